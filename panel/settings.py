@@ -47,7 +47,10 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ssa.roles.RoleContextMiddleware',
+    'ssa.tenancy.CampusMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'ssa.replicas.ReplicaStickinessMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -76,7 +79,7 @@ WSGI_APPLICATION = 'panel.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': os.environ.get('DB_ENGINE', 'django.db.backends.mysql'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASSWORD'),
@@ -85,6 +88,23 @@ DATABASES = {
     }
 }
 
+# Optional read replica for reports, chart APIs and exports. Set
+# DB_REPLICA_HOST (or DB_REPLICA_NAME, e.g. a second SQLite file with
+# DB_ENGINE=django.db.backends.sqlite3 for local testing) to enable it.
+if os.environ.get('DB_REPLICA_HOST') or os.environ.get('DB_REPLICA_NAME'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': os.environ.get('DB_REPLICA_HOST', DATABASES['default']['HOST']),
+        'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['ssa.replicas.ReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they make a change
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,7 +142,74 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Outbound notification delivery (see ssa/delivery.py). SMS goes through
+# the HTTP gateway below, and sending refuses to start until its URL is
+# set; development and tests can use SMS_DELIVERY_BACKEND=
+# ssa.delivery.LocalGateway, which keeps messages in memory.
+DELIVERY_BACKENDS = {
+    'sms': os.environ.get('SMS_DELIVERY_BACKEND', 'ssa.delivery.HttpSmsGateway'),
+    'email': os.environ.get('EMAIL_DELIVERY_BACKEND', 'ssa.delivery.EmailGateway'),
+}
+DELIVERY_CONCURRENCY = {'sms': 4, 'email': 2}
+SMS_GATEWAY = {
+    'URL': os.environ.get('SMS_GATEWAY_URL', ''),
+    'API_KEY': os.environ.get('SMS_GATEWAY_API_KEY', ''),
+    'SENDER': os.environ.get('SMS_GATEWAY_SENDER', ''),
+    'TIMEOUT': 30,
+}
+
+# Per-user throttling of reports, chart APIs and exports (see
+# ssa/throttling.py): endpoint class -> (bucket capacity, tokens refilled
+# per second), and the tokens one request of each class costs
+THROTTLE_BUCKETS = {
+    'stats': (60, 1.0),
+    'reports': (30, 0.5),
+    'exports': (30, 0.25),
+}
+THROTTLE_COSTS = {'stats': 1, 'reports': 3, 'exports': 10}
+
+# Rendered receipts and fee statements (content-addressed, safe to delete)
+DOCUMENT_CACHE_DIR = Path(os.environ.get('DOCUMENT_CACHE_DIR', BASE_DIR / 'document_cache'))
+
+# CSV exports written by background jobs, kept for a day (see ssa/exports.py)
+EXPORT_DIR = Path(os.environ.get('EXPORT_DIR', BASE_DIR / 'exports'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Performance profile
+# Select with PANEL_PROFILE=performance. Keeps DB connections open between
+# requests, serves sessions from the cache and caches compiled templates.
+
+PANEL_PROFILE = os.environ.get('PANEL_PROFILE', 'default')
+
+if PANEL_PROFILE == 'performance':
+    for database in DATABASES.values():
+        database['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+        database['CONN_HEALTH_CHECKS'] = True
+
+    if os.environ.get('REDIS_URL'):
+        CACHES = {
+            'default': {
+                'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                'LOCATION': os.environ['REDIS_URL'],
+            }
+        }
+
+    # 'cached_db' reads sessions from the cache and falls back to the DB;
+    # 'signed_cookies' keeps them entirely client-side
+    SESSION_ENGINE = {
+        'cached_db': 'django.contrib.sessions.backends.cached_db',
+        'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    }[os.environ.get('SESSION_BACKEND', 'cached_db')]
+
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
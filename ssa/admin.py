@@ -1,3 +1,357 @@
-from django.contrib import admin
+# admin.py
+# Admin registrations sized for large tables: related columns come from
+# list_select_related, foreign keys use raw id / autocomplete pickers
+# instead of full <select> lists, search uses exact or prefix lookups on
+# indexed columns, and changelists skip the exact COUNT(*) (see
+# paginators.py). Bulk actions are single set-based statements.
+from django.contrib import admin, messages
+from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
 
-# Register your models here.
+from . import changelog, closeout, dedup, jobs, receipts, versioning
+from .models import *
+from .paginators import EstimatedCountPaginator
+from .utils import update_rows
+
+OPEN_STATUSES = ['pending', 'partial', 'overdue']
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class ReadOnlyAdmin(LargeTableAdmin):
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(Campus)
+class CampusAdmin(admin.ModelAdmin):
+    list_display = ('code', 'name')
+    search_fields = ('^code', '^name')
+
+
+@admin.register(CustomUser)
+class CustomUserAdmin(UserAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_display = ('username', 'first_name', 'last_name', 'user_type', 'campus', 'is_active')
+    list_select_related = ('campus',)
+    list_filter = ('user_type', 'campus', 'is_active', 'is_staff')
+    search_fields = ('^username', '^last_name', '^first_name')
+    autocomplete_fields = ('campus',)
+    fieldsets = UserAdmin.fieldsets + (
+        ('School', {'fields': ('user_type', 'campus', 'phone', 'address')}),
+    )
+    add_fieldsets = UserAdmin.add_fieldsets + (
+        ('School', {'fields': ('user_type', 'campus', 'first_name', 'last_name')}),
+    )
+
+
+@admin.register(SchoolClass)
+class SchoolClassAdmin(admin.ModelAdmin):
+    list_display = ('name', 'section', 'campus', 'capacity', 'enrolled_count')
+    list_select_related = ('campus',)
+    search_fields = ('^name',)
+    readonly_fields = ('enrolled_count',)
+    autocomplete_fields = ('campus',)
+
+
+@admin.register(Subject)
+class SubjectAdmin(admin.ModelAdmin):
+    list_display = ('code', 'name')
+    search_fields = ('=code', '^name')
+
+
+@admin.register(Teacher)
+class TeacherAdmin(LargeTableAdmin):
+    list_display = ('employee_id', 'teacher_name', 'qualification', 'hire_date')
+    list_select_related = ('user',)
+    search_fields = ('=employee_id', '^user__last_name', '^user__first_name')
+    raw_id_fields = ('user',)
+    filter_horizontal = ('subjects', 'classes')
+
+    @admin.display(description='Name', ordering='user__last_name')
+    def teacher_name(self, obj):
+        return obj.user.get_full_name()
+
+
+@admin.register(Student)
+class StudentAdmin(LargeTableAdmin):
+    list_display = ('student_id', 'student_name', 'school_class', 'parent_name', 'parent_phone', 'enrollment_date')
+    list_select_related = ('user', 'school_class')
+    list_filter = ('is_transport_user', 'is_food_service_user')
+    search_fields = ('=student_id', '^user__last_name', '^user__first_name', '=parent_phone')
+    raw_id_fields = ('user',)
+    autocomplete_fields = ('school_class',)
+    actions = ['merge_duplicates']
+
+    @admin.display(description='Name', ordering='user__last_name')
+    def student_name(self, obj):
+        return obj.user.get_full_name()
+
+    @admin.action(description="Merge selected students into the earliest enrolled")
+    def merge_duplicates(self, request, queryset):
+        students = list(queryset.select_related('user').order_by('enrollment_date', 'id'))
+        if len(students) < 2:
+            self.message_user(request, "Select at least two records of the same student.", messages.WARNING)
+            return
+        keep = students[0]
+        with transaction.atomic():
+            for duplicate in students[1:]:
+                dedup.merge(keep, duplicate)
+        self.message_user(request, f"Merged {len(students) - 1} record(s) into {keep}.", messages.SUCCESS)
+
+
+@admin.register(FeeStructure)
+class FeeStructureAdmin(admin.ModelAdmin):
+    list_display = ('school_class', 'fee_type', 'amount', 'academic_year', 'is_mandatory')
+    list_select_related = ('school_class',)
+    list_filter = ('academic_year', 'fee_type')
+    search_fields = ('^school_class__name', '=academic_year')
+    autocomplete_fields = ('school_class',)
+
+
+@admin.register(FeeCollection)
+class FeeCollectionAdmin(LargeTableAdmin):
+    list_display = (
+        'id', 'student', 'fee_type', 'amount_due', 'amount_paid',
+        'payment_status', 'due_date', 'receipt_number',
+    )
+    list_select_related = ('student__user', 'fee_structure')
+    list_filter = ('payment_status', 'payment_method')
+    search_fields = ('=receipt_number', '=student__student_id', '^student__user__last_name')
+    raw_id_fields = ('student', 'collected_by')
+    autocomplete_fields = ('fee_structure',)
+    actions = ['mark_paid', 'send_reminder']
+
+    @admin.display(description='Fee', ordering='fee_structure__fee_type')
+    def fee_type(self, obj):
+        return f"{obj.fee_structure.get_fee_type_display()} ({obj.fee_structure.academic_year})"
+
+    @admin.action(description="Mark selected fees as fully paid")
+    def mark_paid(self, request, queryset):
+        now = timezone.now()
+        open_fees = queryset.filter(payment_status__in=OPEN_STATUSES)
+        if closeout.covers_any(open_fees, timezone.localdate(now)):
+            self.message_user(request, "Today's payments are closed out.", messages.ERROR)
+            return
+        with transaction.atomic():
+            ids = list(open_fees.select_for_update().values_list('id', flat=True))
+            missing = list(open_fees.filter(Q(receipt_number__isnull=True) | Q(receipt_number='')).values_list('id', flat=True))
+            updated = open_fees.update(
+                amount_paid=F('amount_due'),
+                payment_status='paid',
+                payment_date=now,
+                collected_by=request.user,
+                updated_at=now,
+            )
+            if missing:
+                numbers = receipts.get_allocator(receipts.FEE_SERIES).take(len(missing))
+                update_rows(FeeCollection, [
+                    {'receipt_number': number, 'id': collection_id}
+                    for collection_id, number in zip(missing, numbers)
+                ])
+            changelog.record(FeeCollection, ids)
+            versioning.touch('fees')
+        self.message_user(request, f"{updated} fee(s) marked as paid.", messages.SUCCESS)
+
+    @admin.action(description="Send fee reminder to the students")
+    def send_reminder(self, request, queryset):
+        # Built and sent by a background job (delivery.create_fee_reminders)
+        fee_ids = list(queryset.filter(payment_status__in=OPEN_STATUSES).values_list('id', flat=True))
+        if not fee_ids:
+            self.message_user(request, "None of the selected fees is open.", messages.WARNING)
+            return
+        job = jobs.enqueue('send_fee_reminders', created_by=request.user, fee_ids=fee_ids)
+        self.message_user(request, f"Fee reminders queued (job #{job.id}).", messages.SUCCESS)
+
+
+@admin.register(TransportRoute)
+class TransportRouteAdmin(admin.ModelAdmin):
+    list_display = ('route_name', 'vehicle_number', 'driver_name', 'capacity', 'monthly_fee')
+    search_fields = ('^route_name', '=vehicle_number')
+
+
+@admin.register(TransportAssignment)
+class TransportAssignmentAdmin(LargeTableAdmin):
+    list_display = ('student', 'route', 'pickup_point', 'start_date', 'is_active')
+    list_select_related = ('student__user', 'route')
+    list_filter = ('is_active',)
+    search_fields = ('=student__student_id',)
+    raw_id_fields = ('student',)
+    autocomplete_fields = ('route',)
+
+
+@admin.register(FoodService)
+class FoodServiceAdmin(admin.ModelAdmin):
+    list_display = ('meal_type', 'daily_rate', 'monthly_rate', 'is_active')
+    list_filter = ('is_active',)
+    search_fields = ('meal_type',)
+
+
+@admin.register(FoodServiceSubscription)
+class FoodServiceSubscriptionAdmin(LargeTableAdmin):
+    list_display = ('student', 'food_service', 'start_date', 'end_date', 'is_active')
+    list_select_related = ('student__user', 'food_service')
+    list_filter = ('is_active',)
+    search_fields = ('=student__student_id',)
+    raw_id_fields = ('student',)
+    autocomplete_fields = ('food_service',)
+
+
+@admin.register(Expense)
+class ExpenseAdmin(LargeTableAdmin):
+    list_display = ('date', 'category', 'description', 'amount', 'vendor', 'receipt_number')
+    list_filter = ('category',)
+    search_fields = ('=receipt_number', '^vendor')
+    raw_id_fields = ('recorded_by', 'teacher', 'payroll_run')
+    autocomplete_fields = ('route', 'food_service')
+
+
+@admin.register(StudentDataChange)
+class StudentDataChangeAdmin(LargeTableAdmin):
+    list_display = ('timestamp', 'student', 'field_name', 'changed_by', 'change_type')
+    list_select_related = ('student__user', 'changed_by__user')
+    list_filter = ('change_type',)
+    search_fields = ('=student__student_id',)
+    raw_id_fields = ('student', 'changed_by')
+
+
+@admin.register(Notification)
+class NotificationAdmin(LargeTableAdmin):
+    list_display = ('created_at', 'title', 'notification_type', 'recipient', 'is_read')
+    list_select_related = ('recipient',)
+    list_filter = ('notification_type', 'is_read')
+    search_fields = ('=recipient__username', '=related_student__student_id')
+    raw_id_fields = ('recipient', 'sender', 'related_student')
+    actions = ['mark_read']
+
+    @admin.action(description="Mark selected notifications as read")
+    def mark_read(self, request, queryset):
+        updated = queryset.filter(is_read=False).update(is_read=True)
+        self.message_user(request, f"{updated} notification(s) marked as read.", messages.SUCCESS)
+
+
+@admin.register(AcademicYear)
+class AcademicYearAdmin(admin.ModelAdmin):
+    list_display = ('year', 'start_date', 'end_date', 'is_current')
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('id', 'task', 'status', 'progress', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'task')
+    raw_id_fields = ('created_by',)
+    actions = ['retry']
+
+    @admin.action(description="Retry selected failed jobs")
+    def retry(self, request, queryset):
+        updated = queryset.filter(status='failed').update(
+            status='queued', attempts=0, run_after=timezone.now(), error='', worker='',
+        )
+        self.message_user(request, f"{updated} job(s) queued again.", messages.SUCCESS)
+
+
+@admin.register(ArchivedFeeCollection)
+class ArchivedFeeCollectionAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'student_id', 'amount_due', 'amount_paid', 'payment_status', 'payment_date', 'receipt_number')
+    list_filter = ('payment_status',)
+    search_fields = ('=receipt_number', '=student__student_id')
+
+
+@admin.register(ArchivedNotification)
+class ArchivedNotificationAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'created_at', 'title', 'notification_type', 'recipient_id')
+    list_filter = ('notification_type',)
+
+
+@admin.register(ArchivedStudentDataChange)
+class ArchivedStudentDataChangeAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'timestamp', 'student_id', 'field_name', 'change_type')
+    list_filter = ('change_type',)
+
+
+@admin.register(Delivery)
+class DeliveryAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'channel', 'address', 'recipient', 'status', 'attempts', 'created_at', 'sent_at')
+    list_select_related = ('recipient',)
+    list_filter = ('status', 'channel')
+    search_fields = ('=address', '=recipient__username')
+    actions = ['retry']
+
+    @admin.action(description="Retry selected failed deliveries")
+    def retry(self, request, queryset):
+        updated = queryset.filter(status='failed').update(
+            status='pending', attempts=0, next_attempt_at=timezone.now(), error='',
+        )
+        self.message_user(request, f"{updated} deliveries queued again.", messages.SUCCESS)
+
+
+@admin.register(DataVersion)
+class DataVersionAdmin(ReadOnlyAdmin):
+    list_display = ('domain', 'updated_at')
+
+
+@admin.register(PayrollRun)
+class PayrollRunAdmin(ReadOnlyAdmin):
+    list_display = ('month', 'teachers_paid', 'teachers_skipped', 'total_amount', 'run_by', 'created_at')
+    list_select_related = ('run_by',)
+    raw_id_fields = ('run_by',)
+
+
+class PeriodSnapshotInline(admin.TabularInline):
+    model = PeriodSnapshot
+    fields = ('section', 'item', 'amount')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ClosedPeriod)
+class ClosedPeriodAdmin(ReadOnlyAdmin):
+    list_display = ('month', 'campus', 'closed_by', 'closed_at')
+    list_select_related = ('campus', 'closed_by')
+    list_filter = ('campus',)
+    inlines = [PeriodSnapshotInline]
+
+    def has_delete_permission(self, request, obj=None):
+        # Reopen with `manage.py close_periods --reopen`
+        return False
+
+
+class CloseOutLineInline(admin.TabularInline):
+    model = CloseOutLine
+    fields = ('collected_by', 'payment_method', 'payments', 'amount')
+    readonly_fields = fields
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(CashierCloseOut)
+class CashierCloseOutAdmin(ReadOnlyAdmin):
+    list_display = ('day', 'campus', 'payments', 'total_amount', 'cash_expected', 'cash_counted', 'signed_off_by')
+    list_select_related = ('campus', 'signed_off_by')
+    list_filter = ('campus',)
+    inlines = [CloseOutLineInline]
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ReceiptSequence)
+class ReceiptSequenceAdmin(ReadOnlyAdmin):
+    list_display = ('series', 'year', 'next_value')
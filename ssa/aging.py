@@ -0,0 +1,124 @@
+# aging.py
+# Receivables aging. The outstanding balance (amount_due - amount_paid) of
+# every open fee is bucketed by days past its due date, per class and fee
+# type, in one aggregate query: each bucket is a SUM over a CASE on
+# due_date, with the bucket boundaries turned into dates up front so the
+# (campus, payment_status, due_date) index serves the scan. Drill-down
+# lists are keyset-paginated on (due_date, id), so deep pages cost the same
+# as the first. The dashboard summary is cached per campus, day and fees
+# data version.
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from . import tenancy, versioning
+from .models import FeeCollection
+
+OPEN_STATUSES = ['pending', 'partial', 'overdue']
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+CACHE_TIMEOUT = 60 * 60
+
+# Bucket -> (label, fewest days past due, most days past due)
+BUCKETS = {
+    'not_due': ("Not yet due", None, -1),
+    'days_0_30': ("0-30 days", 0, 30),
+    'days_31_60': ("31-60 days", 31, 60),
+    'days_61_90': ("61-90 days", 61, 90),
+    'days_over_90': ("Over 90 days", 91, None),
+}
+
+
+def bucket_condition(bucket, as_of):
+    # Q on due_date selecting the bucket's fees on day `as_of`
+    label, fewest, most = BUCKETS[bucket]
+    condition = Q()
+    if fewest is not None:
+        condition &= Q(due_date__lte=as_of - timedelta(days=fewest))
+    if most is not None:
+        condition &= Q(due_date__gte=as_of - timedelta(days=most))
+    return condition
+
+
+def open_fees():
+    return FeeCollection.objects.filter(payment_status__in=OPEN_STATUSES)
+
+
+def _balance():
+    return F('amount_due') - F('amount_paid')
+
+
+def aging_report(as_of=None):
+    """
+    Outstanding balances per class and fee type, bucketed by days past due
+    on `as_of` (by default today). Returns {'rows': [...], 'totals': {...}};
+    each row has the class, fee type, one amount per bucket and its total.
+    """
+    as_of = as_of or timezone.localdate()
+    rows = list(open_fees().values(
+        'student__school_class_id', 'student__school_class__name', 'student__school_class__section',
+        'fee_structure__fee_type',
+    ).annotate(**{
+        bucket: Sum(Case(
+            When(bucket_condition(bucket, as_of), then=_balance()),
+            default=Value(0), output_field=MONEY,
+        ))
+        for bucket in BUCKETS
+    }).order_by('student__school_class__name', 'student__school_class__section', 'fee_structure__fee_type'))
+
+    totals = dict.fromkeys([*BUCKETS, 'total'], Decimal('0.00'))
+    for row in rows:
+        row['total'] = sum(row[bucket] or 0 for bucket in BUCKETS)
+        for bucket in [*BUCKETS, 'total']:
+            totals[bucket] += row[bucket] or 0
+    return {'as_of': as_of, 'rows': rows, 'totals': totals}
+
+
+def cached_summary():
+    # Bucket totals for the dashboard; the buckets move with the date, so
+    # the day is part of the key
+    as_of = timezone.localdate()
+    stamp, = versioning.versions('fees')
+    key = f'ssa:aging:{tenancy.cache_suffix()}:{as_of}:{stamp.timestamp()}'
+    summary = cache.get(key)
+    if summary is None:
+        summary = aging_report(as_of)['totals']
+        cache.set(key, summary, CACHE_TIMEOUT)
+    return summary
+
+
+def encode_cursor(collection):
+    return f'{collection.due_date.isoformat()}_{collection.id}'
+
+
+def decode_cursor(cursor):
+    # (due_date, id) of the last row of the previous page; ValueError if
+    # malformed
+    due_date, collection_id = cursor.split('_')
+    return date.fromisoformat(due_date), int(collection_id)
+
+
+def aging_detail(bucket, as_of=None, class_id=None, fee_type=None, after=None, limit=50):
+    """
+    One page of the open fees in `bucket`, oldest due first. `after` is
+    the cursor of the previous page. Returns (fees, next_cursor), with
+    next_cursor None on the last page.
+    """
+    as_of = as_of or timezone.localdate()
+    fees = open_fees().filter(bucket_condition(bucket, as_of)).select_related(
+        'student__user', 'student__school_class', 'fee_structure',
+    ).annotate(balance=_balance())
+    if class_id:
+        fees = fees.filter(student__school_class_id=class_id)
+    if fee_type:
+        fees = fees.filter(fee_structure__fee_type=fee_type)
+    if after:
+        due_date, collection_id = decode_cursor(after)
+        fees = fees.filter(Q(due_date__gt=due_date) | Q(due_date=due_date, id__gt=collection_id))
+
+    page = list(fees.order_by('due_date', 'id')[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
@@ -0,0 +1,246 @@
+# analytics.py
+# Monthly profitability of transport routes and food services.
+#
+# Revenue is what was billed and collected against each month's transport
+# and food fees (by due date), per service line: the route the student was
+# assigned to that month, or the food service they subscribed to. A fee
+# covering several assignments / subscriptions is split between them (food
+# by their monthly rates). One query over the live and archived fees
+# (UNION ALL) does the split with a window over each fee, groups per line
+# and month, and adds the window columns: the previous month's collections
+# (LAG), the running total per line and the month's headcount.
+#
+# Costs are the fuel / transport_cost / food_cost expenses. Expenses tagged
+# with a route or food service are that line's direct cost; untagged ones
+# are shared out over the month's lines by headcount.
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import DecimalField, F, FilteredRelation, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.db.models.lookups import Exact
+
+from . import archive, tenancy, versioning
+from .models import ArchivedFeeCollection, Expense, FeeCollection, FoodService, TransportRoute
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+CENT = Decimal('0.01')
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# Relation from Student to the service's assignments, the line field on
+# it, and how much of a fee each covering row takes
+SERVICE_LINES = {
+    'transport': ('student__transportassignment', 'route_id', Value(1, output_field=IntegerField())),
+    'food': (
+        'student__foodservicesubscription', 'food_service_id',
+        Coalesce('covering__food_service__monthly_rate', Value(0), output_field=MONEY),
+    ),
+}
+# Expense categories and the field tagging an expense with a line
+SERVICE_COSTS = {
+    'transport': (['fuel', 'transport_cost'], 'route_id'),
+    'food': (['food_cost'], 'food_service_id'),
+}
+
+
+def _covers_month(relation, day):
+    # The assignment / subscription overlaps the month of `day`. Plain date
+    # comparisons decide most rows; the month truncation only runs for
+    # starts and ends within the month itself.
+    month = TruncMonth(day)
+    start, end = f'{relation}__start_date', f'{relation}__end_date'
+    return (
+        (Q(**{f'{start}__lte': F(day)}) | Q(Exact(TruncMonth(start), month)))
+        & (Q(**{f'{end}__isnull': True}) | Q(**{f'{end}__gte': F(day)}) | Q(Exact(TruncMonth(end), month)))
+    )
+
+
+def _fee_facts(source, service, start, end):
+    """
+    One row per fee and covering assignment / subscription in the fee's
+    month: (fee, line, month, student_id, billed, collected, weight).
+    Fees with nothing covering them get a single row with line NULL.
+    """
+    relation, line_field, weight = SERVICE_LINES[service]
+    month = TruncMonth('due_date')
+    return source.filter(fee_structure__fee_type=service, due_date__range=[start, end]).annotate(
+        covering=FilteredRelation(relation, condition=_covers_month(relation, 'due_date')),
+    ).values(
+        'student_id',
+        fee=F('id'),
+        line=F(f'covering__{line_field}'),
+        month=month,
+        billed=F('amount_due'),
+        collected=F('amount_paid'),
+        weight=weight,
+    ).order_by()
+
+
+def _windowed_facts(fact_queries):
+    """
+    Run the fact queries as one UNION ALL, split each fee over its rows by
+    weight, and group per line and month with the window columns. Returns
+    rows of (line, month, billed, collected, students, previous_collected,
+    running_collected, month_students), ordered by line and month.
+    """
+    parts, params = [], []
+    for queryset in fact_queries:
+        sql, query_params = queryset.query.sql_with_params()
+        parts.append(sql)
+        params.extend(query_params)
+    fee, line, month, student, billed, collected, weight = (
+        connection.ops.quote_name(name)
+        for name in ('fee', 'line', 'month', 'student_id', 'billed', 'collected', 'weight')
+    )
+    # 1.0 * keeps SQLite from integer division; a fee whose rows all weigh
+    # nothing is split evenly
+    share = (
+        f"COALESCE(1.0 * {weight} / NULLIF(SUM({weight}) OVER (PARTITION BY {fee}), 0), "
+        f"1.0 / COUNT(*) OVER (PARTITION BY {fee}))"
+    )
+    sql = f"""
+        SELECT {line}, {month}, SUM({billed}), SUM({collected}), COUNT(DISTINCT {student}),
+            LAG(SUM({collected})) OVER (PARTITION BY {line} ORDER BY {month}),
+            SUM(SUM({collected})) OVER (PARTITION BY {line} ORDER BY {month}),
+            SUM(COUNT(DISTINCT {student})) OVER (PARTITION BY {month})
+        FROM (
+            SELECT {line}, {month}, {student}, {billed} * {share} AS {billed}, {collected} * {share} AS {collected}
+            FROM ({' UNION ALL '.join(parts)}) facts
+        ) shares
+        GROUP BY {line}, {month}
+        ORDER BY {line}, {month}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def _money(value):
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(CENT)
+
+
+def _month(value):
+    # Raw cursors return the truncated month as a date, datetime or string
+    # depending on the backend
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _costs(service, start, end):
+    # {(line, month): direct cost} and {month: shared cost}
+    categories, line_field = SERVICE_COSTS[service]
+    rows = Expense.objects.filter(category__in=categories, date__range=[start, end]).annotate(
+        line=F(line_field), month=TruncMonth('date'),
+    ).values('line', 'month').annotate(total=Sum('amount')).order_by()
+    direct, shared = {}, {}
+    for row in rows:
+        if row['line'] is None:
+            shared[row['month']] = row['total']
+        else:
+            direct[(row['line'], row['month'])] = row['total']
+    return direct, shared
+
+
+def service_profitability(service, start, end):
+    """
+    Per line and month of `service` ('transport' or 'food') for fees due
+    and expenses dated from `start` to `end`:
+
+        {'rows': [{'line', 'line_name', 'month', 'billed', 'collected', 'students',
+                   'previous_collected', 'collected_change', 'running_collected',
+                   'direct_cost', 'shared_cost', 'cost', 'margin', 'margin_change',
+                   'cost_per_student'}, ...],
+         'unallocated_cost': shared cost of months without students}
+
+    line None is revenue that could not be tied to a route / food service.
+    Changes are against the line's previous month in the range.
+    """
+    sources = [FeeCollection.objects]
+    if archive.range_needs_archive(start):
+        sources.append(ArchivedFeeCollection.objects)
+    fact_queries = [_fee_facts(source, service, start, end) for source in sources]
+
+    direct, shared = _costs(service, start, end)
+    rows = []
+    seen = set()
+    for line, month, billed, collected, students, previous, running, month_students in _windowed_facts(fact_queries):
+        month = _month(month)
+        seen.add((line, month))
+        rows.append({
+            'line': line,
+            'month': month,
+            'billed': _money(billed),
+            'collected': _money(collected),
+            'students': int(students),
+            'previous_collected': _money(previous),
+            'running_collected': _money(running),
+            'month_students': int(month_students),
+        })
+
+    # Direct costs of lines that had no fees that month still need a row
+    for line, month in sorted(set(direct) - seen):
+        rows.append({
+            'line': line, 'month': month, 'billed': Decimal('0.00'), 'collected': Decimal('0.00'),
+            'students': 0, 'previous_collected': None, 'running_collected': None, 'month_students': 0,
+        })
+    rows.sort(key=lambda row: (row['line'] is not None, row['line'] or 0, row['month']))
+
+    allocated = set()
+    previous_margin = {}
+    for row in rows:
+        line, month = row['line'], row['month']
+        month_students = row.pop('month_students')
+        shared_cost = Decimal('0.00')
+        if month in shared and row['students']:
+            shared_cost = _money(shared[month] * row['students'] / month_students)
+            allocated.add(month)
+        direct_cost = _money(direct.get((line, month)) or 0)
+        cost = direct_cost + shared_cost
+        margin = row['collected'] - cost
+        row.update({
+            'collected_change': (
+                row['collected'] - row['previous_collected'] if row['previous_collected'] is not None else None
+            ),
+            'direct_cost': direct_cost,
+            'shared_cost': shared_cost,
+            'cost': cost,
+            'margin': margin,
+            'margin_change': margin - previous_margin[line] if line in previous_margin else None,
+            'cost_per_student': _money(cost / row['students']) if row['students'] else None,
+        })
+        previous_margin[line] = margin
+
+    if service == 'transport':
+        names = dict(TransportRoute.objects.values_list('id', 'route_name'))
+    else:
+        meal_types = dict(FoodService.MEAL_TYPES)
+        names = {
+            service_id: meal_types.get(meal_type, meal_type)
+            for service_id, meal_type in FoodService.objects.values_list('id', 'meal_type')
+        }
+    for row in rows:
+        row['line_name'] = names.get(row['line'], f"#{row['line']}") if row['line'] is not None else "Unassigned"
+    unallocated = sum((total for month, total in shared.items() if month not in allocated), Decimal(0))
+
+    return {'rows': rows, 'unallocated_cost': _money(unallocated)}
+
+
+def cached_service_profitability(service, start, end):
+    # Cached per campus and data version, so any fee, expense or service
+    # change in the campus recomputes it on the next request
+    stamps = versioning.versions('fees', 'expenses', 'services')
+    key = f"ssa:analytics:{tenancy.cache_suffix()}:{service}:{start}:{end}:" + ':'.join(
+        str(stamp.timestamp()) for stamp in stamps
+    )
+    result = cache.get(key)
+    if result is None:
+        result = service_profitability(service, start, end)
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SsaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ssa'
+
+    def ready(self):
+        # Register background job tasks and model signal handlers
+        from . import signals, tasks  # noqa: F401
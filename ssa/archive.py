@@ -0,0 +1,131 @@
+# archive.py
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import periods, tenancy, versioning
+from .models import (
+    AcademicYear, ArchivedFeeCollection, ArchivedNotification, ArchivedStudentDataChange,
+    FeeCollection, Notification, StudentDataChange,
+)
+
+ARCHIVE_STATE_CACHE_KEY = 'ssa:archive:fee_state'
+ARCHIVE_STATE_TIMEOUT = 24 * 60 * 60
+
+
+def closed_academic_years():
+    # Years that have ended and are not the current year
+    return list(AcademicYear.objects.filter(
+        end_date__lt=timezone.localdate(), is_current=False
+    ).values_list('year', flat=True))
+
+
+def archivable_fee_collections():
+    # Only fully paid rows: unpaid fees of a closed year are still receivables
+    return FeeCollection.objects.filter(
+        fee_structure__academic_year__in=closed_academic_years(),
+        payment_status='paid',
+    )
+
+
+def archivable_notifications(older_than_days):
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return Notification.objects.filter(is_read=True, created_at__lt=cutoff)
+
+
+def archivable_data_changes(older_than_days):
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return StudentDataChange.objects.filter(timestamp__lt=cutoff)
+
+
+def move_in_batches(queryset, archive_model, batch_size=1000, pause=0.0, progress=None):
+    """
+    Copy rows from `queryset` into `archive_model` and delete them, one
+    batch per transaction, sleeping `pause` seconds between batches so the
+    live tables are never locked for long. Returns the number of rows moved.
+    """
+    model = queryset.model
+    fields = [field.attname for field in model._meta.concrete_fields]
+    moved = 0
+
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+
+        with transaction.atomic(), periods.archiving():
+            rows = model.objects.filter(pk__in=ids).values(*fields)
+            archive_model.objects.bulk_create(
+                [archive_model(**row) for row in rows],
+                ignore_conflicts=True,
+            )
+            model.objects.filter(pk__in=ids).delete()
+
+        moved += len(ids)
+        if progress:
+            progress(moved)
+        if pause:
+            time.sleep(pause)
+
+    if archive_model is ArchivedFeeCollection and moved:
+        versioning.touch('fees', 'archive')
+    return moved
+
+
+def archived_fee_state():
+    """
+    Latest archived payment date and lifetime totals of the archive, for
+    the current campus. The archive only changes when archiving runs, which
+    bumps the 'archive' data version, so the state is cached per version:
+    every process sees a run as soon as it has committed.
+    """
+    stamp, = versioning.versions('archive')
+    key = f'{ARCHIVE_STATE_CACHE_KEY}:{tenancy.cache_suffix()}:{stamp.timestamp()}'
+    state = cache.get(key)
+    if state is None:
+        paid = Q(payment_status='paid')
+        state = ArchivedFeeCollection.objects.aggregate(
+            latest_payment=Max('payment_date'),
+            count=Count('id'),
+            total_due=Sum('amount_due'),
+            total_collected=Sum('amount_paid'),
+            transport_revenue=Sum('amount_paid', filter=paid & Q(fee_structure__fee_type='transport')),
+            food_revenue=Sum('amount_paid', filter=paid & Q(fee_structure__fee_type='food')),
+        )
+        cache.set(key, state, ARCHIVE_STATE_TIMEOUT)
+    return state
+
+
+def range_needs_archive(start_date):
+    latest = archived_fee_state()['latest_payment']
+    return latest is not None and start_date <= latest.date()
+
+
+def paid_sources(start_date):
+    # The fee table, and the archive as well when payments from
+    # `start_date` on reach back into archived history
+    sources = [FeeCollection.objects]
+    if range_needs_archive(start_date):
+        sources.append(ArchivedFeeCollection.objects)
+    return sources
+
+
+def paid_by_fee_type(start_date, end_date):
+    """
+    Paid amounts per fee type for payments in the date range, reading the
+    archive only when the range reaches back into archived history.
+    """
+    totals = {}
+    for source in paid_sources(start_date):
+        rows = source.filter(
+            payment_date__date__range=[start_date, end_date],
+            payment_status='paid',
+        ).values('fee_structure__fee_type').annotate(total=Sum('amount_paid')).order_by()
+        for row in rows:
+            fee_type = row['fee_structure__fee_type']
+            totals[fee_type] = totals.get(fee_type, 0) + (row['total'] or 0)
+    return totals
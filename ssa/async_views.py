@@ -0,0 +1,140 @@
+# async_views.py
+# Async variants of the read-heavy dashboards and chart APIs. Served under
+# ASGI (panel.asgi), the independent aggregate queries of each view run
+# concurrently instead of one after another.
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.shortcuts import render
+
+from . import aging, stats
+from .models import AcademicYear
+from .replicas import replica_reads
+from .throttling import throttle
+from .versioning import conditional_on
+from .views import is_admin
+
+
+def _in_own_connection(func):
+    # Run `func` on a worker thread with its own DB connection, releasing
+    # the connection afterwards according to CONN_MAX_AGE
+    def run():
+        try:
+            return func()
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def gather_queries(*funcs):
+    return await asyncio.gather(*(_in_own_connection(func)() for func in funcs))
+
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@throttle('stats')
+async def dashboard_stats_api(request):
+    total_students, total_teachers, pending_fees, monthly_revenue = await gather_queries(
+        stats.total_students,
+        stats.total_teachers,
+        stats.pending_fees,
+        stats.current_month_revenue,
+    )
+
+    return JsonResponse({
+        'total_students': total_students,
+        'total_teachers': total_teachers,
+        'pending_fees': float(pending_fees),
+        'monthly_revenue': float(monthly_revenue),
+    })
+
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees')
+@throttle('stats')
+async def monthly_revenue_api(request):
+    try:
+        months = max(1, min(int(request.GET.get('months', 12)), 60))
+    except ValueError:
+        return JsonResponse({'error': 'months must be an integer'}, status=400)
+    data, = await gather_queries(lambda: stats.monthly_revenue(months))
+    return JsonResponse({'data': data})
+
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees')
+@throttle('stats')
+async def fee_collection_chart_api(request):
+    data, = await gather_queries(stats.fee_collection_by_status)
+    return JsonResponse({'data': data})
+
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('students')
+@throttle('stats')
+async def student_class_distribution_api(request):
+    data, = await gather_queries(stats.student_class_distribution)
+    return JsonResponse({'data': data})
+
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('expenses')
+@throttle('stats')
+async def expense_category_chart_api(request):
+    data, = await gather_queries(stats.expense_by_category)
+    return JsonResponse({'data': data})
+
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+async def admin_dashboard(request):
+    (
+        total_students, total_teachers, fees, expenses, aging_summary,
+        monthly_collections, recent_enrollments, recent_payments, current_year,
+    ) = await gather_queries(
+        stats.total_students,
+        stats.total_teachers,
+        stats.fee_totals,
+        stats.expense_totals,
+        aging.cached_summary,
+        stats.monthly_revenue,
+        stats.recent_enrollments,
+        stats.recent_payments,
+        AcademicYear.get_current,
+    )
+
+    context = {
+        'total_students': total_students,
+        'total_teachers': total_teachers,
+        'total_fees_due': fees['total_due'],
+        'total_fees_collected': fees['total_collected'],
+        'pending_fees': aging_summary['total'],
+        'aging_summary': aging_summary,
+        'transport_revenue': fees['transport_revenue'],
+        'transport_expenses': expenses['transport'],
+        'food_revenue': fees['food_revenue'],
+        'food_expenses': expenses['food'],
+        'total_expenses': expenses['total'],
+        'net_earnings': fees['total_collected'] - expenses['total'],
+        'recent_enrollments': recent_enrollments,
+        'recent_payments': recent_payments,
+        'monthly_collections': monthly_collections,
+        'current_year': current_year,
+    }
+
+    # Rendering resolves request.user and other lazy objects with queries,
+    # which may not run on the event loop
+    return await sync_to_async(render)(request, 'admin_dashboard.html', context)
@@ -0,0 +1,160 @@
+# billing.py
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, Count, DateField, DecimalField, Exists, ExpressionWrapper, F, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Greatest, Least
+
+from . import changelog, versioning
+from .expressions import DaysBetween
+from .models import FeeCollection, FeeStructure, FoodServiceSubscription
+
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+
+
+def month_bounds(day):
+    # First and last day of the month containing `day`
+    start = day.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+
+def billable_subscriptions(period_start, period_end):
+    """
+    Active food subscriptions overlapping the billing period, annotated with
+    the overlap window, the number of billed days and the prorated charge.
+    A subscription covering the whole period is billed the monthly rate;
+    anything shorter is billed per day, capped at the monthly rate.
+    """
+    period_days = (period_end - period_start).days + 1
+
+    return FoodServiceSubscription.objects.filter(
+        is_active=True,
+        food_service__is_active=True,
+        start_date__lte=period_end,
+        end_date__gte=period_start,
+    ).annotate(
+        overlap_start=Greatest('start_date', Value(period_start, output_field=DateField())),
+        overlap_end=Least('end_date', Value(period_end, output_field=DateField())),
+    ).annotate(
+        billed_days=DaysBetween('overlap_end', 'overlap_start') + 1,
+    ).annotate(
+        charge=Case(
+            When(billed_days__gte=period_days, then=F('food_service__monthly_rate')),
+            default=Least(
+                ExpressionWrapper(F('food_service__daily_rate') * F('billed_days'), output_field=MONEY),
+                F('food_service__monthly_rate'),
+            ),
+            output_field=MONEY,
+        ),
+    )
+
+
+def student_food_charges(period_start, period_end):
+    # One row per student: total prorated charge across all their subscriptions
+    return billable_subscriptions(period_start, period_end).values(
+        'student_id', 'student__school_class_id', 'student__campus_id'
+    ).annotate(
+        total=Sum('charge'),
+    ).order_by('student_id')
+
+
+def generate_food_fee_collections(period_start, period_end, academic_year, due_date=None):
+    """
+    Create one 'food' FeeCollection per subscribed student for the period.
+
+    Students already billed for the same fee structure and due date are
+    skipped, so the run can be repeated safely. Classes without a food
+    FeeStructure for `academic_year` are reported rather than billed.
+    """
+    due_date = due_date or period_start
+
+    with transaction.atomic():
+        # Locking the year's food fee structures serializes concurrent runs,
+        # so the already-billed check sees the fees of any run before
+        structures = dict(
+            FeeStructure.objects.select_for_update().filter(
+                fee_type='food', academic_year=academic_year
+            ).order_by('id').values_list('school_class_id', 'id')
+        )
+        already_billed = set(
+            FeeCollection.objects.filter(
+                fee_structure__fee_type='food',
+                fee_structure__academic_year=academic_year,
+                due_date=due_date,
+            ).values_list('student_id', flat=True)
+        )
+
+        to_create = []
+        missing_structure = set()
+        skipped = 0
+        for row in student_food_charges(period_start, period_end):
+            structure_id = structures.get(row['student__school_class_id'])
+            if structure_id is None:
+                missing_structure.add(row['student__school_class_id'])
+                continue
+            if row['student_id'] in already_billed:
+                skipped += 1
+                continue
+            to_create.append(FeeCollection(
+                campus_id=row['student__campus_id'],
+                student_id=row['student_id'],
+                fee_structure_id=structure_id,
+                amount_due=row['total'],
+                due_date=due_date,
+                notes=f"Food service {period_start:%d %b %Y} - {period_end:%d %b %Y}",
+            ))
+
+        FeeCollection.objects.bulk_create(to_create, batch_size=500)
+        if to_create:
+            changelog.record(FeeCollection, changelog.created_ids(to_create, FeeCollection.objects.filter(
+                fee_structure_id__in=structures.values(), due_date=due_date,
+            ).exclude(student_id__in=already_billed)))
+            versioning.touch('fees')
+
+    return {
+        'created': len(to_create),
+        'skipped': skipped,
+        'missing_structure_class_ids': sorted(missing_structure),
+    }
+
+
+def overlapping_subscriptions():
+    # Active subscriptions that overlap another active subscription of the
+    # same student for the same meal type
+    clash = FoodServiceSubscription.objects.filter(
+        is_active=True,
+        student=OuterRef('student'),
+        food_service__meal_type=OuterRef('food_service__meal_type'),
+        start_date__lte=OuterRef('end_date'),
+        end_date__gte=OuterRef('start_date'),
+    ).exclude(pk=OuterRef('pk'))
+
+    return FoodServiceSubscription.objects.filter(
+        Exists(clash), is_active=True
+    ).select_related('student__user', 'food_service').order_by('student_id', 'start_date')
+
+
+def daily_meal_headcounts(start_date, end_date):
+    """
+    Subscribed headcount per meal type for every day in the range, from a
+    single query grouped by meal type with one conditional count per day.
+    Returns {meal_type: [(date, count), ...]}.
+    """
+    days = [start_date + timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+    per_day = {
+        f'day_{n}': Count('id', filter=Q(start_date__lte=day, end_date__gte=day))
+        for n, day in enumerate(days)
+    }
+
+    rows = FoodServiceSubscription.objects.filter(
+        is_active=True,
+        food_service__is_active=True,
+        start_date__lte=end_date,
+        end_date__gte=start_date,
+    ).values('food_service__meal_type').annotate(**per_day).order_by('food_service__meal_type')
+
+    return {
+        row['food_service__meal_type']: [(day, row[f'day_{n}']) for n, day in enumerate(days)]
+        for row in rows
+    }
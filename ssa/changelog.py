@@ -0,0 +1,145 @@
+# changelog.py
+# Incremental change feed of fee collections and expenses for external
+# accounting. Every create, update and delete appends a ChangeLogEntry in
+# the same transaction as the change: single-row saves and deletes via
+# signals, bulk code paths by calling record() themselves. Consumers page
+# through the log with an opaque cursor and get the current state of each
+# changed row, or a tombstone for deleted ones.
+#
+# Archiving (archive.py) moves closed rows out of the live tables without
+# logging them: they are history, not deletions.
+from datetime import timedelta
+
+from django.core import signing
+from django.utils import timezone
+
+from .models import ChangeLogEntry, Expense, FeeCollection
+
+FEEDS = {
+    'fee_collection': (FeeCollection, (
+        'id', 'student_id', 'student__student_id', 'fee_structure_id', 'fee_structure__fee_type',
+        'fee_structure__academic_year', 'amount_due', 'amount_paid', 'payment_status', 'payment_method',
+        'payment_date', 'due_date', 'receipt_number', 'notes', 'created_at', 'updated_at',
+    )),
+    'expense': (Expense, (
+        'id', 'category', 'description', 'amount', 'date', 'receipt_number', 'vendor',
+        'route_id', 'food_service_id', 'teacher_id', 'payroll_month', 'created_at', 'updated_at',
+    )),
+}
+FEED_NAMES = {model: name for name, (model, fields) in FEEDS.items()}
+
+CURSOR_SALT = 'ssa.changelog.cursor'
+MAX_PAGE_SIZE = 1000
+# Entries younger than this are held back. IDs are allocated at insert
+# but become visible at commit, so a slow transaction could otherwise
+# commit an entry below a cursor that was already handed out.
+SETTLE_DELAY = timedelta(seconds=30)
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def record(model, ids, action='upsert'):
+    # Call inside the transaction that made the change
+    feed = FEED_NAMES[model]
+    now = timezone.now()
+    ChangeLogEntry.objects.bulk_create(
+        [ChangeLogEntry(model=feed, object_id=object_id, action=action, created_at=now) for object_id in ids],
+        batch_size=1000,
+    )
+
+
+def created_ids(objs, queryset):
+    # bulk_create only fills in primary keys on backends that return them
+    # (not MySQL); otherwise read them back with `queryset`
+    if objs and all(obj.pk is not None for obj in objs):
+        return [obj.pk for obj in objs]
+    return list(queryset.values_list('pk', flat=True))
+
+
+def encode_cursor(position):
+    return signing.dumps(position, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        position = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor("Malformed cursor")
+    if not isinstance(position, int) or position < 0:
+        raise InvalidCursor("Malformed cursor")
+    return position
+
+
+def head_cursor():
+    # Cursor at the current end of the log, to start from after a full export
+    last = ChangeLogEntry.objects.order_by('-id').values_list('id', flat=True).first()
+    return encode_cursor(last or 0)
+
+
+def changes_since(cursor, limit=500, feeds=None):
+    """
+    Return (changes, next_cursor, has_more) for log entries after `cursor`.
+
+    A row changed several times within the page appears once, at its
+    latest position, with its current data. Deleted rows come back as
+    {'action': 'delete', 'data': None}.
+    """
+    after = decode_cursor(cursor)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    entries = ChangeLogEntry.objects.filter(id__gt=after)
+    if feeds:
+        entries = entries.filter(model__in=feeds)
+    entries = list(entries.order_by('id').values_list('id', 'model', 'object_id', 'action', 'created_at')[:limit + 1])
+
+    # Stop at the first entry that has not settled; everything after it
+    # waits for the next call
+    settled_before = timezone.now() - SETTLE_DELAY
+    for index, entry in enumerate(entries):
+        if entry[4] > settled_before:
+            entries = entries[:index]
+            has_more = False
+            break
+    else:
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        latest[(entry[1], entry[2])] = entry
+
+    rows = {}
+    for feed, (model, fields) in FEEDS.items():
+        ids = [object_id for (name, object_id), entry in latest.items() if name == feed and entry[3] == 'upsert']
+        if ids:
+            rows[feed] = {row['id']: row for row in model.objects.filter(id__in=ids).values(*fields)}
+
+    changes = []
+    for (feed, object_id), (seq, _, _, action, changed_at) in sorted(latest.items(), key=lambda item: item[1][0]):
+        data = None
+        if action == 'upsert':
+            data = rows.get(feed, {}).get(object_id)
+            if data is None:
+                continue  # deleted since; its tombstone is further on
+        changes.append({
+            'seq': seq,
+            'model': feed,
+            'id': object_id,
+            'action': action,
+            'changed_at': changed_at,
+            'data': data,
+        })
+
+    next_position = entries[-1][0] if entries else after
+    return changes, encode_cursor(next_position), has_more
+
+
+def prune(older_than):
+    # Drop entries every consumer has had time to read
+    cutoff = timezone.now() - older_than
+    deleted, _ = ChangeLogEntry.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
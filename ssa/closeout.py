@@ -0,0 +1,156 @@
+# closeout.py
+# Cashier end-of-day close-out. day_totals() sums a day's fee payments per
+# collector and payment method in one grouped query; close_day() stores
+# those totals with the bursar's sign-off and the counted cash, and from
+# then on the day's payments cannot be changed (signals.py) and no new
+# payment can be dated on it. History reads the stored close-outs.
+#
+# A fee row keeps only its latest payment, so a fee paid in instalments
+# counts in full on the day of its last instalment.
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from . import periods
+from .models import CashierCloseOut, CloseOutLine, DayClosedOut, FeeCollection
+from .tenancy import current_campus_id
+
+# Fee fields a close-out vouches for
+GUARDED_FIELDS = ['campus_id', 'amount_paid', 'payment_status', 'payment_method', 'payment_date', 'collected_by_id']
+
+
+def _day_bounds(day):
+    # The day as a half-open range of aware datetimes, so the
+    # (campus, payment_date) index serves the lookup
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def day_payments(day):
+    start, end = _day_bounds(day)
+    return FeeCollection.objects.filter(payment_date__gte=start, payment_date__lt=end, amount_paid__gt=0)
+
+
+def day_totals(day):
+    # [{collected_by, names, payment_method, payments, amount}] for `day`
+    return list(day_payments(day).values(
+        'collected_by', 'collected_by__username', 'collected_by__first_name', 'collected_by__last_name',
+        'payment_method',
+    ).annotate(payments=Count('id'), amount=Sum('amount_paid')).order_by('collected_by__username', 'payment_method'))
+
+
+def close_day(day, signed_off_by, cash_counted=None, notes=''):
+    """
+    Close out `day` for the current campus (outside a campus: for every
+    campus). Raises ValueError if the day is still to come or already
+    closed out.
+    """
+    if day > timezone.localdate():
+        raise ValueError(f"{day:%d %B %Y} is still to come")
+
+    with transaction.atomic():
+        if closed_out(current_campus_id(), day):
+            raise ValueError(f"{day:%d %B %Y} is already closed out")
+        totals = day_totals(day)
+        closeout = CashierCloseOut.objects.create(
+            campus_id=current_campus_id(),
+            day=day,
+            payments=sum(row['payments'] for row in totals),
+            total_amount=sum((row['amount'] for row in totals), Decimal('0.00')),
+            cash_expected=sum((row['amount'] for row in totals if row['payment_method'] == 'cash'), Decimal('0.00')),
+            cash_counted=cash_counted,
+            notes=notes,
+            signed_off_by=signed_off_by,
+        )
+        CloseOutLine.objects.bulk_create([
+            CloseOutLine(
+                closeout=closeout,
+                collected_by_id=row['collected_by'],
+                payment_method=row['payment_method'],
+                payments=row['payments'],
+                amount=row['amount'],
+            )
+            for row in totals
+        ])
+    return closeout
+
+
+def encode_cursor(record):
+    return f'{record.day.isoformat()}_{record.id}'
+
+
+def decode_cursor(cursor):
+    # (day, id) of the last close-out of the previous page; ValueError if
+    # malformed
+    day, record_id = cursor.split('_')
+    return date.fromisoformat(day), int(record_id)
+
+
+def history(after=None, limit=30):
+    """
+    One page of the stored close-outs with their lines, newest first.
+    `after` is the cursor of the previous page. Returns (closeouts,
+    next_cursor), with next_cursor None on the last page.
+    """
+    closeouts = CashierCloseOut.objects.select_related('signed_off_by', 'campus').prefetch_related(
+        'lines__collected_by',
+    )
+    if after:
+        day, record_id = decode_cursor(after)
+        closeouts = closeouts.filter(Q(day__lt=day) | Q(day=day, id__lt=record_id))
+    page = list(closeouts.order_by('-day', '-id')[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
+
+
+def closed_out(campus_id, day):
+    # Close-outs of a campus's day and all-campus ones both cover it
+    return CashierCloseOut._base_manager.filter(
+        Q(campus_id=campus_id) | Q(campus__isnull=True), day=day,
+    ).exists()
+
+
+def covers_any(fees, day):
+    # Whether paying any of the `fees` on `day` would change a close-out,
+    # for bulk updates that bypass the save guard
+    campus_ids = set(CashierCloseOut._base_manager.filter(day=day).values_list('campus_id', flat=True))
+    if not campus_ids:
+        return False
+    return None in campus_ids or fees.filter(campus_id__in=campus_ids).exists()
+
+
+def closed_days_in_scope():
+    # Days closed out for any campus the current campus setting covers
+    closeouts = CashierCloseOut._base_manager.all()
+    campus_id = current_campus_id()
+    if campus_id is not None:
+        closeouts = closeouts.filter(Q(campus_id=campus_id) | Q(campus__isnull=True))
+    return set(closeouts.values_list('day', flat=True))
+
+
+def check_save(instance):
+    # Raise DayClosedOut if saving `instance` changes a closed-out day's
+    # payments
+    new = {field: getattr(instance, field) for field in GUARDED_FIELDS}
+    old = None
+    if instance.pk is not None:
+        old = FeeCollection._base_manager.filter(pk=instance.pk).values(*GUARDED_FIELDS).first()
+    if old == new:
+        return
+    for row in (old, new):
+        if row and row['payment_date']:
+            day = periods.local_day(row['payment_date'])
+            if closed_out(row['campus_id'], day):
+                raise DayClosedOut(day)
+
+
+def check_delete(instance):
+    if periods.moving_to_archive() or instance.payment_date is None:
+        return
+    day = periods.local_day(instance.payment_date)
+    if closed_out(instance.campus_id, day):
+        raise DayClosedOut(day)
@@ -0,0 +1,262 @@
+# dedup.py
+# Duplicate student detection. Every student has blocking keys in
+# StudentMatchKey: the normalized parent phone, the date of birth and a
+# phonetic (Soundex) code of the name. Only students sharing a key are
+# scored against each other, so a full scan costs the size of the blocks
+# rather than every pair on the roster. Keys are refreshed when a student
+# or their user is saved (signals.py) and built in bulk by the importer
+# and `manage.py find_duplicate_students --rebuild`.
+#
+# merge() folds a duplicate into the record to keep, re-pointing every
+# row that references it with one UPDATE per table.
+import re
+from difflib import SequenceMatcher
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from . import changelog, versioning
+from .models import FeeCollection, Student, StudentMatchKey
+from .tenancy import current_campus_id
+from .utils import normalize_phone
+
+THRESHOLD = 0.75
+# Larger blocks are placeholder values (a school phone, 1 January) and
+# say nothing about identity
+MAX_BLOCK_SIZE = 200
+WEIGHTS = {'first_name': 0.3, 'last_name': 0.2, 'phone': 0.25, 'dob': 0.25}
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+    'l': '4', **dict.fromkeys('mn', '5'), 'r': '6',
+}
+
+
+def normalize_name(name):
+    return ' '.join(re.sub(r'[^a-z ]', '', (name or '').lower()).split())
+
+
+def soundex(name):
+    letters = re.sub(r'[^a-z]', '', (name or '').lower())
+    if not letters:
+        return ''
+    code, previous = letters[0].upper(), SOUNDEX_CODES.get(letters[0], '')
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def blocking_keys(first_name, last_name, date_of_birth, parent_phone):
+    keys = []
+    phone = normalize_phone(parent_phone)
+    if phone:
+        keys.append(('phone', phone))
+    if date_of_birth:
+        keys.append(('dob', date_of_birth.isoformat()))
+    name = soundex(first_name) + soundex(last_name)
+    if name:
+        keys.append(('name', name))
+    return keys
+
+
+def _student_keys(student):
+    return blocking_keys(student.user.first_name, student.user.last_name, student.date_of_birth, student.parent_phone)
+
+
+def refresh_keys(students):
+    # Replace the keys of `students` (loaded with their users)
+    students = list(students)
+    with transaction.atomic():
+        StudentMatchKey.objects.filter(student__in=students).delete()
+        StudentMatchKey.objects.bulk_create([
+            StudentMatchKey(student=student, kind=kind, key=key)
+            for student in students
+            for kind, key in _student_keys(student)
+        ], batch_size=1000)
+
+
+def rebuild_keys(batch_size=2000):
+    # Rebuild every student's keys; returns the number of students
+    StudentMatchKey.objects.all().delete()
+    students = Student.objects.select_related('user').order_by('id')
+    last_id, done = 0, 0
+    while True:
+        batch = list(students.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return done
+        refresh_keys(batch)
+        last_id, done = batch[-1].id, done + len(batch)
+
+
+def _similarity(a, b):
+    a, b = normalize_name(a), normalize_name(b)
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def score(a, b):
+    """
+    Likelihood in [0, 1] that two records describe the same child. `a`
+    and `b` are dicts with first_name, last_name, date_of_birth and
+    parent_phone.
+    """
+    total = WEIGHTS['first_name'] * _similarity(a['first_name'], b['first_name'])
+    total += WEIGHTS['last_name'] * _similarity(a['last_name'], b['last_name'])
+    phone = normalize_phone(a['parent_phone'])
+    if phone and phone == normalize_phone(b['parent_phone']):
+        total += WEIGHTS['phone']
+    if a['date_of_birth'] and a['date_of_birth'] == b['date_of_birth']:
+        total += WEIGHTS['dob']
+    return round(total, 3)
+
+
+def _record(student):
+    return {
+        'first_name': student.user.first_name,
+        'last_name': student.user.last_name,
+        'date_of_birth': student.date_of_birth,
+        'parent_phone': student.parent_phone,
+    }
+
+
+def _blocks_query(keys):
+    by_kind = {}
+    for kind, key in keys:
+        by_kind.setdefault(kind, set()).add(key)
+    condition = Q()
+    for kind, values in by_kind.items():
+        condition |= Q(kind=kind, key__in=values)
+    return StudentMatchKey.objects.filter(condition)
+
+
+def _sorted(matches, threshold):
+    return sorted([match for match in matches if match[0] >= threshold], key=lambda match: -match[0])
+
+
+def match_records(records, threshold=THRESHOLD):
+    """
+    Match new records (dicts as for score()) against the roster and each
+    other. Returns (existing, earlier): per record, [(score, student)] for
+    likely duplicates already on the roster and [(score, index)] for
+    likely duplicates among the records before it, best first.
+    """
+    record_keys = [
+        blocking_keys(record['first_name'], record['last_name'], record['date_of_birth'], record['parent_phone'])
+        for record in records
+    ]
+    members = {}
+    all_keys = {key for keys in record_keys for key in keys}
+    if all_keys:
+        for kind, key, student_id in _blocks_query(all_keys).values_list('kind', 'key', 'student_id'):
+            members.setdefault((kind, key), []).append(student_id)
+    candidate_ids = {
+        student_id for block in members.values() if len(block) <= MAX_BLOCK_SIZE for student_id in block
+    }
+    students = Student.objects.select_related('user', 'school_class').in_bulk(candidate_ids)
+    known = {student_id: _record(student) for student_id, student in students.items()}
+
+    existing, earlier, seen = [], [], {}
+    for index, (record, keys) in enumerate(zip(records, record_keys)):
+        ids = {
+            student_id for key in keys if len(members.get(key, ())) <= MAX_BLOCK_SIZE
+            for student_id in members.get(key, ()) if student_id in known
+        }
+        existing.append(_sorted(
+            [(score(record, known[student_id]), students[student_id]) for student_id in ids], threshold,
+        ))
+        previous = {other for key in keys for other in seen.get(key, ())}
+        earlier.append(_sorted([(score(record, records[other]), other) for other in sorted(previous)], threshold))
+        for key in keys:
+            seen.setdefault(key, []).append(index)
+    return existing, earlier
+
+
+def find_matches(record, threshold=THRESHOLD):
+    # Likely duplicates of one new record on the roster: [(score, student)]
+    return match_records([record], threshold)[0][0]
+
+
+def find_duplicates(threshold=THRESHOLD):
+    """
+    Likely duplicate pairs on the whole roster, as [(score, student,
+    other)] best first. Returns (pairs, skipped_blocks).
+    """
+    shared = StudentMatchKey.objects.filter(
+        Exists(StudentMatchKey.objects.filter(
+            kind=OuterRef('kind'), key=OuterRef('key'),
+        ).exclude(student_id=OuterRef('student_id'))),
+    )
+    campus_id = current_campus_id()
+    if campus_id is not None:
+        shared = shared.filter(student__campus_id=campus_id)
+    shared = shared.order_by('kind', 'key', 'student_id').values_list('kind', 'key', 'student_id')
+
+    blocks = {}
+    for kind, key, student_id in shared:
+        blocks.setdefault((kind, key), []).append(student_id)
+    skipped = [block for block, members in blocks.items() if len(members) > MAX_BLOCK_SIZE]
+    pairs = set()
+    for block, members in blocks.items():
+        if len(members) <= MAX_BLOCK_SIZE:
+            pairs.update(combinations(members, 2))
+
+    students = Student.objects.select_related('user').in_bulk({student_id for pair in pairs for student_id in pair})
+    records = {student_id: _record(student) for student_id, student in students.items()}
+    scored = []
+    for first, second in pairs:
+        if first in records and second in records:
+            value = score(records[first], records[second])
+            if value >= threshold:
+                scored.append((value, students[first], students[second]))
+    scored.sort(key=lambda match: (-match[0], match[1].pk, match[2].pk))
+    return scored, skipped
+
+
+def _student_references():
+    # (model, field name) of every foreign key to Student, including the
+    # archive tables' hidden ones; the match keys are rebuilt instead
+    return [
+        (field.related_model, field.field.name)
+        for field in Student._meta.get_fields(include_hidden=True)
+        if field.auto_created and not field.concrete and (field.one_to_many or field.one_to_one)
+        and field.related_model is not StudentMatchKey
+    ]
+
+
+def merge(keep, duplicate):
+    """
+    Fold `duplicate` into `keep`: re-point every row referencing the
+    duplicate (fees, services, notifications, history and their archives)
+    to `keep`, carry over its service flags, then delete the duplicate
+    student and deactivate its user. Returns {table: rows moved}.
+    """
+    if keep.pk == duplicate.pk:
+        raise ValueError("A student cannot be merged into itself")
+    moved = {}
+    with transaction.atomic():
+        fee_ids = list(
+            FeeCollection._base_manager.filter(student=duplicate).values_list('id', flat=True)
+        )
+        for model, field in _student_references():
+            count = model._base_manager.filter(**{field: duplicate}).update(**{field: keep})
+            if count:
+                moved[model._meta.db_table] = count
+
+        keep.is_transport_user = keep.is_transport_user or duplicate.is_transport_user
+        keep.is_food_service_user = keep.is_food_service_user or duplicate.is_food_service_user
+        keep.save(update_fields=['is_transport_user', 'is_food_service_user'])
+        user = duplicate.user
+        duplicate.delete()
+        user.is_active = False
+        user.save(update_fields=['is_active'])
+
+        if fee_ids:
+            changelog.record(FeeCollection, fee_ids)
+        versioning.touch('fees', 'students', 'services')
+    return moved
@@ -0,0 +1,422 @@
+# delivery.py
+# Outbound SMS and email for in-app notifications.
+#
+# build_digests() folds each recipient's undelivered notifications into one
+# Delivery per channel (the parent's phone for students, the user's email).
+# send_due() claims due deliveries, sends them in batches through the
+# configured gateway for each channel with a bounded thread pool (one
+# gateway, and so one open connection, per thread), and writes every
+# status back in bulk. Failed sends are retried with exponential backoff.
+import http.client
+import json
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import make_msgid
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CustomUser, Delivery, Notification
+from .utils import update_rows
+
+logger = logging.getLogger(__name__)
+
+# Data-change notifications are for staff and stay in-app
+DIGEST_TYPES = ['fee_reminder', 'general', 'transport', 'food_service']
+# Older undelivered notifications are not sent at all
+MAX_NOTIFICATION_AGE = timedelta(days=7)
+SMS_MAX_LENGTH = 459  # three concatenated segments
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 60  # seconds, doubled after every failed attempt
+CLAIM_BATCH = 1000
+OPEN_FEE_STATUSES = ['pending', 'partial', 'overdue']
+
+DEFAULT_BACKENDS = {
+    'sms': 'ssa.delivery.HttpSmsGateway',
+    'email': 'ssa.delivery.EmailGateway',
+}
+DEFAULT_CONCURRENCY = {
+    'sms': 4,
+    'email': 2,
+}
+
+
+@dataclass
+class OutboundMessage:
+    id: int
+    address: str
+    subject: str
+    body: str
+
+
+@dataclass
+class SendResult:
+    id: int
+    provider_id: str = ''
+    error: str = ''
+
+
+# Gateways
+
+class Gateway:
+    """
+    Sends batches of messages over one connection. open() is called once
+    before the first batch and close() after the last.
+    """
+
+    batch_size = 100
+
+    @classmethod
+    def check_configured(cls):
+        # Raise ImproperlyConfigured if the gateway cannot send
+        pass
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_batch(self, messages):
+        # Return one SendResult per message
+        raise NotImplementedError
+
+
+class LocalGateway(Gateway):
+    """
+    Keeps messages in memory instead of sending them; for development and
+    tests. Addresses in `fail_addresses` are rejected.
+    """
+
+    outbox = []
+    fail_addresses = set()
+    _lock = threading.Lock()
+
+    def send_batch(self, messages):
+        results = []
+        with self._lock:
+            for message in messages:
+                if message.address in self.fail_addresses:
+                    results.append(SendResult(message.id, error="Rejected by local gateway"))
+                else:
+                    self.outbox.append(message)
+                    results.append(SendResult(message.id, provider_id=f"local-{uuid.uuid4().hex[:12]}"))
+        return results
+
+
+class EmailGateway(Gateway):
+    # Django's configured email backend, one SMTP session per gateway
+    batch_size = 50
+
+    def open(self):
+        self.connection = mail.get_connection()
+        self.connection.open()
+
+    def close(self):
+        self.connection.close()
+
+    def send_batch(self, messages):
+        results = []
+        for message in messages:
+            message_id = make_msgid()
+            email = mail.EmailMessage(
+                message.subject, message.body, to=[message.address],
+                headers={'Message-ID': message_id}, connection=self.connection,
+            )
+            try:
+                email.send()
+            except Exception as exc:
+                results.append(SendResult(message.id, error=str(exc) or exc.__class__.__name__))
+            else:
+                results.append(SendResult(message.id, provider_id=message_id))
+        return results
+
+
+class HttpSmsGateway(Gateway):
+    """
+    Batch SMS over a JSON HTTP API configured by settings.SMS_GATEWAY
+    (URL, API_KEY, SENDER, TIMEOUT). Posts
+        {"sender": ..., "messages": [{"ref": ..., "to": ..., "text": ...}]}
+    and expects
+        {"results": [{"ref": ..., "id": ...} or {"ref": ..., "error": ...}]}
+    over one keep-alive connection.
+    """
+
+    batch_size = 100
+
+    @classmethod
+    def check_configured(cls):
+        if not getattr(settings, 'SMS_GATEWAY', {}).get('URL'):
+            raise ImproperlyConfigured(
+                "SMS_GATEWAY['URL'] is not set; configure the gateway, or set "
+                "SMS_DELIVERY_BACKEND=ssa.delivery.LocalGateway in development"
+            )
+
+    def open(self):
+        self.config = settings.SMS_GATEWAY
+        url = urlsplit(self.config['URL'])
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(url.netloc, timeout=self.config.get('TIMEOUT', 30))
+        self.path = url.path or '/'
+
+    def close(self):
+        self.connection.close()
+
+    def send_batch(self, messages):
+        payload = json.dumps({
+            'sender': self.config.get('SENDER', ''),
+            'messages': [{'ref': str(message.id), 'to': message.address, 'text': message.body} for message in messages],
+        })
+        try:
+            self.connection.request('POST', self.path, body=payload, headers={
+                'Authorization': f"Bearer {self.config.get('API_KEY', '')}",
+                'Content-Type': 'application/json',
+            })
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            # http.client reconnects on the next request
+            self.connection.close()
+            return [SendResult(message.id, error=f"Gateway unreachable: {exc}") for message in messages]
+
+        if response.status >= 400:
+            return [SendResult(message.id, error=f"Gateway returned HTTP {response.status}") for message in messages]
+
+        results = {str(result.get('ref')): result for result in json.loads(data).get('results', [])}
+        sent = []
+        for message in messages:
+            result = results.get(str(message.id), {})
+            if result.get('id'):
+                sent.append(SendResult(message.id, provider_id=str(result['id'])))
+            else:
+                sent.append(SendResult(message.id, error=result.get('error') or "No result from gateway"))
+        return sent
+
+
+def get_gateway_class(channel):
+    backends = getattr(settings, 'DELIVERY_BACKENDS', DEFAULT_BACKENDS)
+    return import_string(backends[channel])
+
+
+# Fee reminders
+
+def create_fee_reminders(fees, sender=None):
+    # One notification per student, summing all their open `fees`;
+    # returns how many were created
+    outstanding = fees.filter(payment_status__in=OPEN_FEE_STATUSES).values(
+        'student_id', 'student__user_id', 'student__campus_id',
+    ).annotate(
+        balance=Sum(F('amount_due') - F('amount_paid')),
+        fees=Count('id'),
+    ).order_by()
+    reminders = [
+        Notification(
+            campus_id=row['student__campus_id'],
+            title="Fee Reminder",
+            message=f"You have {row['fees']} unpaid fee(s) with an outstanding balance of {row['balance']}.",
+            notification_type='fee_reminder',
+            recipient_id=row['student__user_id'],
+            sender=sender,
+            related_student_id=row['student_id'],
+        )
+        for row in outstanding
+    ]
+    Notification.objects.bulk_create(reminders, batch_size=1000)
+    return len(reminders)
+
+
+# Digests
+
+def _sms_text(items):
+    text = " | ".join(message for title, message in items)
+    if len(text) > SMS_MAX_LENGTH:
+        text = text[:SMS_MAX_LENGTH - 3] + "..."
+    return text
+
+
+def _email_digest(items):
+    if len(items) == 1:
+        subject = items[0][0]
+    else:
+        subject = f"You have {len(items)} new notifications"
+    body = "\n\n".join(f"{title}\n{message}" for title, message in items)
+    return subject[:200], body
+
+
+def build_digests(now=None):
+    """
+    Create one Delivery per recipient and channel for every undelivered
+    notification, and mark the notifications as digested. Returns the
+    number of deliveries created.
+    """
+    now = now or timezone.now()
+    deliveries = []
+    with transaction.atomic():
+        # Locked rows are skipped, so concurrent runs never digest the
+        # same notification twice
+        pending = Notification.objects.select_for_update(skip_locked=True).filter(
+            digested_at__isnull=True,
+            notification_type__in=DIGEST_TYPES,
+            created_at__gte=now - MAX_NOTIFICATION_AGE,
+            created_at__lte=now,
+        ).order_by('recipient_id', 'created_at').values_list('id', 'recipient_id', 'title', 'message')
+
+        by_recipient = {}
+        for notification_id, recipient_id, title, message in pending.iterator(chunk_size=5000):
+            ids, items = by_recipient.setdefault(recipient_id, ([], []))
+            ids.append(notification_id)
+            items.append((title, message))
+        if not by_recipient:
+            return 0
+
+        recipient_ids = list(by_recipient)
+        contacts = {}
+        for start in range(0, len(recipient_ids), 1000):
+            rows = CustomUser.objects.filter(id__in=recipient_ids[start:start + 1000]).values_list(
+                'id', 'email', 'phone', 'student__parent_phone',
+            )
+            for user_id, email, phone, parent_phone in rows:
+                contacts[user_id] = (email, parent_phone or phone)
+
+        for recipient_id, (ids, items) in by_recipient.items():
+            email, phone = contacts.get(recipient_id, ('', ''))
+            subject, body = _email_digest(items)
+            if phone:
+                deliveries.append(Delivery(
+                    recipient_id=recipient_id, channel='sms', address=phone,
+                    subject=subject, body=_sms_text(items), notification_ids=ids, next_attempt_at=now,
+                ))
+            if email:
+                deliveries.append(Delivery(
+                    recipient_id=recipient_id, channel='email', address=email,
+                    subject=subject, body=body, notification_ids=ids, next_attempt_at=now,
+                ))
+
+        Delivery.objects.bulk_create(deliveries, batch_size=1000)
+        notification_ids = [notification_id for ids, items in by_recipient.values() for notification_id in ids]
+        for start in range(0, len(notification_ids), 1000):
+            Notification.objects.filter(id__in=notification_ids[start:start + 1000]).update(digested_at=now)
+    return len(deliveries)
+
+
+# Sending
+
+def claim_due(limit=CLAIM_BATCH):
+    with transaction.atomic():
+        rows = list(Delivery.objects.select_for_update(skip_locked=True).filter(
+            status='pending', next_attempt_at__lte=timezone.now(),
+        ).order_by('next_attempt_at', 'id').values('id', 'channel', 'address', 'subject', 'body', 'attempts')[:limit])
+        if rows:
+            Delivery.objects.filter(id__in=[row['id'] for row in rows]).update(
+                status='sending', next_attempt_at=timezone.now(),
+            )
+    return rows
+
+
+class _GatewayPool:
+    # One gateway per worker thread, opened on first use and closed at the end
+    def __init__(self, gateway_class):
+        self.gateway_class = gateway_class
+        self.local = threading.local()
+        self.gateways = []
+        self.lock = threading.Lock()
+
+    def send(self, messages):
+        try:
+            gateway = getattr(self.local, 'gateway', None)
+            if gateway is None:
+                gateway = self.gateway_class()
+                gateway.open()
+                self.local.gateway = gateway
+                with self.lock:
+                    self.gateways.append(gateway)
+            return gateway.send_batch(messages)
+        except Exception as exc:
+            # Connection or gateway errors fail the whole batch, to be retried
+            logger.exception("Gateway %s failed a batch", self.gateway_class.__name__)
+            return [SendResult(message.id, error=str(exc) or exc.__class__.__name__) for message in messages]
+
+    def close(self):
+        for gateway in self.gateways:
+            try:
+                gateway.close()
+            except Exception:
+                logger.exception("Closing gateway %s failed", self.gateway_class.__name__)
+
+
+def send_claimed(rows):
+    # Network calls run in threads; the results are written here, in bulk
+    concurrency = getattr(settings, 'DELIVERY_CONCURRENCY', DEFAULT_CONCURRENCY)
+    results = []
+    for channel in {row['channel'] for row in rows}:
+        messages = [
+            OutboundMessage(row['id'], row['address'], row['subject'], row['body'])
+            for row in rows if row['channel'] == channel
+        ]
+        pool = _GatewayPool(get_gateway_class(channel))
+        size = pool.gateway_class.batch_size
+        batches = [messages[start:start + size] for start in range(0, len(messages), size)]
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency.get(channel, 1)) as executor:
+                for batch_results in executor.map(pool.send, batches):
+                    results.extend(batch_results)
+        finally:
+            pool.close()
+
+    attempts = {row['id']: row['attempts'] + 1 for row in rows}
+    now = timezone.now()
+    updates = []
+    for result in results:
+        attempt = attempts[result.id]
+        if not result.error:
+            status, next_attempt_at, sent_at = 'sent', now, now
+        elif attempt < MAX_ATTEMPTS:
+            status, next_attempt_at, sent_at = 'pending', now + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (attempt - 1)), None
+        else:
+            status, next_attempt_at, sent_at = 'failed', now, None
+        updates.append({
+            'status': status,
+            'attempts': attempt,
+            'next_attempt_at': next_attempt_at,
+            'provider_id': result.provider_id[:100],
+            'error': result.error,
+            'sent_at': sent_at,
+            'id': result.id,
+        })
+    if updates:
+        with transaction.atomic():
+            update_rows(Delivery, updates)
+    return updates
+
+
+def requeue_stale(older_than=timedelta(hours=1)):
+    # Deliveries left 'sending' by a process that died are tried again
+    return Delivery.objects.filter(
+        status='sending', next_attempt_at__lt=timezone.now() - older_than,
+    ).update(status='pending')
+
+
+def send_due(limit=CLAIM_BATCH):
+    # Send everything that is due, one claimed batch at a time. A channel
+    # without a working gateway fails here, before anything is claimed.
+    for channel in getattr(settings, 'DELIVERY_BACKENDS', DEFAULT_BACKENDS):
+        get_gateway_class(channel).check_configured()
+    totals = {'sent': 0, 'pending': 0, 'failed': 0}
+    while True:
+        rows = claim_due(limit)
+        if not rows:
+            return totals
+        for update in send_claimed(rows):
+            totals[update['status']] += 1
+        if len(rows) < limit:
+            return totals
@@ -0,0 +1,258 @@
+# documents.py
+# Printable fee receipts and term fee statements.
+#
+# A batch loads everything it needs in a couple of queries, turns each
+# document into a plain-data context, and renders the HTML in a process
+# pool. Output goes to a content-addressed cache: the file name is a hash
+# of the template source and the context, so a reprint of unchanged data
+# is served straight from disk and any change to the data or the template
+# produces a new file. Serving a cached file refreshes its mtime, and
+# prune() removes files nobody asked for in a while.
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.template.loader import get_template
+
+from .models import FeeCollection, FeeStructure, Student
+
+TEMPLATES = {
+    'receipt': 'documents/receipt.html',
+    'statement': 'documents/statement.html',
+}
+# Batches smaller than this are rendered in-process; starting workers
+# costs more than it saves
+MIN_POOL_BATCH = 50
+# Cached documents not rendered or served for this long are pruned
+RETENTION_DAYS = 30
+
+FEE_TYPES = dict(FeeStructure.FEE_TYPES)
+PAYMENT_METHODS = dict(FeeCollection.PAYMENT_METHODS)
+PAYMENT_STATUS = dict(FeeCollection.PAYMENT_STATUS)
+
+_template_digests = {}
+
+
+def cache_dir():
+    return Path(getattr(settings, 'DOCUMENT_CACHE_DIR', settings.BASE_DIR / 'document_cache'))
+
+
+def _template_digest(kind):
+    if kind not in _template_digests:
+        source = get_template(TEMPLATES[kind]).template.source
+        _template_digests[kind] = hashlib.sha256(source.encode()).hexdigest()
+    return _template_digests[kind]
+
+
+def document_digest(kind, context):
+    payload = json.dumps(context, sort_keys=True, default=str)
+    return hashlib.sha256(f"{kind}:{_template_digest(kind)}:{payload}".encode()).hexdigest()
+
+
+def document_path(kind, digest, root=None):
+    return Path(root or cache_dir()) / kind / digest[:2] / f"{digest}.html"
+
+
+def _full_name(first_name, last_name, fallback=''):
+    return f"{first_name} {last_name}".strip() or fallback
+
+
+# Context building: plain dicts only, so they pickle cheaply to workers
+
+RECEIPT_FIELDS = (
+    'id', 'receipt_number', 'payment_date', 'payment_method', 'amount_due', 'amount_paid', 'due_date',
+    'fee_structure__fee_type', 'fee_structure__academic_year',
+    'student__student_id', 'student__user__first_name', 'student__user__last_name',
+    'student__school_class__name', 'student__school_class__section', 'student__parent_name',
+    'collected_by__first_name', 'collected_by__last_name', 'collected_by__username',
+)
+
+
+def receipt_contexts(collections):
+    """
+    Receipt contexts keyed by FeeCollection id, in one query. `collections`
+    is a FeeCollection queryset; only collections with a receipt number
+    are included.
+    """
+    rows = collections.exclude(receipt_number__isnull=True).exclude(receipt_number='').values(*RECEIPT_FIELDS)
+    contexts = {}
+    for row in rows.iterator(chunk_size=2000):
+        contexts[row['id']] = {
+            'receipt_number': row['receipt_number'],
+            'payment_date': row['payment_date'].date() if row['payment_date'] else None,
+            'payment_method': PAYMENT_METHODS.get(row['payment_method'], ''),
+            'student_name': _full_name(row['student__user__first_name'], row['student__user__last_name']),
+            'student_id': row['student__student_id'],
+            'class_name': f"{row['student__school_class__name']} {row['student__school_class__section']}".strip(),
+            'parent_name': row['student__parent_name'],
+            'fee_type': FEE_TYPES.get(row['fee_structure__fee_type'], row['fee_structure__fee_type']),
+            'academic_year': row['fee_structure__academic_year'],
+            'due_date': row['due_date'],
+            'amount_due': row['amount_due'],
+            'amount_paid': row['amount_paid'],
+            'balance': row['amount_due'] - row['amount_paid'],
+            'collected_by': _full_name(
+                row['collected_by__first_name'] or '', row['collected_by__last_name'] or '',
+                row['collected_by__username'] or '',
+            ),
+        }
+    return contexts
+
+
+def statement_contexts(academic_year, students=None):
+    """
+    Fee statement contexts keyed by Student id for one academic year, in
+    two queries. `students` optionally narrows the Student queryset.
+    """
+    students = (students if students is not None else Student.objects.all()).values(
+        'id', 'student_id', 'user__first_name', 'user__last_name',
+        'school_class__name', 'school_class__section', 'parent_name', 'parent_phone',
+    )
+    contexts = {}
+    for row in students.iterator(chunk_size=2000):
+        contexts[row['id']] = {
+            'academic_year': academic_year,
+            'student_name': _full_name(row['user__first_name'], row['user__last_name']),
+            'student_id': row['student_id'],
+            'class_name': f"{row['school_class__name']} {row['school_class__section']}".strip(),
+            'parent_name': row['parent_name'],
+            'parent_phone': row['parent_phone'],
+            'lines': [],
+            'total_due': Decimal('0'),
+            'total_paid': Decimal('0'),
+        }
+    if not contexts:
+        return contexts
+
+    lines = defaultdict(list)
+    collections = FeeCollection.objects.filter(
+        fee_structure__academic_year=academic_year,
+        student_id__in=students.values('id'),
+    ).values_list(
+        'student_id', 'fee_structure__fee_type', 'due_date', 'amount_due', 'amount_paid',
+        'payment_status', 'payment_date', 'receipt_number',
+    ).order_by('student_id', 'due_date', 'id')
+    for student_id, fee_type, due_date, amount_due, amount_paid, status, paid_on, receipt in collections.iterator(chunk_size=5000):
+        lines[student_id].append({
+            'fee_type': FEE_TYPES.get(fee_type, fee_type),
+            'due_date': due_date,
+            'amount_due': amount_due,
+            'amount_paid': amount_paid,
+            'balance': amount_due - amount_paid,
+            'status': PAYMENT_STATUS.get(status, status),
+            'payment_date': paid_on.date() if paid_on else None,
+            'receipt_number': receipt or '',
+        })
+
+    for student_id, context in contexts.items():
+        context['lines'] = lines.get(student_id, [])
+        context['total_due'] = sum((line['amount_due'] for line in context['lines']), Decimal('0'))
+        context['total_paid'] = sum((line['amount_paid'] for line in context['lines']), Decimal('0'))
+        context['balance'] = context['total_due'] - context['total_paid']
+    return contexts
+
+
+# Rendering
+
+def _render_to_file(item):
+    kind, path, context = item
+    path = Path(path)
+    if path.exists():
+        return False
+    html = get_template(TEMPLATES[kind]).render(context)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(html, encoding='utf-8')
+    os.replace(tmp_path, path)  # atomic, so readers never see a partial file
+    return True
+
+
+def _touch(path):
+    try:
+        path.touch()
+    except FileNotFoundError:
+        pass  # pruned meanwhile; rendered again on the next request
+
+
+def render_one(kind, context):
+    path = document_path(kind, document_digest(kind, context))
+    if not _render_to_file((kind, str(path), context)):
+        _touch(path)
+    return path
+
+
+def render_batch(kind, contexts, workers=None, progress=None, root=None):
+    """
+    Render every context in `contexts` (a dict of key -> context) and return
+    ({key: path}, number_rendered). Documents already in the cache are not
+    rendered again.
+    """
+    root = root or cache_dir()
+    paths = {key: document_path(kind, document_digest(kind, context), root) for key, context in contexts.items()}
+    pending = []
+    for key, path in paths.items():
+        if path.exists():
+            _touch(path)
+        else:
+            pending.append((kind, str(path), contexts[key]))
+    if not pending:
+        return paths, 0
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(pending) < MIN_POOL_BATCH:
+        rendered = sum(_render_to_file(item) for item in pending)
+        return paths, rendered
+
+    # Spawned, not forked: batches run on runworker's and the web server's
+    # threads, and forking a threaded process can copy locks held by other
+    # threads (and their database connections) into the children. Each
+    # worker sets Django up before it loads this module to render.
+    chunksize = max(1, len(pending) // (workers * 4))
+    rendered = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    ) as executor:
+        for done, was_rendered in enumerate(executor.map(_render_to_file, pending, chunksize=chunksize), start=1):
+            rendered += was_rendered
+            if progress and done % 500 == 0:
+                progress(done, len(pending))
+    return paths, rendered
+
+
+def prune(days=RETENTION_DAYS, root=None):
+    # Remove cached documents not rendered or served for `days` days;
+    # returns how many
+    cutoff = time.time() - days * 24 * 60 * 60
+    removed = 0
+    for path in Path(root or cache_dir()).glob('*/*/*.html'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass  # removed by a concurrent prune
+    return removed
+
+
+def receipt_path(collection_id):
+    contexts = receipt_contexts(FeeCollection.objects.filter(id=collection_id))
+    if collection_id not in contexts:
+        return None
+    return render_one('receipt', contexts[collection_id])
+
+
+def statement_path(student_id, academic_year):
+    contexts = statement_contexts(academic_year, Student.objects.filter(id=student_id))
+    if student_id not in contexts:
+        return None
+    return render_one('statement', contexts[student_id])
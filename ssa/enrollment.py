@@ -0,0 +1,158 @@
+# enrollment.py
+# Class headcounts. SchoolClass.enrolled_count is kept current by
+# Student.save (new students and class changes), the student post_delete
+# signal, import_students() and rollover, always with relative UPDATEs
+# (see SchoolClassManager). Capacity is enforced by those same UPDATEs, so
+# enrolling never needs a count of students. reconcile() recounts.
+from collections import Counter
+from datetime import datetime
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Count
+
+from . import dedup, versioning
+from .models import ClassFull, CustomUser, SchoolClass, Student
+from .utils import update_rows
+
+IMPORT_COLUMNS = [
+    'student_id', 'first_name', 'last_name', 'email', 'class_id',
+    'roll_number', 'date_of_birth', 'parent_name', 'parent_phone',
+]
+REQUIRED_COLUMNS = ['student_id', 'first_name', 'last_name', 'class_id', 'date_of_birth', 'parent_name', 'parent_phone']
+
+
+class StudentImportError(Exception):
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def reconcile(dry_run=False):
+    """
+    Recount every class's students and correct enrolled_count where it
+    drifted. Returns [(class, recorded, actual)] for the drifted classes.
+    """
+    with transaction.atomic():
+        # Locking the classes first holds back enrollments (which update
+        # the class row before inserting the student) while counting
+        classes = list(SchoolClass.objects.select_for_update().order_by('id'))
+        actual = dict(
+            Student.objects.values_list('school_class_id').annotate(count=Count('id')).order_by()
+        )
+        drifted = [
+            (school_class, school_class.enrolled_count, actual.get(school_class.id, 0))
+            for school_class in classes
+            if school_class.enrolled_count != actual.get(school_class.id, 0)
+        ]
+        if drifted and not dry_run:
+            update_rows(SchoolClass, [
+                {'enrolled_count': count, 'id': school_class.id} for school_class, recorded, count in drifted
+            ])
+            versioning.touch('students')
+    return drifted
+
+
+def _clean_row(number, row, errors):
+    values = {column: (row.get(column) or '').strip() for column in IMPORT_COLUMNS}
+    missing = [column for column in REQUIRED_COLUMNS if not values[column]]
+    if missing:
+        errors.append(f"Row {number}: missing {', '.join(missing)}")
+        return None
+    try:
+        values['class_id'] = int(values['class_id'])
+        values['date_of_birth'] = datetime.strptime(values['date_of_birth'], '%Y-%m-%d').date()
+    except ValueError:
+        errors.append(f"Row {number}: class_id must be a number and date_of_birth a YYYY-MM-DD date")
+        return None
+    return values
+
+
+def _duplicate_errors(cleaned, numbers):
+    records = [
+        {field: values[field] for field in ('first_name', 'last_name', 'date_of_birth', 'parent_phone')}
+        for values in cleaned
+    ]
+    existing, earlier = dedup.match_records(records)
+    errors = []
+    for number, students, rows in zip(numbers, existing, earlier):
+        if students:
+            similar = ", ".join(str(student) for value, student in students[:3])
+            errors.append(f"Row {number}: looks like a student already on the roll: {similar}")
+        if rows:
+            errors.append(f"Row {number}: looks like the same student as row {numbers[rows[0][1]]}")
+    return errors
+
+
+def import_students(rows, allow_duplicates=False):
+    """
+    Create a student, and a student user named after the student ID, for
+    each row (a dict keyed by IMPORT_COLUMNS). All rows are imported or
+    none: any invalid row, a likely duplicate (see dedup.py) unless
+    allow_duplicates, or a class without enough free seats raises
+    StudentImportError listing every problem. Users get an unusable
+    password and set their own through password reset.
+    """
+    errors = []
+    cleaned = []
+    numbers = []
+    for number, row in enumerate(rows, start=2):  # row 1 is the CSV header
+        values = _clean_row(number, row, errors)
+        if values:
+            cleaned.append(values)
+            numbers.append(number)
+    if not cleaned and not errors:
+        raise StudentImportError(["The file has no students"])
+
+    student_ids = [values['student_id'] for values in cleaned]
+    duplicates = [student_id for student_id, count in Counter(student_ids).items() if count > 1]
+    taken = set(Student.objects.filter(student_id__in=student_ids).values_list('student_id', flat=True))
+    taken |= set(CustomUser.objects.filter(username__in=student_ids).values_list('username', flat=True))
+    for student_id in sorted(duplicates):
+        errors.append(f"Student ID {student_id} appears more than once")
+    for student_id in sorted(taken):
+        errors.append(f"Student ID {student_id} is already in use")
+
+    seats = Counter(values['class_id'] for values in cleaned)
+    classes = SchoolClass.objects.in_bulk(list(seats))
+    for class_id in sorted(set(seats) - set(classes)):
+        errors.append(f"Class {class_id} does not exist")
+    if not allow_duplicates:
+        errors.extend(_duplicate_errors(cleaned, numbers))
+    if errors:
+        raise StudentImportError(errors)
+
+    with transaction.atomic():
+        full = []
+        for class_id, count in sorted(seats.items()):  # fixed order, so concurrent imports cannot deadlock
+            try:
+                SchoolClass.objects.take_seats(class_id, count)
+            except ClassFull:
+                full.append(f"{classes[class_id]} has no room for {count} more student(s)")
+        if full:
+            raise StudentImportError(full)
+
+        unusable = make_password(None)
+        users = [
+            CustomUser(
+                username=values['student_id'], email=values['email'], password=unusable,
+                first_name=values['first_name'], last_name=values['last_name'], user_type='student',
+                campus_id=classes[values['class_id']].campus_id,
+            )
+            for values in cleaned
+        ]
+        CustomUser.objects.bulk_create(users, batch_size=500)
+        user_ids = dict(CustomUser.objects.filter(username__in=student_ids).values_list('username', 'id'))
+        Student.objects.bulk_create([
+            Student(
+                campus_id=classes[values['class_id']].campus_id,
+                user_id=user_ids[values['student_id']], student_id=values['student_id'],
+                school_class_id=values['class_id'], roll_number=values['roll_number'],
+                date_of_birth=values['date_of_birth'], parent_name=values['parent_name'],
+                parent_phone=values['parent_phone'],
+            )
+            for values in cleaned
+        ], batch_size=500)
+        dedup.refresh_keys(Student.objects.filter(student_id__in=student_ids).select_related('user'))
+        versioning.touch('students')
+    return len(cleaned)
@@ -0,0 +1,83 @@
+# exports.py
+# CSV exports of whole tables, written by a background job (tasks.py) to
+# EXPORT_DIR and downloaded from the job's page once it has finished.
+# Files older than RETENTION are removed whenever a new export is written.
+import csv
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+
+from .models import Expense, FeeCollection, Student
+
+RETENTION = timedelta(days=1)
+
+# Export name -> (file name, header, function returning the rows)
+EXPORTS = {
+    'students': ('students.csv', [
+        'Student ID', 'First Name', 'Last Name', 'Class', 'Section', 'Roll Number', 'Date of Birth',
+        'Parent Name', 'Parent Phone', 'Enrollment Date', 'Transport', 'Food Service',
+    ], lambda: Student.objects.values_list(
+        'student_id', 'user__first_name', 'user__last_name', 'school_class__name', 'school_class__section',
+        'roll_number', 'date_of_birth', 'parent_name', 'parent_phone', 'enrollment_date',
+        'is_transport_user', 'is_food_service_user',
+    ).order_by('student_id')),
+    'fee_collections': ('fee_collections.csv', [
+        'ID', 'Student ID', 'Fee Type', 'Academic Year', 'Amount Due', 'Amount Paid', 'Status',
+        'Payment Method', 'Payment Date', 'Due Date', 'Receipt Number',
+    ], lambda: FeeCollection.objects.values_list(
+        'id', 'student__student_id', 'fee_structure__fee_type', 'fee_structure__academic_year',
+        'amount_due', 'amount_paid', 'payment_status', 'payment_method', 'payment_date',
+        'due_date', 'receipt_number',
+    ).order_by('id')),
+    'expenses': ('expenses.csv', [
+        'ID', 'Date', 'Category', 'Description', 'Amount', 'Vendor', 'Receipt Number',
+    ], lambda: Expense.objects.values_list(
+        'id', 'date', 'category', 'description', 'amount', 'vendor', 'receipt_number',
+    ).order_by('date', 'id')),
+}
+
+
+def export_dir():
+    return Path(getattr(settings, 'EXPORT_DIR', settings.BASE_DIR / 'exports'))
+
+
+def prune(older_than=RETENTION):
+    # Remove exports nobody downloaded in time; returns how many
+    cutoff = time.time() - older_than.total_seconds()
+    removed = 0
+    for path in export_dir().glob('*.csv'):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass  # removed by a concurrent prune
+    return removed
+
+
+def write_export(name, job_id):
+    """
+    Write export `name` to a file of its own for job `job_id`. Returns
+    (file name, rows written).
+    """
+    filename, header, rows = EXPORTS[name]
+    directory = export_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    prune()
+    path = directory / f"{job_id}-{filename}"
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(header)
+        for row in rows().iterator(chunk_size=2000):
+            writer.writerow(row)
+            count += 1
+    return path.name, count
+
+
+def export_path(filename):
+    # Path of a finished export, or None if it has been pruned
+    path = export_dir() / Path(filename).name
+    return path if path.is_file() else None
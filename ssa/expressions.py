@@ -0,0 +1,31 @@
+# expressions.py
+from django.db.models import Func, IntegerField
+
+
+class DaysBetween(Func):
+    # Whole days from `start` to `end` (end - start), evaluated by the database
+    output_field = IntegerField()
+    arity = 2
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # MySQL / MariaDB
+        return super().as_sql(compiler, connection, function='DATEDIFF', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template='(%(expressions)s::date)',
+            arg_joiner='::date - ',
+            **extra_context
+        )
@@ -0,0 +1,101 @@
+# facets.py
+# Faceted student filtering. Every facet's counts reflect all the *other*
+# selected facets (choosing a class still shows how many students each
+# other class would give), and all counts come from one query grouped by
+# class with conditional COUNTs, served from the
+# (school_class, is_transport_user, is_food_service_user) index.
+from django.db.models import Count, Q
+
+from .forms import StudentFilterForm
+from .models import Student
+
+BOOLEAN_FACETS = {
+    'transport_user': 'is_transport_user',
+    'food_service_user': 'is_food_service_user',
+}
+
+
+def _count(condition):
+    return Count('id', filter=condition) if condition else Count('id')
+
+
+def _combine(conditions):
+    combined = Q()
+    for condition in conditions:
+        combined &= condition
+    return combined
+
+
+class StudentFacets:
+    """
+    Applies a StudentFilterForm to the Student table.
+
+    `students` is the filtered queryset; `counts` holds the facet counts:
+        {'total': n,
+         'school_class': {class_id: n, ...},
+         'transport_user': {'true': n, 'false': n},
+         'food_service_user': {'true': n, 'false': n}}
+    Invalid filter values are ignored.
+    """
+
+    def __init__(self, data=None, queryset=None):
+        self.form = StudentFilterForm(data or None)
+        cleaned = {}
+        if self.form.is_bound:
+            self.form.is_valid()
+            cleaned = self.form.cleaned_data  # keeps the valid fields when others fail
+
+        base = queryset if queryset is not None else Student.objects.all()
+        search = cleaned.get('search')
+        if search:
+            base = base.filter(
+                Q(user__first_name__icontains=search) |
+                Q(user__last_name__icontains=search) |
+                Q(student_id__icontains=search)
+            )
+        self.base = base
+
+        self.selected = {}
+        if cleaned.get('school_class'):
+            self.selected['school_class'] = Q(school_class=cleaned['school_class'])
+        for facet, field in BOOLEAN_FACETS.items():
+            if cleaned.get(facet):
+                self.selected[facet] = Q(**{field: cleaned[facet] == 'true'})
+
+        self.students = base.filter(_combine(self.selected.values()))
+        self._counts = None
+
+    def _excluding(self, facet):
+        return _combine(condition for name, condition in self.selected.items() if name != facet)
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            aggregates = {
+                'class_total': _count(self._excluding('school_class')),
+                'total': _count(_combine(self.selected.values())),
+            }
+            for facet, field in BOOLEAN_FACETS.items():
+                others = self._excluding(facet)
+                aggregates[f'{facet}_true'] = Count('id', filter=others & Q(**{field: True}))
+                aggregates[f'{facet}_false'] = Count('id', filter=others & Q(**{field: False}))
+
+            counts = {
+                'total': 0,
+                'school_class': {},
+                **{facet: {'true': 0, 'false': 0} for facet in BOOLEAN_FACETS},
+            }
+            rows = self.base.order_by().values('school_class_id').annotate(**aggregates)
+            for row in rows:
+                if row['class_total']:
+                    counts['school_class'][row['school_class_id']] = row['class_total']
+                counts['total'] += row['total']
+                for facet in BOOLEAN_FACETS:
+                    counts[facet]['true'] += row[f'{facet}_true']
+                    counts[facet]['false'] += row[f'{facet}_false']
+            self._counts = counts
+        return self._counts
+
+    def class_options(self, classes):
+        # (class, count) pairs for rendering the class facet
+        return [(school_class, self.counts['school_class'].get(school_class.id, 0)) for school_class in classes]
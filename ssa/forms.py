@@ -2,7 +2,9 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from .models import *
+from . import dedup, periods, receipts, tenancy
 
 class CustomUserCreationForm(UserCreationForm):
     first_name = forms.CharField(max_length=30, required=True)
@@ -23,7 +25,23 @@ class CustomUserCreationForm(UserCreationForm):
             'phone': forms.TextInput(attrs={'class': 'form-control'}),
         }
 
-class StudentForm(forms.ModelForm):
+def check_free_seat(school_class):
+    # Early, friendly check from the already loaded class; the seat itself
+    # is taken atomically when the student is saved
+    if school_class.free_seats < 1:
+        raise ValidationError(f"{school_class} is full ({school_class.capacity} students).")
+    return school_class
+
+class CampusChoicesMixin:
+    # Choice querysets are built when the form class is defined, outside
+    # any campus; limit them to the current campus for each form
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in self.fields.values():
+            if isinstance(field, forms.ModelChoiceField):
+                field.queryset = tenancy.scoped(field.queryset)
+
+class StudentForm(CampusChoicesMixin, forms.ModelForm):
     # User fields
     first_name = forms.CharField(max_length=30, required=True, widget=forms.TextInput(attrs={'class': 'form-control'}))
     last_name = forms.CharField(max_length=30, required=True, widget=forms.TextInput(attrs={'class': 'form-control'}))
@@ -33,6 +51,10 @@ class StudentForm(forms.ModelForm):
     username = forms.CharField(max_length=150, required=True, widget=forms.TextInput(attrs={'class': 'form-control'}))
     password1 = forms.CharField(widget=forms.PasswordInput(attrs={'class': 'form-control'}), label="Password")
     password2 = forms.CharField(widget=forms.PasswordInput(attrs={'class': 'form-control'}), label="Confirm Password")
+    allow_duplicate = forms.BooleanField(
+        required=False, label="Not a duplicate: add this student anyway",
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
     
     class Meta:
         model = Student
@@ -56,27 +78,48 @@ class StudentForm(forms.ModelForm):
             raise ValidationError("Passwords don't match")
         return password2
     
+    def clean_school_class(self):
+        return check_free_seat(self.cleaned_data['school_class'])
+    
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('allow_duplicate'):
+            return cleaned_data
+        record = {field: cleaned_data.get(field) for field in ('first_name', 'last_name', 'date_of_birth', 'parent_phone')}
+        if all(record.values()):
+            matches = dedup.find_matches(record)
+            if matches:
+                similar = ", ".join(f"{student} ({student.school_class})" for value, student in matches[:3])
+                raise ValidationError(
+                    f"This looks like a student already on the roll: {similar}. "
+                    "Tick \"Not a duplicate\" to add them anyway."
+                )
+        return cleaned_data
+    
     def save(self, commit=True):
-        # Create user first
-        user = CustomUser.objects.create_user(
-            username=self.cleaned_data['username'],
-            email=self.cleaned_data['email'],
-            first_name=self.cleaned_data['first_name'],
-            last_name=self.cleaned_data['last_name'],
-            phone=self.cleaned_data.get('phone', ''),
-            address=self.cleaned_data.get('address', ''),
-            user_type='student',
-            password=self.cleaned_data['password1']
-        )
-        
-        # Create student
-        student = super().save(commit=False)
-        student.user = user
-        if commit:
-            student.save()
+        with transaction.atomic():
+            # Create user first
+            user = CustomUser.objects.create_user(
+                username=self.cleaned_data['username'],
+                email=self.cleaned_data['email'],
+                first_name=self.cleaned_data['first_name'],
+                last_name=self.cleaned_data['last_name'],
+                phone=self.cleaned_data.get('phone', ''),
+                address=self.cleaned_data.get('address', ''),
+                user_type='student',
+                password=self.cleaned_data['password1'],
+                campus_id=self.cleaned_data['school_class'].campus_id,
+            )
+            
+            # Create student; raises ClassFull (and creates nothing) if the
+            # class filled up after validation
+            student = super().save(commit=False)
+            student.user = user
+            if commit:
+                student.save(enforce_capacity=True)
         return student
 
-class StudentEditForm(forms.ModelForm):
+class StudentEditForm(CampusChoicesMixin, forms.ModelForm):
     # User fields
     first_name = forms.CharField(max_length=30, required=True, widget=forms.TextInput(attrs={'class': 'form-control'}))
     last_name = forms.CharField(max_length=30, required=True, widget=forms.TextInput(attrs={'class': 'form-control'}))
@@ -107,6 +150,12 @@ class StudentEditForm(forms.ModelForm):
             self.fields['phone'].initial = self.instance.user.phone
             self.fields['address'].initial = self.instance.user.address
     
+    def clean_school_class(self):
+        school_class = self.cleaned_data['school_class']
+        if school_class.id != self.instance.school_class_id:
+            check_free_seat(school_class)
+        return school_class
+    
     def save(self, commit=True):
         student = super().save(commit=False)
         if commit:
@@ -117,11 +166,12 @@ class StudentEditForm(forms.ModelForm):
             user.email = self.cleaned_data['email']
             user.phone = self.cleaned_data.get('phone', '')
             user.address = self.cleaned_data.get('address', '')
-            user.save()
-            student.save()
+            with transaction.atomic():
+                user.save()
+                student.save(enforce_capacity=True)
         return student
 
-class TeacherForm(forms.ModelForm):
+class TeacherForm(CampusChoicesMixin, forms.ModelForm):
     # User fields
     first_name = forms.CharField(max_length=30, required=True, widget=forms.TextInput(attrs={'class': 'form-control'}))
     last_name = forms.CharField(max_length=30, required=True, widget=forms.TextInput(attrs={'class': 'form-control'}))
@@ -161,7 +211,8 @@ class TeacherForm(forms.ModelForm):
             phone=self.cleaned_data.get('phone', ''),
             address=self.cleaned_data.get('address', ''),
             user_type='teacher',
-            password=self.cleaned_data['password1']
+            password=self.cleaned_data['password1'],
+            campus_id=tenancy.current_campus_id(),
         )
         
         # Create teacher
@@ -183,7 +234,7 @@ class FeeCollectionForm(forms.ModelForm):
             'notes': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
         }
 
-class FeeStructureForm(forms.ModelForm):
+class FeeStructureForm(CampusChoicesMixin, forms.ModelForm):
     class Meta:
         model = FeeStructure
         fields = ['school_class', 'fee_type', 'amount', 'is_mandatory', 'academic_year']
@@ -195,18 +246,37 @@ class FeeStructureForm(forms.ModelForm):
             'academic_year': forms.TextInput(attrs={'class': 'form-control', 'placeholder': '2024-2025'}),
         }
 
-class ExpenseForm(forms.ModelForm):
+class ExpenseForm(CampusChoicesMixin, forms.ModelForm):
     class Meta:
         model = Expense
-        fields = ['category', 'description', 'amount', 'date', 'receipt_number', 'vendor']
+        fields = ['category', 'description', 'amount', 'date', 'receipt_number', 'vendor', 'route', 'food_service']
         widgets = {
             'category': forms.Select(attrs={'class': 'form-control'}),
+            'route': forms.Select(attrs={'class': 'form-control'}),
+            'food_service': forms.Select(attrs={'class': 'form-control'}),
             'description': forms.TextInput(attrs={'class': 'form-control'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
             'date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
             'receipt_number': forms.TextInput(attrs={'class': 'form-control'}),
             'vendor': forms.TextInput(attrs={'class': 'form-control'}),
         }
+    
+    def clean_date(self):
+        # Closed months are final (see periods.py), whichever side of the
+        # edit they are on
+        date = self.cleaned_data['date']
+        for day in (self.instance.date if self.instance.pk else None, date):
+            if day and periods.is_closed(day):
+                raise ValidationError(f"{day:%B %Y} is closed; its expenses can no longer be changed.")
+        return date
+    
+    def save(self, commit=True):
+        expense = super().save(commit=False)
+        if not expense.receipt_number:
+            expense.receipt_number = receipts.next_expense_receipt()
+        if commit:
+            expense.save()
+        return expense
 
 class TransportRouteForm(forms.ModelForm):
     class Meta:
@@ -293,7 +363,7 @@ class AcademicYearForm(forms.ModelForm):
         }
 
 # Search and Filter Forms
-class StudentFilterForm(forms.Form):
+class StudentFilterForm(CampusChoicesMixin, forms.Form):
     search = forms.CharField(
         max_length=100, 
         required=False,
@@ -316,7 +386,7 @@ class StudentFilterForm(forms.Form):
         widget=forms.Select(attrs={'class': 'form-control'})
     )
 
-class FeeCollectionFilterForm(forms.Form):
+class FeeCollectionFilterForm(CampusChoicesMixin, forms.Form):
     payment_status = forms.ChoiceField(
         choices=[('', 'All')] + list(FeeCollection.PAYMENT_STATUS),
         required=False,
@@ -0,0 +1,111 @@
+# jobs.py
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .tenancy import current_campus_id, use_campus
+
+logger = logging.getLogger(__name__)
+
+# Task name -> callable(job, **kwargs); filled by the @task decorator
+registry = {}
+
+RETRY_BASE_DELAY = 30  # seconds, doubled after every failed attempt
+HEARTBEAT_INTERVAL = 30  # seconds between a worker's heartbeats
+
+
+def task(name):
+    def register(func):
+        registry[name] = func
+        return func
+    return register
+
+
+def enqueue(task_name, created_by=None, max_attempts=3, **kwargs):
+    # kwargs are stored as JSON, so pass dates and decimals as strings
+    if task_name not in registry:
+        raise KeyError(f"Unknown job task: {task_name}")
+    return Job.objects.create(
+        task=task_name,
+        kwargs=kwargs,
+        created_by=created_by,
+        campus_id=current_campus_id(),
+        max_attempts=max_attempts,
+    )
+
+
+def claim_next(worker_name):
+    """
+    Atomically take the oldest runnable job and mark it running.
+    SKIP LOCKED lets several workers poll the table without blocking on
+    each other; returns None when nothing is due.
+    """
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            status='queued',
+            run_after__lte=timezone.now(),
+        ).order_by('run_after', 'id').first()
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.attempts += 1
+        job.worker = worker_name
+        job.started_at = job.heartbeat_at = timezone.now()
+        job.save(update_fields=['status', 'attempts', 'worker', 'started_at', 'heartbeat_at'])
+    return job
+
+
+def heartbeat(worker_name):
+    # Mark the worker's running jobs as still in hand; runworker calls
+    # this every HEARTBEAT_INTERVAL seconds
+    return Job.objects.filter(status='running', worker=worker_name).update(heartbeat_at=timezone.now())
+
+
+def run_job(job):
+    close_old_connections()
+    try:
+        func = registry[job.task]
+        with use_campus(job.campus_id):
+            result = func(job, **job.kwargs)
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = timezone.now() + timedelta(seconds=RETRY_BASE_DELAY * 2 ** (job.attempts - 1))
+            logger.warning("Job %s failed (attempt %s), retrying", job.pk, job.attempts)
+        else:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+            logger.error("Job %s failed permanently", job.pk)
+        job.save(update_fields=['status', 'error', 'run_after', 'finished_at'])
+    else:
+        job.status = 'succeeded'
+        job.result = result
+        job.progress = 100
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'progress', 'finished_at'])
+    finally:
+        close_old_connections()
+    return job
+
+
+def requeue_stale(older_than):
+    """
+    Put back in the queue the jobs of workers that died: running jobs
+    without a heartbeat for `older_than`. Jobs still being run, however
+    long, keep beating and are left alone. A job that has used up its
+    attempts fails instead.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status='running', heartbeat_at__lt=now - older_than)
+    with transaction.atomic():
+        stale.filter(attempts__gte=F('max_attempts')).update(
+            status='failed', error="Worker stopped while running the job", finished_at=now,
+        )
+        return stale.update(status='queued', worker='', run_after=now)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from ssa import archive
+from ssa.models import ArchivedFeeCollection, ArchivedNotification, ArchivedStudentDataChange
+
+
+class Command(BaseCommand):
+    help = (
+        "Move closed history into the archive tables in small batches: paid fee collections "
+        "of ended academic years, old read notifications and old student data changes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0.2, help="Pause between batches, in seconds")
+        parser.add_argument('--notification-days', type=int, default=180,
+                            help="Archive read notifications older than this")
+        parser.add_argument('--data-change-days', type=int, default=730,
+                            help="Archive student data changes older than this")
+        parser.add_argument('--dry-run', action='store_true', help="Only count archivable rows")
+
+    def handle(self, *args, **options):
+        targets = [
+            ('fee collections', archive.archivable_fee_collections(), ArchivedFeeCollection),
+            ('notifications', archive.archivable_notifications(options['notification_days']), ArchivedNotification),
+            ('student data changes', archive.archivable_data_changes(options['data_change_days']), ArchivedStudentDataChange),
+        ]
+
+        for label, queryset, archive_model in targets:
+            if options['dry_run']:
+                self.stdout.write(f"{label}: {queryset.count()} rows to archive")
+                continue
+
+            moved = archive.move_in_batches(
+                queryset,
+                archive_model,
+                batch_size=options['batch_size'],
+                pause=options['sleep'],
+                progress=lambda count, label=label: self.stdout.write(f"  {label}: {count} moved"),
+            )
+            self.stdout.write(self.style.SUCCESS(f"{label}: archived {moved} rows"))
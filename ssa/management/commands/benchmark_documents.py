@@ -0,0 +1,57 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ssa import documents
+from ssa.models import FeeCollection
+
+
+class Command(BaseCommand):
+    help = (
+        "Time receipt rendering for a batch of documents: serial, in the process pool, "
+        "and reprinting from the cache. Uses a throwaway cache directory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+
+    def handle(self, *args, **options):
+        count = options['count']
+        started = time.perf_counter()
+        ids = list(
+            FeeCollection.objects.exclude(receipt_number__isnull=True).order_by('-id').values_list('id', flat=True)[:count]
+        )
+        contexts = documents.receipt_contexts(FeeCollection.objects.filter(id__in=ids))
+        load_time = time.perf_counter() - started
+        if not contexts:
+            raise CommandError("No fee collections with receipt numbers to render")
+
+        # Pad with copies (distinct receipt numbers, so distinct files) when
+        # the database has fewer receipts than requested
+        real = len(contexts)
+        templates = list(contexts.values())
+        for n in range(count - real):
+            context = dict(templates[n % real])
+            context['receipt_number'] = f"{context['receipt_number']}-B{n}"
+            contexts[f'copy-{n}'] = context
+        self.stdout.write(f"{len(contexts)} receipts ({real} from the database) loaded in {load_time:.2f}s")
+
+        results = []
+        with tempfile.TemporaryDirectory() as serial_root, tempfile.TemporaryDirectory() as pool_root:
+            for label, workers, root in [
+                ('serial', 1, serial_root),
+                (f'pool ({options["workers"]} workers)', options['workers'], pool_root),
+                ('reprint from cache', options['workers'], pool_root),
+            ]:
+                started = time.perf_counter()
+                paths, rendered = documents.render_batch('receipt', contexts, workers=workers, root=root)
+                elapsed = time.perf_counter() - started
+                results.append((label, elapsed, rendered))
+
+        for label, elapsed, rendered in results:
+            self.stdout.write(
+                f"  {label:<24} {elapsed:7.2f}s  {len(contexts) / elapsed:9.0f} docs/s  {rendered} rendered"
+            )
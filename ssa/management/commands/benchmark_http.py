@@ -0,0 +1,93 @@
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test one or more URLs with concurrent clients and report throughput and latency. "
+        "Compare the sync and async APIs by serving the project under both servers, e.g. "
+        "`gunicorn -w 4 panel.wsgi` and `uvicorn --workers 4 panel.asgi:application`, then "
+        "passing http://.../api/dashboard-stats/ and http://.../api/async/dashboard-stats/."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+')
+        parser.add_argument('--clients', type=int, default=16, help="Concurrent clients")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per URL")
+        parser.add_argument('--sessionid', default='', help="Session cookie of a logged-in admin")
+        parser.add_argument('--header', action='append', default=[],
+                            help="Extra request header as 'Name: value' (repeatable)")
+        parser.add_argument('--conditional', action='store_true',
+                            help="Revalidate with the ETag / Last-Modified of a first response, "
+                                 "as a polling browser would; 304s count as successes")
+
+    def handle(self, *args, **options):
+        headers = {}
+        if options['sessionid']:
+            headers['Cookie'] = f"sessionid={options['sessionid']}"
+        for header in options['header']:
+            name, _, value = header.partition(':')
+            headers[name.strip()] = value.strip()
+
+        for url in options['urls']:
+            url_headers = dict(headers)
+            if options['conditional']:
+                url_headers.update(self.validators(url, headers))
+            result = self.run(url, url_headers, options['clients'], options['requests'])
+            self.stdout.write(
+                f"{url}\n"
+                f"  {result['requests']} requests, {options['clients']} clients, "
+                f"{result['errors']} errors, {result['bytes']} bytes\n"
+                f"  {result['rps']:.1f} req/s  mean {result['mean']:.1f} ms  "
+                f"p50 {result['p50']:.1f} ms  p95 {result['p95']:.1f} ms"
+            )
+
+    def validators(self, url, headers):
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=60) as response:
+            response.read()
+            found = {}
+            if response.headers.get('ETag'):
+                found['If-None-Match'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                found['If-Modified-Since'] = response.headers['Last-Modified']
+            return found
+
+    def run(self, url, headers, clients, total):
+        def fetch(_):
+            request = urllib.request.Request(url, headers=headers)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    size = len(response.read())
+                    ok = response.status < 400
+            except urllib.error.HTTPError as exc:
+                size, ok = 0, exc.code == 304
+            except OSError:
+                size, ok = 0, False
+            return (time.perf_counter() - started) * 1000, size, ok
+
+        # Warm up connections and caches before timing
+        fetch(None)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            samples = list(pool.map(fetch, range(total)))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(sample[0] for sample in samples)
+        if not latencies:
+            raise CommandError("No requests were made")
+        return {
+            'requests': total,
+            'errors': sum(1 for sample in samples if not sample[2]),
+            'bytes': sum(sample[1] for sample in samples),
+            'rps': total / elapsed,
+            'mean': statistics.fmean(latencies),
+            'p50': latencies[len(latencies) // 2],
+            'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        }
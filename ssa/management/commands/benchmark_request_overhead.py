@@ -0,0 +1,74 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+
+from ssa.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure per-request overhead (time, queries, new DB connections) for an authenticated "
+        "request. Run once with and once without PANEL_PROFILE=performance to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/dashboard-stats/')
+        parser.add_argument('--username', required=True, help="Existing user to log in as")
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError("--requests must be at least 1")
+        user = CustomUser.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f"No user named {options['username']!r}")
+
+        # The test client's default host, 'testserver', is not in
+        # ALLOWED_HOSTS outside the test runner
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS if host != '*'), 'localhost')
+        client = Client(HTTP_HOST=host)
+        client.force_login(user)
+        client.get(options['path'])  # warm up templates and caches
+
+        connections_opened = []
+        queries = []
+
+        def count_connection(sender, connection, **kwargs):
+            connections_opened.append(connection.alias)
+
+        # Counted with an execute wrapper because request_started resets
+        # connection.queries on every request
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        connection_created.connect(count_connection)
+        timings = []
+        try:
+            with connection.execute_wrapper(count_query):
+                for _ in range(options['requests']):
+                    started = time.perf_counter()
+                    response = client.get(options['path'])
+                    # The test client skips the request_finished cleanup that
+                    # closes or keeps the connection per CONN_MAX_AGE
+                    close_old_connections()
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if response.status_code >= 400:
+                        raise CommandError(f"{options['path']} returned {response.status_code}")
+        finally:
+            connection_created.disconnect(count_connection)
+
+        total = options['requests']
+        self.stdout.write(
+            f"profile={settings.PANEL_PROFILE} session={settings.SESSION_ENGINE.rsplit('.', 1)[-1]} "
+            f"conn_max_age={settings.DATABASES['default'].get('CONN_MAX_AGE', 0)}\n"
+            f"  {total} requests to {options['path']}\n"
+            f"  mean {statistics.fmean(timings):.2f} ms  p95 {sorted(timings)[int(total * 0.95) - 1]:.2f} ms\n"
+            f"  {len(queries) / total:.2f} queries/request  "
+            f"{len(connections_opened) / total:.2f} new connections/request"
+        )
@@ -0,0 +1,44 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ssa import periods
+
+
+class Command(BaseCommand):
+    help = "Close finished months, freezing their income, expense and outstanding figures into snapshots"
+
+    def add_arguments(self, parser):
+        parser.add_argument('month', nargs='?', help="Month to close as YYYY-MM; by default every finished month")
+        parser.add_argument('--reopen', action='store_true', help="Reopen the month instead, to correct it")
+
+    def handle(self, *args, **options):
+        month = None
+        if options['month']:
+            try:
+                month = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError("Month must be given as YYYY-MM")
+
+        if options['reopen']:
+            if month is None:
+                raise CommandError("Give the month to reopen")
+            reopened = periods.reopen_month(month)
+            self.stdout.write(f"Reopened {month:%B %Y} for {reopened} campus(es)")
+            return
+
+        if month is None:
+            closed = periods.close_finished_months()
+            self.stdout.write(f"Closed {len(closed)} month(s)")
+            for month in closed:
+                self.stdout.write(f"  {month:%B %Y}")
+            return
+
+        try:
+            closed = periods.close_month(month)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if closed:
+            self.stdout.write(f"Closed {month:%B %Y} for {len(closed)} campus(es)")
+        else:
+            self.stdout.write(f"{month:%B %Y} is already closed")
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ssa import delivery
+
+
+class Command(BaseCommand):
+    help = "Digest undelivered notifications and send due SMS/email deliveries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep running, polling every --interval seconds")
+        parser.add_argument('--interval', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        requeued = delivery.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale deliveries")
+
+        while True:
+            created = delivery.build_digests()
+            totals = delivery.send_due()
+            if created or any(totals.values()):
+                self.stdout.write(
+                    f"{created} digests created; sent {totals['sent']}, "
+                    f"retrying {totals['pending']}, failed {totals['failed']}"
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ssa import dedup
+from ssa.models import Student
+
+
+class Command(BaseCommand):
+    help = "List likely duplicate students, comparing only students that share a blocking key"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help="Rebuild every student's blocking keys first")
+        parser.add_argument('--threshold', type=float, default=dedup.THRESHOLD,
+                            help=f"Minimum score to report (default {dedup.THRESHOLD})")
+        parser.add_argument('--merge', nargs=2, metavar=('KEEP', 'DUPLICATE'),
+                            help="Merge the student with ID DUPLICATE into KEEP instead of listing")
+
+    def handle(self, *args, **options):
+        if options['merge']:
+            keep_id, duplicate_id = options['merge']
+            students = Student.objects.select_related('user').in_bulk([keep_id, duplicate_id], field_name='student_id')
+            missing = [student_id for student_id in (keep_id, duplicate_id) if student_id not in students]
+            if missing:
+                raise CommandError(f"Unknown student ID(s): {', '.join(missing)}")
+            moved = dedup.merge(students[keep_id], students[duplicate_id])
+            for table, count in sorted(moved.items()):
+                self.stdout.write(f"  {table}: {count} row(s)")
+            self.stdout.write(f"Merged {duplicate_id} into {keep_id}")
+            return
+
+        if options['rebuild']:
+            self.stdout.write(f"Rebuilt keys for {dedup.rebuild_keys()} student(s)")
+
+        pairs, skipped = dedup.find_duplicates(options['threshold'])
+        for score, student, other in pairs:
+            self.stdout.write(f"  {score:.2f}  {student}  <->  {other}")
+        for kind, key in skipped:
+            self.stdout.write(f"  skipped oversized block {kind}={key}")
+        self.stdout.write(f"{len(pairs)} likely duplicate pair(s)")
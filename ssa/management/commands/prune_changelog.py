@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ssa import changelog
+
+
+class Command(BaseCommand):
+    help = "Delete change-feed entries older than --days"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+
+    def handle(self, *args, **options):
+        deleted = changelog.prune(timedelta(days=options['days']))
+        self.stdout.write(f"Deleted {deleted} change-log entries")
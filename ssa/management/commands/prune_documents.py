@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from ssa import documents
+
+
+class Command(BaseCommand):
+    help = "Delete cached receipts and fee statements not rendered or served for --days"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=documents.RETENTION_DAYS)
+
+    def handle(self, *args, **options):
+        removed = documents.prune(options['days'])
+        self.stdout.write(f"Deleted {removed} cached documents")
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from ssa import enrollment
+
+
+class Command(BaseCommand):
+    help = "Recount the students in every class and repair drifted enrolled_count values"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report drifted classes")
+
+    def handle(self, *args, **options):
+        drifted = enrollment.reconcile(dry_run=options['dry_run'])
+        for school_class, recorded, actual in drifted:
+            self.stdout.write(f"  {school_class}: recorded {recorded}, actual {actual}")
+        prefix = "Would fix" if options['dry_run'] else "Fixed"
+        self.stdout.write(f"{prefix} {len(drifted)} class count(s)")
@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ssa import reconciliation
+from ssa.models import CustomUser, FeeCollection
+
+
+class Command(BaseCommand):
+    help = "Match a bank or mobile-money CSV statement against open fee collections and record the payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help="Path to the statement CSV")
+        parser.add_argument('--method', default='bank_transfer',
+                            choices=[value for value, label in FeeCollection.PAYMENT_METHODS])
+        parser.add_argument('--collected-by', help="Username recorded as the collector")
+        parser.add_argument('--exceptions', help="Write unmatched lines to this CSV file")
+        parser.add_argument('--dry-run', action='store_true', help="Match only; do not update fee collections")
+
+    def handle(self, *args, **options):
+        collected_by = None
+        if options['collected_by']:
+            collected_by = CustomUser.objects.filter(username=options['collected_by']).first()
+            if collected_by is None:
+                raise CommandError(f"No user named {options['collected_by']!r}")
+
+        started = time.perf_counter()
+        reconciler = reconciliation.Reconciler()
+        self.stdout.write(f"Loaded {len(reconciler.by_id)} open fee collections")
+
+        try:
+            with open(options['statement'], newline='', encoding='utf-8-sig') as fh:
+                result = reconciler.reconcile(reconciliation.read_statement(fh))
+        except reconciliation.StatementError as exc:
+            raise CommandError(str(exc))
+
+        if not options['dry_run']:
+            reconciler.apply(result, options['method'], collected_by=collected_by)
+
+        if options['exceptions']:
+            with open(options['exceptions'], 'w', newline='') as fh:
+                reconciliation.write_exceptions_report(result, fh)
+
+        for key, value in result.summary().items():
+            self.stdout.write(f"  {key.replace('_', ' ')}: {value}")
+        self.stdout.write(f"Finished in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ssa import documents
+from ssa.models import AcademicYear, FeeCollection, Student
+
+
+class Command(BaseCommand):
+    help = "Pre-render fee receipts or term fee statements into the document cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['receipt', 'statement'])
+        parser.add_argument('--academic-year', help="Defaults to the current academic year")
+        parser.add_argument('--class-id', type=int, help="Only students of this class")
+        parser.add_argument('--workers', type=int, help="Rendering processes (default: CPU count)")
+
+    def handle(self, *args, **options):
+        academic_year = options['academic_year']
+        if not academic_year:
+            current_year = AcademicYear.get_current()
+            if current_year is None:
+                raise CommandError("No current academic year; pass --academic-year")
+            academic_year = current_year.year
+
+        started = time.perf_counter()
+        if options['kind'] == 'receipt':
+            collections = FeeCollection.objects.filter(fee_structure__academic_year=academic_year)
+            if options['class_id']:
+                collections = collections.filter(student__school_class_id=options['class_id'])
+            contexts = documents.receipt_contexts(collections)
+        else:
+            students = Student.objects.all()
+            if options['class_id']:
+                students = students.filter(school_class_id=options['class_id'])
+            contexts = documents.statement_contexts(academic_year, students)
+        loaded = time.perf_counter()
+
+        paths, rendered = documents.render_batch(
+            options['kind'], contexts, workers=options['workers'],
+            progress=lambda done, total: self.stdout.write(f"  {done}/{total}"),
+        )
+        finished = time.perf_counter()
+
+        self.stdout.write(
+            f"{len(paths)} {options['kind']}s for {academic_year}: {rendered} rendered, "
+            f"{len(paths) - rendered} already cached\n"
+            f"  load {loaded - started:.2f}s  render {finished - loaded:.2f}s"
+        )
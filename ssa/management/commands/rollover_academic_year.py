@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ssa import rollover
+
+
+class Command(BaseCommand):
+    help = (
+        "Promote students, clone fee structures and close transport/food services at year end. "
+        "The progression map is a JSON object of current class id -> next class id, "
+        "with null for classes leaving the school, e.g. {\"1\": 2, \"2\": 3, \"3\": null}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('from_year', help="Closing academic year, e.g. 2024-2025")
+        parser.add_argument('to_year', help="Opening academic year, e.g. 2025-2026")
+        parser.add_argument('progression_map', help="Path to the JSON progression map")
+        parser.add_argument('--dry-run', action='store_true', help="Only print what would change")
+        parser.add_argument('--keep-current', action='store_true',
+                            help="Do not mark to_year as the current academic year")
+
+    def handle(self, *args, **options):
+        with open(options['progression_map']) as fh:
+            raw = json.load(fh)
+        progression = {int(from_id): (int(to_id) if to_id is not None else None) for from_id, to_id in raw.items()}
+
+        try:
+            from_year = rollover.get_year(options['from_year'])
+            to_year = rollover.get_year(options['to_year'])
+            if options['dry_run']:
+                result = rollover.preview(from_year, to_year, progression)
+            else:
+                result = rollover.rollover(from_year, to_year, progression, make_current=not options['keep_current'])
+        except rollover.RolloverError as exc:
+            raise CommandError(str(exc))
+
+        prefix = "Would change" if options['dry_run'] else "Changed"
+        self.stdout.write(f"{prefix} ({from_year} -> {to_year}):")
+        for key, value in result.items():
+            self.stdout.write(f"  {key.replace('_', ' ')}: {value}")
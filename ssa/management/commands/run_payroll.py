@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ssa import payroll
+from ssa.models import PeriodClosed
+
+
+class Command(BaseCommand):
+    help = "Record the month's salary expenses for every teacher not yet paid for it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('month', help="Payroll month as YYYY-MM")
+        parser.add_argument('--dry-run', action='store_true', help="Only list the teachers who would be paid")
+
+    def handle(self, *args, **options):
+        try:
+            month = datetime.strptime(options['month'], '%Y-%m').date()
+        except ValueError:
+            raise CommandError("Month must be given as YYYY-MM")
+
+        if options['dry_run']:
+            plan = payroll.preview(month)
+            for teacher in plan['teachers']:
+                self.stdout.write(f"  {teacher.employee_id} {teacher}: {teacher.salary}")
+            self.stdout.write(
+                f"Would pay {len(plan['teachers'])} teacher(s) {plan['total_amount']} for {plan['month']:%B %Y}; "
+                f"{plan['already_paid']} already paid"
+            )
+            return
+
+        try:
+            run = payroll.run_payroll(month)
+        except PeriodClosed as exc:
+            raise CommandError(str(exc))
+        if run is None:
+            self.stdout.write(f"Nobody is due for {month:%B %Y}")
+        else:
+            self.stdout.write(
+                f"Paid {run.teachers_paid} teacher(s) {run.total_amount} for {run.month:%B %Y} "
+                f"(run #{run.id}, {run.teachers_skipped} skipped)"
+            )
@@ -0,0 +1,59 @@
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from ssa import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs from the Job table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help="Number of jobs run concurrently")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--stale-after', type=int, default=10 * jobs.HEARTBEAT_INTERVAL,
+                            help="Requeue running jobs whose worker has not sent a heartbeat for this many seconds")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is drained")
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        worker_name = f"{socket.gethostname()}:{os.getpid()}"
+
+        stale_after = timedelta(seconds=options['stale_after'])
+
+        self.stdout.write(f"Worker {worker_name} started with {threads} threads")
+        running = set()
+        last_beat = None
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            try:
+                while True:
+                    if last_beat is None or time.monotonic() - last_beat >= jobs.HEARTBEAT_INTERVAL:
+                        # Keep our jobs alive and take over those of dead workers
+                        jobs.heartbeat(worker_name)
+                        requeued = jobs.requeue_stale(stale_after)
+                        if requeued:
+                            self.stdout.write(f"Requeued {requeued} stale jobs")
+                        last_beat = time.monotonic()
+
+                    # Fill free slots before waiting on anything
+                    while len(running) < threads:
+                        job = jobs.claim_next(worker_name)
+                        if job is None:
+                            break
+                        self.stdout.write(f"Running {job}")
+                        running.add(pool.submit(jobs.run_job, job))
+
+                    if running:
+                        done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.stdout.write(f"Finished {future.result()}")
+                    elif options['once']:
+                        break
+                    else:
+                        time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write("Stopping, waiting for running jobs")
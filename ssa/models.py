@@ -1,9 +1,36 @@
 # models.py
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.db.models.functions import Greatest
+from django.core.cache import cache
 from django.utils import timezone
 from decimal import Decimal
 
+from .tenancy import current_campus_id, use_campus
+
+class Campus(models.Model):
+    name = models.CharField(max_length=100)
+    code = models.CharField(max_length=20, unique=True)
+    address = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name_plural = 'campuses'
+    
+    def __str__(self):
+        return self.name
+
+class CampusManager(models.Manager):
+    # Default manager of campus-owned models: inside a campus every query
+    # only sees that campus's rows (see tenancy.py). Rows without a campus
+    # belong to single-campus installations and are seen outside campuses.
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        campus_id = current_campus_id()
+        if campus_id is not None:
+            queryset = queryset.filter(campus_id=campus_id)
+        return queryset
+
 class CustomUser(AbstractUser):
     USER_TYPES = (
         ('admin', 'Admin'),
@@ -13,14 +40,72 @@ class CustomUser(AbstractUser):
     user_type = models.CharField(max_length=10, choices=USER_TYPES)
     phone = models.CharField(max_length=15, blank=True)
     address = models.TextField(blank=True)
+    # Staff and students belong to one campus; admins without one work
+    # across campuses
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_name', 'first_name']),
+            models.Index(fields=['first_name']),
+        ]
+
+class ClassFull(Exception):
+    def __init__(self, class_id, seats=1):
+        super().__init__(f"Class {class_id} has fewer than {seats} free seat(s)")
+        self.class_id = class_id
+        self.seats = seats
+
+class PeriodClosed(Exception):
+    def __init__(self, month):
+        super().__init__(f"{month:%B %Y} is closed")
+        self.month = month
+
+class DayClosedOut(Exception):
+    def __init__(self, day):
+        super().__init__(f"Payments of {day:%d %B %Y} are closed out")
+        self.day = day
+
+class SchoolClassManager(CampusManager):
+    # enrolled_count is only ever changed with relative UPDATEs, so
+    # concurrent enrollments never overwrite each other. The capacity check
+    # is part of the same UPDATE: the row lock it takes serializes
+    # competing enrollments without counting students.
+    def take_seats(self, class_id, seats=1, enforce_capacity=True):
+        classes = self.filter(id=class_id)
+        if enforce_capacity:
+            classes = classes.filter(enrolled_count__lte=models.F('capacity') - seats)
+        if not classes.update(enrolled_count=models.F('enrolled_count') + seats):
+            raise ClassFull(class_id, seats)
+
+    def release_seats(self, class_id, seats=1):
+        # Never below zero, for counts not reconciled yet; Greatest before
+        # subtracting so unsigned columns (MySQL) never underflow
+        self.filter(id=class_id).update(enrolled_count=Greatest(models.F('enrolled_count'), seats) - seats)
 
 class SchoolClass(models.Model):
+    # Indexed as the leading column of the composite index below
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     name = models.CharField(max_length=50)  # e.g., "Grade 1", "Form 4"
     section = models.CharField(max_length=10, blank=True)  # e.g., "A", "B"
     capacity = models.IntegerField(default=30)
+    # Maintained by Student.save, the student post_delete signal, bulk
+    # import and rollover; `manage.py reconcile_class_counts` repairs drift
+    enrolled_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = SchoolClassManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['campus', 'name', 'section']),
+        ]
+    
+    @property
+    def free_seats(self):
+        return max(self.capacity - self.enrolled_count, 0)
+    
     def __str__(self):
         return f"{self.name} - {self.section}" if self.section else self.name
 
@@ -33,6 +118,7 @@ class Subject(models.Model):
         return self.name
 
 class Teacher(models.Model):
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
     employee_id = models.CharField(max_length=20, unique=True)
     subjects = models.ManyToManyField(Subject)
@@ -41,13 +127,18 @@ class Teacher(models.Model):
     hire_date = models.DateField()
     qualification = models.CharField(max_length=200)
     
+    objects = CampusManager()
+    
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name}"
 
 class Student(models.Model):
+    # The class's campus, copied so campus queries need no join
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
     student_id = models.CharField(max_length=20, unique=True)
-    school_class = models.ForeignKey(SchoolClass, on_delete=models.CASCADE)
+    # None once the student has left the school (see rollover.py)
+    school_class = models.ForeignKey(SchoolClass, on_delete=models.CASCADE, null=True)
     roll_number = models.CharField(max_length=20)
     date_of_birth = models.DateField()
     parent_name = models.CharField(max_length=100)
@@ -56,9 +147,67 @@ class Student(models.Model):
     is_transport_user = models.BooleanField(default=False)
     is_food_service_user = models.BooleanField(default=False)
     
+    objects = CampusManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['parent_phone']),
+            # Covers the student facet counts (see facets.py)
+            models.Index(fields=['campus', 'school_class', 'is_transport_user', 'is_food_service_user']),
+            models.Index(fields=['campus', '-enrollment_date']),
+        ]
+    
+    # Class whose enrolled_count includes this student (set when loaded)
+    _seated_class_id = None
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # DEFERRED if loaded without the class: its seat is then left alone
+        instance._seated_class_id = instance.__dict__.get('school_class_id', models.DEFERRED)
+        return instance
+    
+    def save(self, *args, enforce_capacity=False, **kwargs):
+        # Moves the student's seat when the class changes, in the same
+        # transaction as the row; raises ClassFull if enforce_capacity and
+        # the new class has no free seat
+        update_fields = kwargs.get('update_fields')
+        moving = (
+            self._seated_class_id is not models.DEFERRED
+            and self.school_class_id != self._seated_class_id
+            and (update_fields is None or 'school_class' in update_fields or 'school_class_id' in update_fields)
+        )
+        with transaction.atomic():
+            if moving:
+                if self.school_class_id is not None:
+                    SchoolClass.objects.take_seats(self.school_class_id, enforce_capacity=enforce_capacity)
+                if self._seated_class_id is not None:
+                    SchoolClass.objects.release_seats(self._seated_class_id)
+            super().save(*args, **kwargs)
+        if moving:
+            self._seated_class_id = self.school_class_id
+    
     def __str__(self):
         return f"{self.user.first_name} {self.user.last_name} - {self.student_id}"
 
+class StudentMatchKey(models.Model):
+    # Blocking keys for duplicate detection (see dedup.py): students only
+    # get compared with students sharing one of their keys
+    KINDS = (
+        ('phone', 'Parent phone'),
+        ('dob', 'Date of birth'),
+        ('name', 'Name sound'),
+    )
+    
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='match_keys')
+    kind = models.CharField(max_length=5, choices=KINDS)
+    key = models.CharField(max_length=20)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'key']),
+        ]
+
 class FeeStructure(models.Model):
     FEE_TYPES = (
         ('tuition', 'Tuition Fee'),
@@ -68,12 +217,15 @@ class FeeStructure(models.Model):
         ('lab', 'Laboratory Fee'),
         ('other', 'Other Fee'),
     )
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     school_class = models.ForeignKey(SchoolClass, on_delete=models.CASCADE)
     fee_type = models.CharField(max_length=20, choices=FEE_TYPES)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_mandatory = models.BooleanField(default=True)
     academic_year = models.CharField(max_length=9)  # e.g., "2024-2025"
     
+    objects = CampusManager()
+    
     class Meta:
         unique_together = ['school_class', 'fee_type', 'academic_year']
 
@@ -91,6 +243,8 @@ class FeeCollection(models.Model):
         ('cheque', 'Cheque'),
     )
     
+    # The student's campus, copied so campus queries need no join
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     fee_structure = models.ForeignKey(FeeStructure, on_delete=models.CASCADE)
     amount_due = models.DecimalField(max_digits=10, decimal_places=2)
@@ -99,13 +253,30 @@ class FeeCollection(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHODS, blank=True)
     payment_date = models.DateTimeField(null=True, blank=True)
     due_date = models.DateField()
-    receipt_number = models.CharField(max_length=50, blank=True)
+    receipt_number = models.CharField(max_length=50, null=True, blank=True, unique=True)
     collected_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['campus', 'payment_status', 'due_date']),
+            models.Index(fields=['campus', 'payment_date']),
+            # A fee structure belongs to one campus already
+            models.Index(fields=['fee_structure', 'due_date']),
+        ]
+    
+    def save(self, *args, **kwargs):
+        # Atomic so the change-log entry written on post_save commits or
+        # rolls back with the row (see changelog.py)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
 class TransportRoute(models.Model):
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     route_name = models.CharField(max_length=100)
     pickup_points = models.TextField()  # JSON field to store multiple pickup points
     monthly_fee = models.DecimalField(max_digits=8, decimal_places=2)
@@ -114,16 +285,27 @@ class TransportRoute(models.Model):
     vehicle_number = models.CharField(max_length=20)
     capacity = models.IntegerField()
     
+    objects = CampusManager()
+    
     def __str__(self):
         return self.route_name
 
 class TransportAssignment(models.Model):
+    # The student's campus, copied so campus queries need no join
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     route = models.ForeignKey(TransportRoute, on_delete=models.CASCADE)
     pickup_point = models.CharField(max_length=200)
     start_date = models.DateField()
     end_date = models.DateField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', 'start_date']),
+        ]
 
 class FoodService(models.Model):
     MEAL_TYPES = (
@@ -132,18 +314,50 @@ class FoodService(models.Model):
         ('dinner', 'Dinner'),
         ('snack', 'Snack'),
     )
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     meal_type = models.CharField(max_length=10, choices=MEAL_TYPES)
     daily_rate = models.DecimalField(max_digits=6, decimal_places=2)
     monthly_rate = models.DecimalField(max_digits=8, decimal_places=2)
     description = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
+    
+    objects = CampusManager()
 
 class FoodServiceSubscription(models.Model):
+    # The student's campus, copied so campus queries need no join
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     food_service = models.ForeignKey(FoodService, on_delete=models.CASCADE)
     start_date = models.DateField()
     end_date = models.DateField()
     is_active = models.BooleanField(default=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', 'start_date']),
+        ]
+
+class PayrollRun(models.Model):
+    # Audit record of one payroll run (see payroll.py)
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    month = models.DateField()  # first day of the month paid
+    run_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
+    teachers_paid = models.PositiveIntegerField(default=0)
+    teachers_skipped = models.PositiveIntegerField(default=0)  # already paid for the month, or no salary
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['campus', 'month']),
+        ]
+    
+    def __str__(self):
+        return f"Payroll {self.month:%B %Y} ({self.teachers_paid} teachers)"
 
 class Expense(models.Model):
     EXPENSE_CATEGORIES = (
@@ -157,17 +371,119 @@ class Expense(models.Model):
         ('other', 'Other'),
     )
     
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
     category = models.CharField(max_length=20, choices=EXPENSE_CATEGORIES)
     description = models.CharField(max_length=200)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
-    receipt_number = models.CharField(max_length=50, blank=True)
-    vendor = models.CharField(max_length=100, blank=True)
+    receipt_number = models.CharField(max_length=50, null=True, blank=True, unique=True)
+    vendor = models.CharField(max_length=100, blank=True, db_index=True)
+    # Optional service line a transport / food cost belongs to; untagged
+    # costs are shared out over all lines (see analytics.py)
+    route = models.ForeignKey(TransportRoute, on_delete=models.SET_NULL, null=True, blank=True)
+    food_service = models.ForeignKey(FoodService, on_delete=models.SET_NULL, null=True, blank=True)
+    # Set on salary expenses created by a payroll run; a teacher is paid
+    # at most once per payroll month
+    teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, blank=True)
+    payroll_month = models.DateField(null=True, blank=True)
+    payroll_run = models.ForeignKey(PayrollRun, on_delete=models.SET_NULL, null=True, blank=True, related_name='expenses')
     recorded_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['campus', 'category', 'date']),
+            models.Index(fields=['campus', 'date']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['teacher', 'payroll_month'], name='unique_teacher_payroll_month'),
+        ]
     
     def __str__(self):
         return f"{self.category} - {self.amount} on {self.date}"
+    
+    def save(self, *args, **kwargs):
+        # Atomic for the same reason as FeeCollection.save
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+class ClosedPeriod(models.Model):
+    # A finished month frozen by periods.close_month(); its snapshots are
+    # the month's figures from then on
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    month = models.DateField()  # first day of the month
+    closed_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+    closed_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campus', 'month'], name='unique_campus_closed_month'),
+            # NULLs are distinct in the constraint above
+            models.UniqueConstraint(fields=['month'], condition=models.Q(campus__isnull=True), name='unique_closed_month'),
+        ]
+    
+    def __str__(self):
+        return f"{self.month:%B %Y} (closed)"
+
+class PeriodSnapshot(models.Model):
+    SECTIONS = (
+        ('income', 'Income'),  # paid in the month, by fee type
+        ('expense', 'Expense'),  # by category
+        ('outstanding', 'Outstanding'),  # unpaid balances of fees due by the month's end, by fee type
+    )
+    
+    period = models.ForeignKey(ClosedPeriod, on_delete=models.CASCADE, related_name='snapshots')
+    section = models.CharField(max_length=15, choices=SECTIONS)
+    item = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'section', 'item'], name='unique_period_snapshot_item'),
+        ]
+
+class CashierCloseOut(models.Model):
+    # A signed-off end-of-day close-out of fee payments (see closeout.py).
+    # Without a campus it covers every campus.
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True, db_index=False)
+    day = models.DateField()
+    payments = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cash_expected = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cash_counted = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    notes = models.TextField(blank=True)
+    signed_off_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='+')
+    signed_off_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['campus', 'day'], name='unique_campus_closeout_day'),
+            models.UniqueConstraint(fields=['day'], condition=models.Q(campus__isnull=True), name='unique_closeout_day'),
+        ]
+    
+    @property
+    def cash_variance(self):
+        if self.cash_counted is None:
+            return None
+        return self.cash_counted - self.cash_expected
+    
+    def __str__(self):
+        return f"Close-out {self.day:%d %b %Y}"
+
+class CloseOutLine(models.Model):
+    # One collector and payment method of a close-out
+    closeout = models.ForeignKey(CashierCloseOut, on_delete=models.CASCADE, related_name='lines')
+    collected_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='+')
+    payment_method = models.CharField(max_length=20, choices=FeeCollection.PAYMENT_METHODS, blank=True)
+    payments = models.PositiveIntegerField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
 
 class StudentDataChange(models.Model):
     CHANGE_TYPES = (
@@ -179,6 +495,8 @@ class StudentDataChange(models.Model):
         ('food_service_info', 'Food Service Information'),
     )
     
+    # The student's campus, copied so campus queries need no join
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     student = models.ForeignKey(Student, on_delete=models.CASCADE)
     changed_by = models.ForeignKey(Teacher, on_delete=models.CASCADE)
     change_type = models.CharField(max_length=20, choices=CHANGE_TYPES)
@@ -188,6 +506,8 @@ class StudentDataChange(models.Model):
     reason = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     
+    objects = CampusManager()
+    
     def __str__(self):
         return f"{self.student} - {self.field_name} changed by {self.changed_by}"
 
@@ -203,16 +523,30 @@ class Notification(models.Model):
     title = models.CharField(max_length=200)
     message = models.TextField()
     notification_type = models.CharField(max_length=15, choices=NOTIFICATION_TYPES)
+    # The recipient's campus, else the campus it was sent from
+    campus = models.ForeignKey(Campus, on_delete=models.PROTECT, null=True, blank=True)
     recipient = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='notifications')
     sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='sent_notifications')
     is_read = models.BooleanField(default=False)
     related_student = models.ForeignKey(Student, on_delete=models.CASCADE, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    digested_at = models.DateTimeField(null=True, blank=True)  # included in an outbound Delivery
+    
+    objects = CampusManager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['recipient', '-created_at']),
+            models.Index(fields=['digested_at', 'created_at']),
+        ]
+
+CURRENT_ACADEMIC_YEAR_CACHE_KEY = 'ssa:current_academic_year'
+NO_CURRENT_YEAR = 'none'
 
 class AcademicYear(models.Model):
+    # School-wide: every campus keeps the same calendar, and fee structures
+    # of all campuses refer to its years by name
     year = models.CharField(max_length=9, unique=True)  # e.g., "2024-2025"
     start_date = models.DateField()
     end_date = models.DateField()
@@ -226,3 +560,226 @@ class AcademicYear(models.Model):
             # Ensure only one academic year is current
             AcademicYear.objects.filter(is_current=True).update(is_current=False)
         super().save(*args, **kwargs)
+        self._touch()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        self._touch()
+        return result
+    
+    @staticmethod
+    def _touch():
+        # School-wide, so the version every campus reads
+        from . import versioning
+
+        with use_campus(None):
+            versioning.touch('years')
+    
+    @classmethod
+    def get_current(cls):
+        # Cached per 'years' data version, which save() and delete() bump
+        # after commit, so every process sees a change (e.g. a rollover run
+        # from the command line) on its next call
+        from . import versioning
+
+        stamp, = versioning.versions('years')
+        key = f'{CURRENT_ACADEMIC_YEAR_CACHE_KEY}:{stamp.timestamp()}'
+        current = cache.get(key)
+        if current is None:
+            current = cls.objects.filter(is_current=True).first() or NO_CURRENT_YEAR
+            cache.set(key, current, 60 * 60)
+        return None if current == NO_CURRENT_YEAR else current
+
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+
+    task = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveSmallIntegerField(default=0)  # percent
+    progress_message = models.CharField(max_length=200, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)
+    # Campus the job was queued in; it runs scoped to it (see jobs.run_job)
+    campus = models.ForeignKey(Campus, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs (see jobs.heartbeat)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+    def set_progress(self, progress, message=''):
+        # Written straight to the row so pollers see it while the job runs
+        self.progress = progress
+        self.progress_message = message[:200]
+        Job.objects.filter(pk=self.pk).update(progress=self.progress, progress_message=self.progress_message)
+
+# Archive tables for closed history. Rows keep their original primary key;
+# foreign keys are unconstrained so archived rows outlive their parents.
+class ArchivedFeeCollection(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    campus = models.ForeignKey(
+        Campus, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+', db_index=False,
+    )
+    student = models.ForeignKey(Student, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    fee_structure = models.ForeignKey(FeeStructure, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    amount_due = models.DecimalField(max_digits=10, decimal_places=2)
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2)
+    payment_status = models.CharField(max_length=10, choices=FeeCollection.PAYMENT_STATUS)
+    payment_method = models.CharField(max_length=20, choices=FeeCollection.PAYMENT_METHODS, blank=True)
+    payment_date = models.DateTimeField(null=True, blank=True)
+    due_date = models.DateField()
+    receipt_number = models.CharField(max_length=50, null=True, blank=True)
+    collected_by = models.ForeignKey(CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    notes = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = CampusManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['campus', 'payment_date']),
+        ]
+
+class ArchivedNotification(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    campus = models.ForeignKey(
+        Campus, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+',
+    )
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    notification_type = models.CharField(max_length=15, choices=Notification.NOTIFICATION_TYPES)
+    recipient = models.ForeignKey(CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    sender = models.ForeignKey(CustomUser, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    is_read = models.BooleanField(default=True)
+    related_student = models.ForeignKey(Student, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+
+class ArchivedStudentDataChange(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    campus = models.ForeignKey(
+        Campus, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+',
+    )
+    student = models.ForeignKey(Student, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    changed_by = models.ForeignKey(Teacher, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    change_type = models.CharField(max_length=20, choices=StudentDataChange.CHANGE_TYPES)
+    field_name = models.CharField(max_length=100)
+    old_value = models.TextField()
+    new_value = models.TextField()
+    reason = models.TextField()
+    timestamp = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+class Delivery(models.Model):
+    # One outbound SMS or email carrying a digest of a recipient's
+    # notifications; see delivery.py
+    CHANNELS = (
+        ('sms', 'SMS'),
+        ('email', 'Email'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    )
+    
+    recipient = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='deliveries')
+    channel = models.CharField(max_length=5, choices=CHANNELS)
+    address = models.CharField(max_length=254)
+    subject = models.CharField(max_length=200, blank=True)
+    body = models.TextField()
+    notification_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    provider_id = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.channel} to {self.address} ({self.status})"
+
+class ChangeLogEntry(models.Model):
+    # Outbox of fee and expense changes for the accounting change feed;
+    # written in the same transaction as the change (see changelog.py)
+    MODELS = (
+        ('fee_collection', 'Fee Collection'),
+        ('expense', 'Expense'),
+    )
+    ACTIONS = (
+        ('upsert', 'Created or updated'),
+        ('delete', 'Deleted'),
+    )
+    
+    id = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=20, choices=MODELS)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['model', 'id']),
+            models.Index(fields=['created_at']),
+        ]
+
+class DataVersion(models.Model):
+    # Last write time per data domain, used for ETag / Last-Modified
+    DOMAINS = (
+        ('fees', 'Fee Collections'),
+        ('expenses', 'Expenses'),
+        ('students', 'Students'),
+        ('archive', 'Archived Fee Collections'),
+        ('years', 'Academic Years'),
+        ('assignments', 'Teacher Class Assignments'),
+    )
+    
+    # "<domain>@<campus id>" for writes within one campus
+    domain = models.CharField(max_length=40, unique=True)
+    updated_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.domain} @ {self.updated_at}"
+
+class ReceiptSequence(models.Model):
+    # Next unallocated receipt number per series and year; see receipts.py
+    series = models.CharField(max_length=10)
+    year = models.PositiveSmallIntegerField()
+    next_value = models.PositiveIntegerField(default=1)
+    
+    class Meta:
+        unique_together = ['series', 'year']
+    
+    def __str__(self):
+        return f"{self.series}-{self.year}: next {self.next_value}"
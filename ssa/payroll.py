@@ -0,0 +1,92 @@
+# payroll.py
+# Monthly payroll: one 'salary' Expense per teacher per month, created in
+# bulk by run_payroll(). Expense's (teacher, payroll_month) unique
+# constraint makes a repeated or concurrent run unable to pay anyone
+# twice; teachers already paid for the month are skipped. Each run leaves
+# a PayrollRun record, and its expenses point back at it. Inside a campus
+# only that campus's teachers are paid.
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+from . import changelog, periods, receipts, versioning
+from .billing import month_bounds
+from .models import Expense, PayrollRun, PeriodClosed, Teacher
+from .tenancy import current_campus_id
+
+
+def _payable(month):
+    # Active teachers hired by the end of `month` with a salary, annotated
+    # with whether the month is already paid
+    period_start, period_end = month_bounds(month)
+    return Teacher.objects.filter(
+        user__is_active=True, hire_date__lte=period_end, salary__gt=0,
+    ).annotate(
+        paid=Exists(Expense.objects.filter(teacher=OuterRef('pk'), payroll_month=period_start)),
+    )
+
+
+def preview(month):
+    # What run_payroll(month) would do, without writing anything
+    teachers = _payable(month)
+    due = [teacher for teacher in teachers.select_related('user').order_by('employee_id') if not teacher.paid]
+    return {
+        'month': month_bounds(month)[0],
+        'teachers': due,
+        'total_amount': sum((teacher.salary for teacher in due), Decimal('0.00')),
+        'already_paid': teachers.filter(paid=True).count(),
+    }
+
+
+def run_payroll(month, run_by=None, pay_date=None):
+    """
+    Create the salary expenses of every payable teacher not yet paid for
+    the month containing `month`, dated `pay_date` (by default the last
+    day of the month). Returns the PayrollRun, or None if nobody was due.
+    Raises PeriodClosed if `pay_date` falls in a closed month.
+    """
+    period_start, period_end = month_bounds(month)
+    pay_date = pay_date or period_end
+    if periods.is_closed(pay_date):
+        raise PeriodClosed(pay_date.replace(day=1))
+
+    with transaction.atomic():
+        # Locking the teachers serializes concurrent runs for the same
+        # month, so the second one sees the first one's expenses and skips
+        teachers = list(
+            _payable(period_start).select_related('user').select_for_update(of=('self',)).order_by('id')
+        )
+        due = [teacher for teacher in teachers if not teacher.paid]
+        if not due:
+            return None
+
+        run = PayrollRun.objects.create(
+            campus_id=current_campus_id(),
+            month=period_start,
+            run_by=run_by,
+            teachers_paid=len(due),
+            teachers_skipped=len(teachers) - len(due),
+            total_amount=sum(teacher.salary for teacher in due),
+        )
+        numbers = receipts.get_allocator(receipts.EXPENSE_SERIES).take(len(due))
+        expenses = [
+            Expense(
+                campus_id=teacher.campus_id,
+                category='salary',
+                description=f"Salary {period_start:%B %Y} - {teacher} ({teacher.employee_id})",
+                amount=teacher.salary,
+                date=pay_date,
+                receipt_number=number,
+                vendor=str(teacher),
+                teacher=teacher,
+                payroll_month=period_start,
+                payroll_run=run,
+                recorded_by=run_by,
+            )
+            for teacher, number in zip(due, numbers)
+        ]
+        Expense.objects.bulk_create(expenses, batch_size=500)
+        changelog.record(Expense, changelog.created_ids(expenses, run.expenses.all()))
+        versioning.touch('expenses')
+    return run
@@ -0,0 +1,240 @@
+# periods.py
+# Period close. close_month() freezes a finished month, per campus, into
+# PeriodSnapshot rows: income by fee type (fees paid in the month,
+# archived ones included), expenses by category and, as of the close, the
+# balances still outstanding on fees due by the month's end. Reports read
+# closed months from the snapshots and only aggregate raw rows for the
+# rest of their range (see split_range()).
+#
+# Closed months do not change: saving or deleting a fee payment or an
+# expense dated in one raises PeriodClosed (signals.py), and the expense
+# form, payroll and statement reconciliation refuse such dates. Archiving
+# moves paid fees without changing any total, so it may delete them.
+# reopen_month() lifts a close to correct a month; closing it again takes
+# fresh snapshots.
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Q, Sum
+from django.utils import timezone
+
+from .billing import month_bounds
+from .models import (
+    ArchivedFeeCollection, Campus, ClosedPeriod, Expense, FeeCollection, PeriodClosed, PeriodSnapshot,
+)
+from .tenancy import current_campus_id
+
+# Model -> (date field, fields whose change alters a month's figures)
+GUARDED = {
+    Expense: ('date', ['campus_id', 'category', 'amount', 'date']),
+    FeeCollection: (
+        'payment_date', ['campus_id', 'fee_structure_id', 'amount_due', 'amount_paid', 'payment_status', 'payment_date'],
+    ),
+}
+
+_archiving = contextvars.ContextVar('ssa_archiving', default=False)
+
+
+@contextmanager
+def archiving():
+    # Fee rows deleted inside are being moved to the archive, which keeps
+    # them in every total
+    token = _archiving.set(True)
+    try:
+        yield
+    finally:
+        _archiving.reset(token)
+
+
+def moving_to_archive():
+    return _archiving.get()
+
+
+def local_day(value):
+    # The local date of a date or datetime
+    if isinstance(value, datetime):
+        return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+    return value
+
+
+def _campus_keys():
+    # Campuses a close or a report covers; None stands for rows without a
+    # campus, which are only seen outside campuses
+    campus_id = current_campus_id()
+    if campus_id is not None:
+        return [campus_id]
+    return [*Campus.objects.values_list('id', flat=True), None]
+
+
+def _campus_filter(campus_ids, prefix=''):
+    condition = Q(**{f'{prefix}campus_id__in': [campus_id for campus_id in campus_ids if campus_id is not None]})
+    if None in campus_ids:
+        condition |= Q(**{f'{prefix}campus_id__isnull': True})
+    return condition
+
+
+def _figures(period_start, period_end, campus_ids):
+    # {campus_id: {(section, item): amount}} from the raw rows
+    figures = {campus_id: {} for campus_id in campus_ids}
+
+    def add(rows, section, item_field):
+        for row in rows:
+            items = figures[row['campus_id']]
+            key = (section, row[item_field])
+            items[key] = items.get(key, 0) + (row['total'] or 0)
+
+    campuses = _campus_filter(campus_ids)
+    for source in (FeeCollection, ArchivedFeeCollection):
+        add(source._base_manager.filter(
+            campuses, payment_status='paid', payment_date__date__range=[period_start, period_end],
+        ).values('campus_id', 'fee_structure__fee_type').annotate(total=Sum('amount_paid')).order_by(),
+            'income', 'fee_structure__fee_type')
+    add(Expense._base_manager.filter(
+        campuses, date__range=[period_start, period_end],
+    ).values('campus_id', 'category').annotate(total=Sum('amount')).order_by(), 'expense', 'category')
+    add(FeeCollection._base_manager.filter(campuses, due_date__lte=period_end).exclude(
+        payment_status='paid',
+    ).values('campus_id', 'fee_structure__fee_type').annotate(
+        total=Sum(F('amount_due') - F('amount_paid')),
+    ).order_by(), 'outstanding', 'fee_structure__fee_type')
+    return figures
+
+
+def close_month(month, closed_by=None):
+    """
+    Close the month containing `month` for the current campus, or for
+    every campus outside one, snapshotting its figures. Campuses that
+    already closed it are left alone. Returns the new ClosedPeriods.
+    """
+    period_start, period_end = month_bounds(month)
+    if period_end >= timezone.localdate():
+        raise ValueError(f"{period_start:%B %Y} has not finished")
+
+    with transaction.atomic():
+        closed = set(ClosedPeriod._base_manager.filter(month=period_start).values_list('campus_id', flat=True))
+        campus_ids = [campus_id for campus_id in _campus_keys() if campus_id not in closed]
+        if not campus_ids:
+            return []
+        figures = _figures(period_start, period_end, campus_ids)
+        periods = ClosedPeriod._base_manager.bulk_create([
+            ClosedPeriod(campus_id=campus_id, month=period_start, closed_by=closed_by) for campus_id in campus_ids
+        ])
+        PeriodSnapshot.objects.bulk_create([
+            PeriodSnapshot(period=period, section=section, item=item, amount=amount)
+            for period in periods
+            for (section, item), amount in figures[period.campus_id].items()
+        ], batch_size=1000)
+    return periods
+
+
+def close_finished_months(closed_by=None):
+    # Close every finished month since the first payment or expense;
+    # returns the months closed
+    firsts = [
+        local_day(source._base_manager.filter(_campus_filter(_campus_keys())).aggregate(first=Min(field))['first'])
+        for source, field in (
+            (FeeCollection, 'payment_date'), (ArchivedFeeCollection, 'payment_date'), (Expense, 'date'),
+        )
+    ]
+    firsts = [first for first in firsts if first is not None]
+    if not firsts:
+        return []
+    month, last = min(firsts).replace(day=1), timezone.localdate().replace(day=1)
+    closed = []
+    while month < last:
+        if close_month(month, closed_by=closed_by):
+            closed.append(month)
+        month = month_bounds(month)[1] + timedelta(days=1)
+    return closed
+
+
+def reopen_month(month):
+    # Lift the close of the month containing `month` for the current
+    # campus, or for every campus outside one; returns the periods reopened
+    _, deleted = ClosedPeriod._base_manager.filter(
+        _campus_filter(_campus_keys()), month=month_bounds(month)[0],
+    ).delete()
+    return deleted.get(ClosedPeriod._meta.label, 0)
+
+
+def closed_months(start_date, end_date):
+    # Months wholly inside the range that are closed for the current
+    # campus (outside a campus: for every campus)
+    campus_ids = _campus_keys()
+    months = ClosedPeriod._base_manager.filter(
+        _campus_filter(campus_ids), month__range=[start_date, end_date],
+    ).values('month').annotate(campuses=Count('id')).filter(campuses=len(campus_ids)).values_list('month', flat=True)
+    return sorted(month for month in months if month_bounds(month)[1] <= end_date)
+
+
+def split_range(start_date, end_date):
+    """
+    Split a report range into (closed months, live ranges): the months to
+    read from snapshots and the (start, end) ranges left to aggregate.
+    """
+    months = closed_months(start_date, end_date)
+    live, cursor = [], start_date
+    for month in months:
+        if cursor < month:
+            live.append((cursor, month - timedelta(days=1)))
+        cursor = month_bounds(month)[1] + timedelta(days=1)
+    if cursor <= end_date:
+        live.append((cursor, end_date))
+    return months, live
+
+
+def snapshot_totals(months):
+    # {section: {item: amount}} over the snapshots of the closed `months`
+    totals = {}
+    if not months:
+        return totals
+    rows = PeriodSnapshot.objects.filter(
+        _campus_filter(_campus_keys(), prefix='period__'), period__month__in=months,
+    ).values('section', 'item').annotate(total=Sum('amount')).order_by()
+    for row in rows:
+        totals.setdefault(row['section'], {})[row['item']] = row['total']
+    return totals
+
+
+def closed_month(campus_id, day):
+    # First day of the month containing `day` if it is closed for
+    # `campus_id`, else None
+    if day is None:
+        return None
+    month = local_day(day).replace(day=1)
+    return month if ClosedPeriod._base_manager.filter(campus_id=campus_id, month=month).exists() else None
+
+
+def closed_in_scope():
+    # Months closed for any campus the current campus setting covers
+    return set(ClosedPeriod._base_manager.filter(_campus_filter(_campus_keys())).values_list('month', flat=True))
+
+
+def is_closed(day):
+    return local_day(day).replace(day=1) in closed_in_scope()
+
+
+def check_save(instance):
+    # Raise PeriodClosed if saving `instance` changes a closed month
+    date_field, fields = GUARDED[type(instance)]
+    new = {field: getattr(instance, field) for field in fields}
+    old = None
+    if instance.pk is not None:
+        old = type(instance)._base_manager.filter(pk=instance.pk).values(*fields).first()
+    if old == new:
+        return
+    for row in (old, new):
+        month = row and closed_month(row['campus_id'], row[date_field])
+        if month:
+            raise PeriodClosed(month)
+
+
+def check_delete(instance):
+    date_field = GUARDED[type(instance)][0]
+    if moving_to_archive():
+        return
+    month = closed_month(instance.campus_id, getattr(instance, date_field))
+    if month:
+        raise PeriodClosed(month)
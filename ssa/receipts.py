@@ -0,0 +1,103 @@
+# receipts.py
+# Receipt numbers come from per-series, per-year counters in ReceiptSequence.
+# Each process reserves a block of numbers with one locked UPDATE and hands
+# them out from memory, so most receipts cost no database round-trip.
+# Numbers left in a block when a process exits are never used: sequences
+# are unique and increasing, but may have gaps.
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ReceiptSequence
+
+FEE_SERIES = 'FEE'
+EXPENSE_SERIES = 'EXP'
+DEFAULT_BLOCK_SIZE = 50
+
+
+def reserve_block(series, year, size):
+    # Returns range(first, first + size), exclusively ours
+    while True:
+        with transaction.atomic():
+            updated = ReceiptSequence.objects.filter(series=series, year=year).update(
+                next_value=F('next_value') + size
+            )
+            if updated:
+                # The UPDATE holds the row lock until commit, so this read
+                # sees our own increment and nobody else's
+                end = ReceiptSequence.objects.filter(series=series, year=year).values_list(
+                    'next_value', flat=True
+                ).get()
+                return range(end - size, end)
+
+        try:
+            with transaction.atomic():
+                ReceiptSequence.objects.create(series=series, year=year, next_value=1 + size)
+                return range(1, 1 + size)
+        except IntegrityError:
+            # Another process created the row first; take a block from it
+            continue
+
+
+def format_receipt(series, year, number):
+    return f"{series}-{year}-{number:06d}"
+
+
+class ReceiptAllocator:
+    def __init__(self, series, block_size=DEFAULT_BLOCK_SIZE):
+        self.series = series
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._year = None
+        self._block = iter(())
+
+    def take(self, count=1):
+        """
+        Return `count` unused receipt numbers for the current year. Bulk
+        callers ask for all their numbers at once so a single reservation
+        covers the batch.
+        """
+        year = timezone.localdate().year
+        if transaction.get_connection().in_atomic_block:
+            # A rollback of the caller's transaction would also undo the
+            # reservation, so nothing from it may be kept for later callers
+            block = reserve_block(self.series, year, count)
+            return [format_receipt(self.series, year, number) for number in block]
+
+        numbers = []
+        with self._lock:
+            if year != self._year:
+                self._year = year
+                self._block = iter(())
+            while len(numbers) < count:
+                number = next(self._block, None)
+                if number is None:
+                    size = max(self.block_size, count - len(numbers))
+                    self._block = iter(reserve_block(self.series, year, size))
+                    continue
+                numbers.append(format_receipt(self.series, year, number))
+        return numbers
+
+    def next(self):
+        return self.take(1)[0]
+
+
+_allocators = {}
+_allocators_lock = threading.Lock()
+
+
+def get_allocator(series):
+    with _allocators_lock:
+        if series not in _allocators:
+            _allocators[series] = ReceiptAllocator(series)
+        return _allocators[series]
+
+
+def next_fee_receipt():
+    return get_allocator(FEE_SERIES).next()
+
+
+def next_expense_receipt():
+    return get_allocator(EXPENSE_SERIES).next()
@@ -0,0 +1,349 @@
+# reconciliation.py
+# Matches bank / mobile-money statement lines against open FeeCollection
+# rows. Open collections are loaded once into in-memory hash indexes; the
+# statement is streamed line by line; matched payments are written back
+# in bulk, one executemany per batch.
+import csv
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import changelog, closeout, periods, receipts, versioning
+from .models import FeeCollection
+from .utils import normalize_phone, update_rows
+
+OPEN_STATUSES = ['pending', 'partial', 'overdue']
+
+# Accepted header names for each statement column (compared lower-cased)
+COLUMN_ALIASES = {
+    'date': ['date', 'transaction date', 'value date', 'completion time'],
+    'amount': ['amount', 'credit', 'paid in', 'deposit'],
+    'reference': ['reference', 'ref', 'receipt', 'receipt no', 'account', 'account no', 'bill ref'],
+    'description': ['description', 'details', 'narrative', 'particulars'],
+    'phone': ['phone', 'msisdn', 'payer phone', 'mobile'],
+}
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y %H:%M']
+TOKEN = re.compile(r'[A-Za-z0-9][A-Za-z0-9/-]*')
+NON_ALNUM = re.compile(r'[^A-Z0-9]')
+
+
+class StatementError(Exception):
+    pass
+
+
+@dataclass
+class StatementLine:
+    line_number: int
+    date: object
+    amount: Decimal
+    reference: str = ''
+    description: str = ''
+    phone: str = ''
+    raw: dict = field(default_factory=dict)
+
+
+@dataclass
+class OpenCollection:
+    id: int
+    receipt_number: str
+    student_id: str
+    parent_phone: str
+    due_date: object
+    amount_due: Decimal
+    amount_paid: Decimal
+    notes: str
+    applied: Decimal = Decimal('0')
+    payment_date: object = None
+
+    @property
+    def outstanding(self):
+        return self.amount_due - self.amount_paid - self.applied
+
+
+@dataclass
+class ReconciliationResult:
+    matched: list = field(default_factory=list)      # (line, match_type, [(collection, amount)])
+    exceptions: list = field(default_factory=list)   # (line or None, reason)
+    lines_read: int = 0
+    collections_updated: int = 0
+
+    def summary(self):
+        counts = defaultdict(int)
+        for _, match_type, _ in self.matched:
+            counts[match_type] += 1
+        return {
+            'lines_read': self.lines_read,
+            'matched': len(self.matched),
+            'exceptions': len(self.exceptions),
+            'collections_updated': self.collections_updated,
+            **{f'matched_{key}': value for key, value in sorted(counts.items())},
+        }
+
+
+def _parse_amount(value):
+    try:
+        return Decimal(str(value).replace(',', '').strip())
+    except InvalidOperation:
+        raise StatementError(f"Invalid amount {value!r}")
+
+
+@lru_cache(maxsize=1024)
+def _parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise StatementError(f"Invalid date {value!r}")
+
+
+def read_statement(fh):
+    """
+    Yield StatementLine objects from a CSV statement, one at a time.
+    Lines that cannot be parsed are yielded as (line_number, error) tuples.
+    """
+    reader = csv.DictReader(fh)
+    headers = {name.strip().lower(): name for name in reader.fieldnames or []}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        columns[column] = next((headers[alias] for alias in aliases if alias in headers), None)
+    if columns['amount'] is None or columns['date'] is None:
+        raise StatementError("Statement needs at least a date and an amount column")
+
+    for line_number, row in enumerate(reader, start=2):
+        try:
+            amount = _parse_amount(row[columns['amount']])
+            if amount <= 0:
+                continue  # debits and zero lines are not fee payments
+            yield StatementLine(
+                line_number=line_number,
+                date=_parse_date((row[columns['date']] or '').strip()),
+                amount=amount,
+                reference=(row.get(columns['reference']) or '').strip() if columns['reference'] else '',
+                description=(row.get(columns['description']) or '').strip() if columns['description'] else '',
+                phone=(row.get(columns['phone']) or '').strip() if columns['phone'] else '',
+                raw=row,
+            )
+        except StatementError as exc:
+            yield (line_number, str(exc))
+
+
+class Reconciler:
+    def __init__(self):
+        self.by_id = {}
+        self.by_receipt = {}
+        self.by_receipt_key = {}
+        self.receipt_variants = defaultdict(set)
+        self.by_student = defaultdict(list)
+        self.by_phone = defaultdict(list)
+        # Payments dated in a closed month cannot be recorded (periods.py)
+        self.closed_months = periods.closed_in_scope()
+        self.closed_days = closeout.closed_days_in_scope()
+        self._load()
+
+    def _load(self):
+        # One query for every open collection, indexed three ways
+        rows = FeeCollection.objects.filter(payment_status__in=OPEN_STATUSES).values_list(
+            'id', 'receipt_number', 'student__student_id', 'student__parent_phone',
+            'due_date', 'amount_due', 'amount_paid', 'notes',
+        ).order_by('due_date', 'id')
+        for row in rows.iterator(chunk_size=5000):
+            collection = OpenCollection(*row)
+            self.by_id[collection.id] = collection
+            if collection.receipt_number:
+                self.by_receipt[collection.receipt_number.upper()] = collection
+                key = self._receipt_key(collection.receipt_number)
+                self.by_receipt_key[key] = collection
+                for variant in self._deletions(key):
+                    self.receipt_variants[variant].add(key)
+            self.by_student[collection.student_id.upper()].append(collection)
+            phone = normalize_phone(collection.parent_phone)
+            if phone:
+                self.by_phone[phone].append(collection)
+
+    @staticmethod
+    def _receipt_key(value):
+        # Receipt number without punctuation, for format-insensitive matching
+        return NON_ALNUM.sub('', value.upper())
+
+    @staticmethod
+    def _deletions(key):
+        # The key and every copy of it with one character dropped; two keys
+        # within one typo of each other always share one of these
+        return {key} | {key[:i] + key[i + 1:] for i in range(len(key))}
+
+    def _tokens(self, line):
+        return [token.upper() for token in TOKEN.findall(f"{line.reference} {line.description}")]
+
+    def _student_candidates(self, line):
+        for token in self._tokens(line):
+            if token in self.by_student:
+                return self.by_student[token], 'student'
+        phone = normalize_phone(line.phone)
+        if phone and phone in self.by_phone:
+            return self.by_phone[phone], 'phone'
+        return None, None
+
+    def match(self, line):
+        """
+        Return (match_type, [(collection, amount), ...]) or (None, reason).
+
+        Order of preference: the receipt number quoted in the reference; a
+        single open fee of the student (found by student ID in the
+        reference or by parent phone) with that amount; a split payment
+        covering several of the student's open fees oldest first; and a
+        fuzzy receipt-number match.
+        """
+        tokens = self._tokens(line)
+
+        for token in tokens:
+            collection = self.by_receipt.get(token)
+            if collection is not None and collection.outstanding > 0:
+                if line.amount <= collection.outstanding:
+                    return 'receipt', [(collection, line.amount)]
+                return None, f"Amount {line.amount} exceeds outstanding {collection.outstanding} on {token}"
+
+        candidates, via = self._student_candidates(line)
+        if candidates:
+            open_fees = [collection for collection in candidates if collection.outstanding > 0]
+            for collection in open_fees:
+                if collection.outstanding == line.amount:
+                    return via, [(collection, line.amount)]
+            total_outstanding = sum(collection.outstanding for collection in open_fees)
+            if open_fees and line.amount <= total_outstanding:
+                return 'split', self._allocate(open_fees, line.amount)
+            if open_fees:
+                return None, f"Amount {line.amount} exceeds student's outstanding {total_outstanding}"
+
+        for token in tokens:
+            # Fuzzy: same receipt with different punctuation, or one mistyped,
+            # missing or extra character. Candidates come from hash lookups,
+            # so this never scans the receipt list.
+            key = self._receipt_key(token)
+            collection = self.by_receipt_key.get(key)
+            if collection is None and len(key) > 4:
+                close = set()
+                for variant in self._deletions(key):
+                    close.update(self.receipt_variants.get(variant, ()))
+                if len(close) == 1:
+                    collection = self.by_receipt_key[close.pop()]
+            if collection is not None and 0 < line.amount <= collection.outstanding:
+                return 'fuzzy', [(collection, line.amount)]
+
+        return None, "No matching open fee"
+
+    def _allocate(self, open_fees, amount):
+        # Oldest due first; the last fee may be paid partially
+        allocation = []
+        remaining = amount
+        for collection in open_fees:
+            if remaining <= 0:
+                break
+            part = min(remaining, collection.outstanding)
+            allocation.append((collection, part))
+            remaining -= part
+        return allocation
+
+    def reconcile(self, lines):
+        result = ReconciliationResult()
+        for line in lines:
+            result.lines_read += 1
+            if isinstance(line, tuple):
+                result.exceptions.append((None, f"Line {line[0]}: {line[1]}"))
+                continue
+            if line.date.date().replace(day=1) in self.closed_months:
+                result.exceptions.append((line, f"{line.date:%B %Y} is closed"))
+                continue
+            if line.date.date() in self.closed_days:
+                result.exceptions.append((line, f"{line.date:%d %B %Y} is closed out"))
+                continue
+            match_type, outcome = self.match(line)
+            if match_type is None:
+                result.exceptions.append((line, outcome))
+                continue
+            for collection, amount in outcome:
+                collection.applied += amount
+                collection.payment_date = line.date
+            result.matched.append((line, match_type, outcome))
+        return result
+
+    def apply(self, result, payment_method, collected_by=None, batch_size=1000):
+        """
+        Write every matched payment back. Collections are updated once each,
+        however many statement lines paid into them. The rows are locked and
+        re-read first, so payments recorded since the collections were
+        loaded are added to, not overwritten; what no longer fits a
+        collection's balance is reported as an exception.
+        """
+        touched = {collection.id: collection for collection in self.by_id.values() if collection.applied > 0}
+        if not touched:
+            return 0
+
+        now = timezone.now()
+        rows = []
+        with transaction.atomic():
+            ids = sorted(touched)
+            current = []
+            for start in range(0, len(ids), batch_size):
+                current.extend(FeeCollection.objects.select_for_update().filter(pk__in=ids[start:start + batch_size]).values(
+                    'id', 'amount_due', 'amount_paid', 'receipt_number', 'notes',
+                ).order_by('id'))
+            applied = {}
+            for fresh in current:
+                collection = touched[fresh['id']]
+                applied[fresh['id']] = min(collection.applied, fresh['amount_due'] - fresh['amount_paid'])
+                if applied[fresh['id']] < collection.applied:
+                    last_line = [line for line, _, allocation in result.matched if any(
+                        paid.id == collection.id for paid, _ in allocation
+                    )][-1]
+                    result.exceptions.append((last_line, (
+                        f"{collection.applied - applied[fresh['id']]} not applied to fee {collection.id}: "
+                        f"paid since the statement was matched"
+                    )))
+            current = [fresh for fresh in current if applied[fresh['id']] > 0]
+            new_receipts = iter(receipts.get_allocator(receipts.FEE_SERIES).take(
+                sum(1 for fresh in current if not fresh['receipt_number'])
+            ))
+            for fresh in current:
+                collection = touched[fresh['id']]
+                amount_paid = fresh['amount_paid'] + applied[fresh['id']]
+                payment_date = collection.payment_date
+                if timezone.is_naive(payment_date):
+                    payment_date = timezone.make_aware(payment_date)
+                rows.append({
+                    'amount_paid': amount_paid,
+                    'payment_status': 'paid' if amount_paid >= fresh['amount_due'] else 'partial',
+                    'payment_method': payment_method,
+                    'payment_date': payment_date,
+                    'collected_by': collected_by.pk if collected_by else None,
+                    'receipt_number': fresh['receipt_number'] or next(new_receipts),
+                    'notes': (fresh['notes'] + "\n" if fresh['notes'] else '') + f"Reconciled {applied[fresh['id']]} from statement",
+                    'updated_at': now,
+                    'id': fresh['id'],
+                })
+            if rows:
+                update_rows(FeeCollection, rows, batch_size)
+                changelog.record(FeeCollection, [row['id'] for row in rows])
+                versioning.touch('fees')
+
+        result.collections_updated = len(rows)
+        return len(rows)
+
+
+def write_exceptions_report(result, fh):
+    writer = csv.writer(fh)
+    writer.writerow(['Line', 'Date', 'Amount', 'Reference', 'Description', 'Phone', 'Reason'])
+    for line, reason in result.exceptions:
+        if line is None:
+            writer.writerow(['', '', '', '', '', '', reason])
+        else:
+            writer.writerow([
+                line.line_number, line.date.date(), line.amount,
+                line.reference, line.description, line.phone, reason,
+            ])
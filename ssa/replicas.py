@@ -0,0 +1,114 @@
+# replicas.py
+# Routing of read-only analytic views to a read replica. Reads go to the
+# replica only inside read_from_replica() / @replica_reads, and never for a
+# user who wrote something within the last REPLICA_STICKY_SECONDS, so people
+# always see their own changes. That pin travels in a signed cookie, so it
+# holds whichever process serves the next request, with or without a
+# shared cache.
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+REPLICA_ALIAS = 'replica'
+PIN_COOKIE = 'ssa_primary'
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_use_replica = contextvars.ContextVar('ssa_use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def _sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+def pin_to_primary(response, user_id):
+    response.set_signed_cookie(PIN_COOKIE, str(user_id), salt=PIN_COOKIE, max_age=_sticky_seconds(), httponly=True)
+
+
+def is_pinned(request, user_id):
+    # The signature's timestamp bounds the pin even if the client keeps
+    # the cookie longer
+    pinned = request.get_signed_cookie(PIN_COOKIE, default=None, salt=PIN_COOKIE, max_age=_sticky_seconds())
+    return user_id is not None and pinned == str(user_id)
+
+
+@contextmanager
+def read_from_replica(pinned=False):
+    token = _use_replica.set(replica_configured() and not pinned)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def replica_reads(view_func):
+    # Apply inside the auth decorators so session and user lookups stay on
+    # the primary
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            user = await request.auser()
+            with read_from_replica(is_pinned(request, user.pk)):
+                return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with read_from_replica(is_pinned(request, request.user.pk)):
+            return view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get():
+            return REPLICA_ALIAS
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # A real replica gets its schema through replication; allowing it
+        # here lets a local SQLite replica be set up with migrate --database
+        return True
+
+
+class ReplicaStickinessMiddleware:
+    # Pins a user's reads to the primary for a short window after any
+    # write request, so replication lag never hides their own changes.
+    # Sync and async, so async views run without a thread switch
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if request.method in UNSAFE_METHODS and request.user.is_authenticated and replica_configured():
+            pin_to_primary(response, request.user.pk)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if request.method in UNSAFE_METHODS and replica_configured():
+            user = await request.auser()
+            if user.is_authenticated:
+                pin_to_primary(response, user.pk)
+        return response
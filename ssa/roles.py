@@ -0,0 +1,114 @@
+# roles.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.core.cache import cache
+from django.db.models import Subquery
+from django.utils.functional import SimpleLazyObject, cached_property
+
+from . import versioning
+from .models import DataVersion, Student, Teacher
+from .tenancy import use_campus
+
+CLASS_IDS_CACHE_TIMEOUT = 60 * 60
+# Data version bumped whenever any teacher's classes change
+ASSIGNMENTS_DOMAIN = 'assignments'
+
+
+def teacher_class_ids_cache_key(teacher_id, stamp):
+    return f'ssa:teacher:{teacher_id}:class_ids:{stamp.timestamp() if stamp else 0}'
+
+
+def assignments_changed():
+    # Called when a teacher's classes change. The version is school-wide,
+    # so every campus reads it
+    with use_campus(None):
+        versioning.touch(ASSIGNMENTS_DOMAIN)
+
+
+class RoleContext:
+    """
+    The signed-in user's role profile, resolved at most once per request.
+    A teacher's class IDs are also cached across requests, keyed on the
+    assignments data version, which is read with the teacher and bumped
+    when any teacher's classes change, so every process sees the change.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.user_type = getattr(user, 'user_type', None) if user.is_authenticated else None
+
+    @property
+    def is_admin(self):
+        return self.user_type == 'admin'
+
+    @property
+    def is_teacher(self):
+        return self.user_type == 'teacher'
+
+    @property
+    def is_student(self):
+        return self.user_type == 'student'
+
+    @cached_property
+    def teacher(self):
+        if not self.is_teacher:
+            return None
+        teacher = Teacher.objects.filter(user_id=self.user.pk).annotate(
+            assignments_version=Subquery(
+                DataVersion.objects.filter(domain=ASSIGNMENTS_DOMAIN).values('updated_at')[:1],
+            ),
+        ).first()
+        if teacher is not None:
+            teacher.user = self.user
+        return teacher
+
+    @cached_property
+    def student(self):
+        if not self.is_student:
+            return None
+        student = Student.objects.select_related('school_class').filter(user_id=self.user.pk).first()
+        if student is not None:
+            student.user = self.user
+        return student
+
+    @cached_property
+    def class_ids(self):
+        # IDs of the classes the teacher is assigned to (empty for other roles)
+        if self.teacher is None:
+            return frozenset()
+        key = teacher_class_ids_cache_key(self.teacher.pk, self.teacher.assignments_version)
+        class_ids = cache.get(key)
+        if class_ids is None:
+            class_ids = frozenset(self.teacher.classes.values_list('id', flat=True))
+            cache.set(key, class_ids, CLASS_IDS_CACHE_TIMEOUT)
+        return class_ids
+
+    def teaches_class(self, class_id):
+        return class_id in self.class_ids
+
+    def can_edit_student(self, student):
+        if self.is_admin:
+            return True
+        return self.is_teacher and self.teaches_class(student.school_class_id)
+
+
+class RoleContextMiddleware:
+    # Attaches request.role; must come after AuthenticationMiddleware.
+    # Sync and async, so async views run without a thread switch
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request.role = SimpleLazyObject(lambda: RoleContext(request.user))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.role = SimpleLazyObject(lambda: RoleContext(request.user))
+        return await self.get_response(request)
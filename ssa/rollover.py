@@ -0,0 +1,179 @@
+# rollover.py
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+
+from . import versioning
+from .models import AcademicYear, FeeStructure, FoodServiceSubscription, SchoolClass, Student, TransportAssignment
+from .utils import update_rows
+
+
+class RolloverError(Exception):
+    pass
+
+
+def _class_ids(progression):
+    # progression maps current class id -> next class id (None: leaving school)
+    return set(progression) | {to_id for to_id in progression.values() if to_id is not None}
+
+
+def _validate_progression(progression):
+    class_ids = _class_ids(progression)
+    known = set(SchoolClass.objects.filter(id__in=class_ids).values_list('id', flat=True))
+    unknown = class_ids - known
+    if unknown:
+        raise RolloverError(f"Unknown class ids in progression map: {sorted(unknown)}")
+
+
+def _promoted_counts(classes, progression):
+    # Headcount of every class once each student has moved along
+    # `progression` (leavers to no class), from the maintained
+    # enrolled_count instead of counting students
+    counts = {class_id: school_class.enrolled_count for class_id, school_class in classes.items()}
+    for from_id, to_id in progression.items():
+        counts[from_id] -= classes[from_id].enrolled_count
+        if to_id is not None:
+            counts[to_id] += classes[from_id].enrolled_count
+    return counts
+
+
+def _overfilled(classes, counts):
+    # Classes promotion would push past capacity (a class already over
+    # capacity only counts if it would grow)
+    return [
+        f"{school_class} ({counts[class_id]} of {school_class.capacity})"
+        for class_id, school_class in sorted(classes.items())
+        if counts[class_id] > school_class.capacity and counts[class_id] > school_class.enrolled_count
+    ]
+
+
+def preview(from_year, to_year, progression):
+    """
+    Counts of what rollover() would change, without changing anything.
+    """
+    _validate_progression(progression)
+    close_date = from_year.end_date
+
+    classes = SchoolClass.objects.in_bulk(_class_ids(progression))
+    moves = {from_id: to_id for from_id, to_id in progression.items() if to_id is not None}
+    per_class = {class_id: classes[class_id].enrolled_count for class_id in progression}
+    promoted = sum(per_class[from_id] for from_id in moves)
+
+    existing = set(
+        FeeStructure.objects.filter(academic_year=to_year.year).values_list('school_class_id', 'fee_type')
+    )
+    to_clone = sum(
+        1 for key in FeeStructure.objects.filter(
+            academic_year=from_year.year
+        ).values_list('school_class_id', 'fee_type')
+        if key not in existing
+    )
+
+    return {
+        'students_promoted': promoted,
+        'students_leaving': sum(per_class.values()) - promoted,
+        'students_by_class': per_class,
+        'classes_over_capacity': _overfilled(classes, _promoted_counts(classes, progression)),
+        'fee_structures_cloned': to_clone,
+        'transport_assignments_closed': _open_transport(close_date).count(),
+        'food_subscriptions_closed': _open_subscriptions(close_date).count(),
+    }
+
+
+def _open_transport(close_date):
+    return TransportAssignment.objects.filter(is_active=True).filter(
+        Q(end_date__isnull=True) | Q(end_date__gt=close_date)
+    )
+
+
+def _open_subscriptions(close_date):
+    return FoodServiceSubscription.objects.filter(is_active=True, end_date__gt=close_date)
+
+
+def rollover(from_year, to_year, progression, make_current=True):
+    """
+    Close `from_year` and open `to_year` in one transaction:
+
+    - move every student along `progression` with a single UPDATE (a CASE
+      over the old class, so chains like 1 -> 2 -> 3 move each student once),
+      refusing with RolloverError if a class would end up over capacity;
+      students of classes mapped to None leave the school: their class is
+      cleared and their seats freed
+    - clone from_year's fee structures to to_year with bulk_create
+    - end transport assignments and food subscriptions still open after
+      from_year's end date
+    """
+    _validate_progression(progression)
+    close_date = from_year.end_date
+    moves = {from_id: to_id for from_id, to_id in progression.items() if to_id is not None}
+
+    with transaction.atomic():
+        # Locking the classes holds back enrollments into them until the
+        # promotion commits, so the headcounts below stay exact
+        locked = SchoolClass.objects.select_for_update().filter(id__in=_class_ids(progression)).order_by('id')
+        classes = {school_class.id: school_class for school_class in locked}
+        counts = _promoted_counts(classes, progression)
+        overfilled = _overfilled(classes, counts)
+        if overfilled:
+            raise RolloverError(f"Promotion would put classes over capacity: {', '.join(overfilled)}")
+
+        # Leavers first, so a class both leaving and receiving students
+        # only loses the ones it had
+        leaving = [from_id for from_id, to_id in progression.items() if to_id is None]
+        left = Student.objects.filter(school_class_id__in=leaving).update(school_class=None) if leaving else 0
+        promoted = 0
+        if moves:
+            promoted = Student.objects.filter(school_class_id__in=moves).update(
+                school_class_id=Case(
+                    *[When(school_class_id=from_id, then=Value(to_id)) for from_id, to_id in moves.items()]
+                )
+            )
+        changed = [
+            {'enrolled_count': count, 'id': class_id}
+            for class_id, count in counts.items() if count != classes[class_id].enrolled_count
+        ]
+        if changed:
+            update_rows(SchoolClass, changed)
+
+        existing = set(
+            FeeStructure.objects.filter(academic_year=to_year.year).values_list('school_class_id', 'fee_type')
+        )
+        clones = [
+            FeeStructure(
+                campus_id=structure.campus_id,
+                school_class_id=structure.school_class_id,
+                fee_type=structure.fee_type,
+                amount=structure.amount,
+                is_mandatory=structure.is_mandatory,
+                academic_year=to_year.year,
+            )
+            for structure in FeeStructure.objects.filter(academic_year=from_year.year)
+            if (structure.school_class_id, structure.fee_type) not in existing
+        ]
+        FeeStructure.objects.bulk_create(clones, batch_size=500)
+
+        transport_closed = _open_transport(close_date).update(is_active=False, end_date=close_date)
+        food_closed = _open_subscriptions(close_date).update(is_active=False, end_date=close_date)
+
+        if promoted or left:
+            versioning.touch('students')
+        if transport_closed or food_closed:
+            versioning.touch('services')
+
+        if make_current:
+            to_year.is_current = True
+            to_year.save()
+
+    return {
+        'students_promoted': promoted,
+        'students_leaving': left,
+        'fee_structures_cloned': len(clones),
+        'transport_assignments_closed': transport_closed,
+        'food_subscriptions_closed': food_closed,
+    }
+
+
+def get_year(year):
+    try:
+        return AcademicYear.objects.get(year=year)
+    except AcademicYear.DoesNotExist:
+        raise RolloverError(f"Academic year {year} does not exist")
@@ -0,0 +1,149 @@
+# signals.py
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import changelog, closeout, dedup, periods, versioning
+from .models import (
+    CustomUser, Expense, FeeCollection, FeeStructure, FoodService, FoodServiceSubscription, Notification, PayrollRun,
+    SchoolClass, Student, StudentDataChange, Teacher, TransportAssignment, TransportRoute,
+)
+from .roles import assignments_changed
+from .tenancy import current_campus_id
+
+
+@receiver(m2m_changed, sender=Teacher.classes.through)
+def teacher_classes_changed(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        assignments_changed()
+
+
+# Class headcounts. Runs inside the deletion's transaction, also for
+# students deleted by a queryset delete or a cascade.
+@receiver(post_delete, sender=Student)
+def student_deleted(sender, instance, **kwargs):
+    SchoolClass.objects.release_seats(instance.school_class_id)
+
+
+# Duplicate detection keys (see dedup.py) follow the names, birth date
+# and parent phone
+MATCH_FIELDS = {
+    Student: {'date_of_birth', 'parent_phone'},
+    CustomUser: {'first_name', 'last_name'},
+}
+
+
+@receiver(post_save, sender=Student)
+def student_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or MATCH_FIELDS[Student] & set(update_fields):
+        dedup.refresh_keys([instance])
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or instance.user_type != 'student':
+        return
+    if update_fields is None or MATCH_FIELDS[CustomUser] & set(update_fields):
+        dedup.refresh_keys(Student._base_manager.filter(user=instance).select_related('user'))
+
+
+# Campus of new campus-owned rows: the parent row's campus, else the
+# campus the row is created in. Bulk code paths set it themselves.
+CAMPUS_PARENTS = {
+    SchoolClass: None,
+    Teacher: 'user',
+    Student: 'school_class',
+    FeeStructure: 'school_class',
+    FeeCollection: 'student',
+    TransportRoute: None,
+    TransportAssignment: 'student',
+    FoodService: None,
+    FoodServiceSubscription: 'student',
+    StudentDataChange: 'student',
+    Notification: 'recipient',
+    Expense: None,
+    PayrollRun: None,
+}
+
+
+def fill_campus(sender, instance, **kwargs):
+    if instance.campus_id is not None:
+        return
+    parent = CAMPUS_PARENTS[sender]
+    if parent and getattr(instance, f'{parent}_id') is not None:
+        instance.campus_id = getattr(instance, parent).campus_id
+    if instance.campus_id is None:
+        instance.campus_id = current_campus_id()
+
+
+for model in CAMPUS_PARENTS:
+    pre_save.connect(fill_campus, sender=model, dispatch_uid=f'fill_campus_{model.__name__}')
+
+
+# Closed periods (see periods.py). Connected after fill_campus so new rows
+# are checked against their own campus's periods.
+def guard_closed_period_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        periods.check_save(instance)
+
+
+def guard_closed_period_delete(sender, instance, **kwargs):
+    periods.check_delete(instance)
+
+
+for model in periods.GUARDED:
+    pre_save.connect(guard_closed_period_save, sender=model, dispatch_uid=f'closed_period_save_{model.__name__}')
+    pre_delete.connect(guard_closed_period_delete, sender=model, dispatch_uid=f'closed_period_delete_{model.__name__}')
+
+
+# Closed-out days (see closeout.py)
+@receiver(pre_save, sender=FeeCollection)
+def guard_closed_out_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        closeout.check_save(instance)
+
+
+@receiver(pre_delete, sender=FeeCollection)
+def guard_closed_out_delete(sender, instance, **kwargs):
+    closeout.check_delete(instance)
+
+
+# Data versions for conditional GET
+VERSIONED_MODELS = {
+    FeeCollection: ('fees',),
+    Expense: ('expenses',),
+    Student: ('students',),
+    SchoolClass: ('students',),
+    TransportRoute: ('services',),
+    TransportAssignment: ('services',),
+    FoodService: ('services',),
+    FoodServiceSubscription: ('services',),
+}
+
+
+def bump_data_version(sender, instance, **kwargs):
+    versioning.touch(*VERSIONED_MODELS[sender], campus_id=getattr(instance, 'campus_id', None))
+
+
+# Connected per model: a sender-less post_delete receiver would stop Django
+# fast-deleting every other model
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_data_version, sender=model, dispatch_uid=f'bump_data_version_save_{model.__name__}')
+    post_delete.connect(bump_data_version, sender=model, dispatch_uid=f'bump_data_version_delete_{model.__name__}')
+
+
+# Change feed for external accounting. FeeCollection.save and Expense.save
+# are atomic, so the entry commits with the row; deletes run inside the
+# deletion collector's transaction. Rows moved to the archive are history,
+# not deletions, and are not logged.
+def log_saved(sender, instance, **kwargs):
+    changelog.record(sender, [instance.pk], 'upsert')
+
+
+def log_deleted(sender, instance, **kwargs):
+    if not periods.moving_to_archive():
+        changelog.record(sender, [instance.pk], 'delete')
+
+
+for model in changelog.FEED_NAMES:
+    post_save.connect(log_saved, sender=model, dispatch_uid=f'changelog_save_{model.__name__}')
+    post_delete.connect(log_deleted, sender=model, dispatch_uid=f'changelog_delete_{model.__name__}')
@@ -0,0 +1,157 @@
+# stats.py
+# Aggregate queries shared by the dashboards and chart APIs. Each function
+# issues one query (plus one on the archive when it reaches back into
+# archived history) and returns plain Python data, so the sync views can
+# call them in turn and the async views can run them concurrently.
+from datetime import timedelta
+
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import archive
+from .models import Expense, FeeCollection, SchoolClass, Student, Teacher
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def total_students():
+    return Student.objects.count()
+
+
+def total_teachers():
+    return Teacher.objects.count()
+
+
+def fee_totals():
+    open_fees = Q(payment_status__in=['pending', 'partial'])
+    paid = Q(payment_status='paid')
+    totals = FeeCollection.objects.aggregate(
+        total_due=Sum('amount_due'),
+        total_collected=Sum('amount_paid'),
+        pending=Sum(F('amount_due') - F('amount_paid'), filter=open_fees, output_field=MONEY),
+        transport_revenue=Sum('amount_paid', filter=paid & Q(fee_structure__fee_type='transport')),
+        food_revenue=Sum('amount_paid', filter=paid & Q(fee_structure__fee_type='food')),
+    )
+    # Archived rows are all paid, so they add to every total except pending
+    archived = archive.archived_fee_state()
+    return {
+        key: (value or 0) + (archived.get(key) or 0)
+        for key, value in totals.items()
+    }
+
+
+def expense_totals():
+    totals = Expense.objects.aggregate(
+        total=Sum('amount'),
+        transport=Sum('amount', filter=Q(category__in=['fuel', 'transport_cost'])),
+        food=Sum('amount', filter=Q(category='food_cost')),
+    )
+    return {key: value or 0 for key, value in totals.items()}
+
+
+def pending_fees():
+    return FeeCollection.objects.filter(
+        payment_status__in=['pending', 'partial']
+    ).aggregate(
+        total=Sum(F('amount_due') - F('amount_paid'), output_field=MONEY)
+    )['total'] or 0
+
+
+def current_month_revenue():
+    month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return sum(
+        source.filter(
+            payment_date__gte=month_start,
+            payment_status='paid'
+        ).aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0
+        for source in archive.paid_sources(month_start.date())
+    )
+
+
+def monthly_revenue(months=12):
+    # Paid collections per calendar month for the last `months` months
+    # (at least one), oldest first, with empty months filled in as zero
+    today = timezone.localdate()
+    month_starts = []
+    month = today.replace(day=1)
+    for _ in range(max(months, 1)):
+        month_starts.append(month)
+        month = (month - timedelta(days=1)).replace(day=1)
+    month_starts.reverse()
+
+    by_month = {}
+    for source in archive.paid_sources(month_starts[0]):
+        rows = source.filter(
+            payment_status='paid',
+            payment_date__date__gte=month_starts[0],
+        ).annotate(
+            month=TruncMonth('payment_date')
+        ).values('month').annotate(
+            total=Sum('amount_paid')
+        ).order_by('month')
+        for row in rows:
+            month = row['month'].date()
+            by_month[month] = by_month.get(month, 0) + row['total']
+
+    return [
+        {'month': start.strftime('%b %Y'), 'amount': float(by_month.get(start) or 0)}
+        for start in month_starts
+    ]
+
+
+def fee_collection_by_status():
+    by_status = {
+        row['payment_status']: row
+        for row in FeeCollection.objects.values('payment_status').annotate(
+            count=Count('id'),
+            due=Sum('amount_due'),
+            paid=Sum('amount_paid'),
+        ).order_by()
+    }
+    # Archived rows are all paid (see archive.py)
+    archived = archive.archived_fee_state()
+    if archived.get('count'):
+        paid = by_status.setdefault('paid', {'payment_status': 'paid', 'count': 0, 'due': 0, 'paid': 0})
+        paid['count'] += archived['count']
+        paid['due'] = (paid['due'] or 0) + (archived['total_due'] or 0)
+        paid['paid'] = (paid['paid'] or 0) + (archived['total_collected'] or 0)
+    return [
+        {
+            'status': status,
+            'count': row['count'],
+            'due': float(row['due'] or 0),
+            'paid': float(row['paid'] or 0),
+        }
+        for status, row in sorted(by_status.items())
+    ]
+
+
+def student_class_distribution():
+    # Maintained headcounts (see enrollment.py), read in (name, section)
+    # index order
+    return [
+        {'class': str(school_class), 'students': school_class.enrolled_count, 'capacity': school_class.capacity}
+        for school_class in SchoolClass.objects.only(
+            'name', 'section', 'enrolled_count', 'capacity',
+        ).order_by('name', 'section')
+    ]
+
+
+def expense_by_category():
+    labels = dict(Expense.EXPENSE_CATEGORIES)
+    rows = Expense.objects.values('category').annotate(total=Sum('amount')).order_by('category')
+    return [
+        {'category': labels.get(row['category'], row['category']), 'amount': float(row['total'] or 0)}
+        for row in rows
+    ]
+
+
+def recent_enrollments(limit=5):
+    return list(Student.objects.select_related('user', 'school_class').order_by('-enrollment_date')[:limit])
+
+
+def recent_payments(limit=5):
+    return list(FeeCollection.objects.select_related(
+        'student__user', 'fee_structure'
+    ).filter(payment_status='paid').order_by('-payment_date')[:limit])
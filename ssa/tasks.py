@@ -0,0 +1,84 @@
+# tasks.py
+import csv
+import io
+from datetime import datetime
+
+from django.db import transaction
+
+from . import billing, delivery, documents, enrollment, exports, jobs, payroll
+from .jobs import task
+from .models import FeeCollection, Student
+from .replicas import read_from_replica
+
+
+@task('generate_food_billing')
+def generate_food_billing(job, month, academic_year):
+    job.set_progress(10, "Computing food service charges")
+    period_start, period_end = billing.month_bounds(datetime.strptime(month, '%Y-%m').date())
+    return billing.generate_food_fee_collections(period_start, period_end, academic_year)
+
+
+@task('render_fee_statements')
+def render_fee_statements(job, academic_year, class_id=None):
+    job.set_progress(5, "Loading fee records")
+    students = Student.objects.all()
+    if class_id:
+        students = students.filter(school_class_id=class_id)
+    contexts = documents.statement_contexts(academic_year, students)
+
+    def progress(done, total):
+        job.set_progress(10 + int(85 * done / total), f"Rendered {done} of {total} statements")
+
+    paths, rendered = documents.render_batch('statement', contexts, progress=progress)
+    return {
+        'statements': len(paths), 'rendered': rendered, 'cached': len(paths) - rendered,
+        'pruned': documents.prune(),
+    }
+
+
+@task('deliver_notifications')
+def deliver_notifications(job):
+    job.set_progress(10, "Building digests")
+    created = delivery.build_digests()
+    job.set_progress(30, f"Sending {created} new deliveries")
+    return {'created': created, **delivery.send_due()}
+
+
+@task('run_payroll')
+def run_payroll(job, month):
+    job.set_progress(10, "Recording salary expenses")
+    run = payroll.run_payroll(datetime.strptime(month, '%Y-%m').date(), run_by=job.created_by)
+    if run is None:
+        return {'paid': 0, 'total_amount': '0.00'}
+    return {'run': run.id, 'paid': run.teachers_paid, 'skipped': run.teachers_skipped, 'total_amount': str(run.total_amount)}
+
+
+@task('import_students')
+def import_students(job, csv_text, allow_duplicates=False):
+    # All rows or none; problems are the result, not a failure to retry
+    job.set_progress(10, "Importing students")
+    try:
+        imported = enrollment.import_students(csv.DictReader(io.StringIO(csv_text)), allow_duplicates=allow_duplicates)
+    except enrollment.StudentImportError as exc:
+        return {'imported': 0, 'errors': exc.errors[:20], 'error_count': len(exc.errors)}
+    return {'imported': imported}
+
+
+@task('send_fee_reminders')
+def send_fee_reminders(job, fee_ids):
+    job.set_progress(10, "Creating reminders")
+    # Sending is a job of its own, so a gateway failure retries the
+    # sending without creating the reminders again
+    with transaction.atomic():
+        created = delivery.create_fee_reminders(FeeCollection.objects.filter(id__in=fee_ids), sender=job.created_by)
+        if created:
+            jobs.enqueue('deliver_notifications', created_by=job.created_by)
+    return {'reminders': created}
+
+
+@task('export_csv')
+def export_csv(job, name):
+    job.set_progress(10, "Writing export")
+    with read_from_replica():
+        filename, rows = exports.write_export(name, job.id)
+    return {'file': filename, 'rows': rows}
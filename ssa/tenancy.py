@@ -0,0 +1,101 @@
+# tenancy.py
+# Campus scoping. Campus-owned models (see CampusManager in models.py)
+# filter every query on their default manager by the current campus, set
+# per request by CampusMiddleware and per job by jobs.run_job(). Outside a
+# campus (management commands, users without a campus) queries see every
+# campus. Querysets take the filter when they are built, so a queryset
+# created inside a campus keeps it wherever it is evaluated.
+#
+# Per-campus data versions and cache keys keep each campus's dashboards
+# and reports independent of writes to the others (see versioning.py).
+import contextvars
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+SESSION_KEY = 'ssa_campus_id'
+
+_current_campus = contextvars.ContextVar('ssa_current_campus', default=None)
+
+
+def current_campus_id():
+    return _current_campus.get()
+
+
+@contextmanager
+def use_campus(campus_id):
+    # use_campus(None) lifts the scoping, for code that must see every campus
+    token = _current_campus.set(campus_id)
+    try:
+        yield
+    finally:
+        _current_campus.reset(token)
+
+
+def campus_cache_suffix(campus_id):
+    return f'campus:{campus_id}' if campus_id is not None else 'campus:all'
+
+
+def cache_suffix():
+    # Appended to cache keys of campus-dependent results
+    return campus_cache_suffix(current_campus_id())
+
+
+def scoped(queryset):
+    # Re-apply the current campus to a queryset built elsewhere, e.g. the
+    # choices of a form field created when the form class was defined
+    from .models import CampusManager
+
+    campus_id = current_campus_id()
+    if campus_id is None or not isinstance(queryset.model._default_manager, CampusManager):
+        return queryset
+    return queryset.filter(campus_id=campus_id)
+
+
+def request_campus_id(request):
+    # A user's own campus; admins without one may pick a campus for their
+    # session (see views.switch_campus) or work across all campuses
+    user = request.user
+    if not user.is_authenticated:
+        return None
+    if user.campus_id is not None:
+        return user.campus_id
+    if user.user_type == 'admin':
+        return request.session.get(SESSION_KEY)
+    return None
+
+
+async def arequest_campus_id(request):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return None
+    if user.campus_id is not None:
+        return user.campus_id
+    if user.user_type == 'admin':
+        return await request.session.aget(SESSION_KEY)
+    return None
+
+
+class CampusMiddleware:
+    # Must come after AuthenticationMiddleware. Sync and async, so async
+    # views run without a thread switch
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request.campus_id = request_campus_id(request)
+        with use_campus(request.campus_id):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.campus_id = await arequest_campus_id(request)
+        with use_campus(request.campus_id):
+            return await self.get_response(request)
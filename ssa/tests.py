@@ -1,3 +1,1342 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.http import HttpResponse, JsonResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from .models import (
+    AcademicYear, ArchivedFeeCollection, Campus, ChangeLogEntry, ClassFull, CustomUser, DayClosedOut, Delivery, Expense, FeeCollection, FeeStructure, FoodService,
+    FoodServiceSubscription, Job, Notification, PayrollRun, PeriodClosed, ReceiptSequence, SchoolClass, Student, Teacher,
+    TransportAssignment, TransportRoute,
+)
+from . import aging, analytics, archive, async_views, billing, changelog, closeout, dedup, delivery, documents, enrollment, exports, facets, jobs, paginators, payroll, periods, receipts, reconciliation, replicas, roles, rollover, stats, tenancy, throttling, versioning, views
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.admin = CustomUser.objects.create_user(username='admin', password='x', user_type='admin')
+
+    def get(self, view, **headers):
+        request = self.factory.get('/api/chart/', headers=headers)
+        request.user = self.admin
+        return view(request)
+
+    def add_expense(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Expense.objects.create(category='fuel', description='Diesel', amount=100, date=date.today())
+
+    def test_unchanged_data_returns_304(self):
+        first = self.get(views.expense_category_chart_api)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.has_header('ETag'))
+        self.assertTrue(first.has_header('Last-Modified'))
+
+        second = self.get(views.expense_category_chart_api, if_none_match=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    def test_write_to_domain_changes_etag(self):
+        first = self.get(views.expense_category_chart_api)
+        self.add_expense()
+
+        second = self.get(views.expense_category_chart_api, if_none_match=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+    def test_write_to_other_domain_keeps_etag(self):
+        first = self.get(views.fee_collection_chart_api)
+        self.add_expense()
+
+        second = self.get(views.fee_collection_chart_api, if_none_match=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    def test_not_modified_skips_aggregate_queries(self):
+        first = self.get(views.expense_category_chart_api)
+        # Only the data version lookup runs
+        with self.assertNumQueries(1):
+            response = self.get(views.expense_category_chart_api, if_none_match=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+def _allocate_receipts(count, queue):
+    # Runs in a forked child; it must not share the parent's connection
+    connections.close_all()
+    allocator = receipts.ReceiptAllocator('TST', block_size=7)
+    try:
+        queue.put([allocator.next() for _ in range(count)])
+    finally:
+        connections.close_all()
+
+
+class AsyncViewTests(TransactionTestCase):
+    # The async views run their queries on worker threads with their own
+    # connections, which only see committed data
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.admin = CustomUser.objects.create_user(username='admin', password='x', user_type='admin')
+
+    async def get(self, view, path='/api/chart/', **headers):
+        request = self.factory.get(path, headers=headers)
+        admin_id = self.admin.pk
+        # Lazy, like the one AuthenticationMiddleware sets
+        request.user = SimpleLazyObject(lambda: CustomUser.objects.get(pk=admin_id))
+
+        async def auser():
+            return self.admin
+        request.auser = auser
+        return await view(request)
+
+    async def test_chart_api_answers_conditional_get(self):
+        first = await self.get(async_views.expense_category_chart_api)
+        self.assertEqual(first.status_code, 200)
+        second = await self.get(async_views.expense_category_chart_api, if_none_match=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+    async def test_months_is_validated(self):
+        response = await self.get(async_views.monthly_revenue_api, '/api/monthly-revenue/?months=abc')
+        self.assertEqual(response.status_code, 400)
+        response = await self.get(async_views.monthly_revenue_api, '/api/monthly-revenue/?months=-1')
+        self.assertEqual(len(json.loads(response.content)['data']), 1)
+
+    async def test_middleware_runs_async_views_without_a_thread_switch(self):
+        campus = await Campus.objects.acreate(code='N', name='North')
+        user = await CustomUser.objects.acreate(username='teacher', user_type='teacher', campus=campus)
+
+        async def view(request):
+            return HttpResponse(f"{tenancy.current_campus_id()} {request.role.user_type}")
+
+        handler = roles.RoleContextMiddleware(tenancy.CampusMiddleware(replicas.ReplicaStickinessMiddleware(view)))
+        self.assertTrue(iscoroutinefunction(handler))
+        request = self.factory.post('/')
+        request.user = user
+
+        async def auser():
+            return user
+        request.auser = auser
+        response = await handler(request)
+        self.assertEqual(response.content, f"{campus.pk} teacher".encode())
+
+    async def test_dashboard_renders_off_the_event_loop(self):
+        # base.html reads request.user, a query under ASGI
+        def render(request, template_name, context):
+            return HttpResponse(f"{request.user.username}: {context['total_students']} students")
+
+        with mock.patch.object(async_views, 'render', render):
+            response = await self.get(async_views.admin_dashboard, '/admin-dashboard/')
+        self.assertEqual(response.content, b'admin: 0 students')
+
+
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = CustomUser.objects.create_user(username='admin', password='x', user_type='admin')
+
+        @replicas.replica_reads
+        def report(request):
+            return HttpResponse(replicas.ReplicaRouter().db_for_read(FeeCollection))
+        self.report = report
+
+    def read(self, cookies=None):
+        request = self.factory.get('/reports/')
+        request.COOKIES.update(cookies or {})
+        request.user = self.user
+        return self.report(request).content.decode()
+
+    def write(self):
+        request = self.factory.post('/fees/add/')
+        request.user = self.user
+        return replicas.ReplicaStickinessMiddleware(lambda request: HttpResponse())(request)
+
+    @mock.patch.object(replicas, 'replica_configured', return_value=True)
+    def test_writer_reads_from_primary_in_any_process(self, configured):
+        self.assertEqual(self.read(), 'replica')
+        response = self.write()
+        # Another process's cache knows nothing of the write
+        cache.clear()
+        cookies = {name: morsel.value for name, morsel in response.cookies.items()}
+        self.assertEqual(self.read(cookies), 'default')
+
+        other = CustomUser.objects.create_user(username='other', password='x', user_type='admin')
+        self.user = other
+        self.assertEqual(self.read(cookies), 'replica')
+
+        with override_settings(REPLICA_STICKY_SECONDS=0):
+            time.sleep(1)
+            self.user = CustomUser.objects.get(username='admin')
+            self.assertEqual(self.read(cookies), 'replica')
+
+
+class JobTests(TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def flaky(job, fail=False):
+            self.calls.append(job.attempts)
+            if fail:
+                raise RuntimeError("boom")
+            return {'attempt': job.attempts}
+
+        patcher = mock.patch.dict(jobs.registry, {'flaky': flaky})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_claim_and_run(self):
+        queued = jobs.enqueue('flaky')
+        job = jobs.claim_next('worker-1')
+        self.assertEqual((job.pk, job.status, job.attempts, job.worker), (queued.pk, 'running', 1, 'worker-1'))
+        self.assertIsNone(jobs.claim_next('worker-2'))
+
+        jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result), ('succeeded', {'attempt': 1}))
+
+    def test_failures_back_off_then_fail(self):
+        queued = jobs.enqueue('flaky', max_attempts=2, fail=True)
+        jobs.run_job(jobs.claim_next('worker-1'))
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, 'queued')
+        self.assertGreater(queued.run_after, timezone.now())
+        self.assertIsNone(jobs.claim_next('worker-1'))
+
+        Job.objects.filter(pk=queued.pk).update(run_after=timezone.now())
+        jobs.run_job(jobs.claim_next('worker-1'))
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, self.calls), ('failed', [1, 2]))
+        self.assertIn("RuntimeError: boom", queued.error)
+
+    def test_only_jobs_of_dead_workers_are_requeued(self):
+        alive, dead, spent = [jobs.enqueue('flaky', max_attempts=attempts) for attempts in (3, 3, 1)]
+        for job, worker in [(alive, 'alive'), (dead, 'dead'), (spent, 'dead')]:
+            Job.objects.filter(pk=job.pk).update(
+                status='running', worker=worker, attempts=1, started_at=timezone.now() - timedelta(hours=2),
+                heartbeat_at=timezone.now() - timedelta(hours=1),
+            )
+        # A long-running job of a live worker keeps beating
+        self.assertEqual(jobs.heartbeat('alive'), 1)
+
+        self.assertEqual(jobs.requeue_stale(timedelta(minutes=5)), 1)
+        self.assertEqual(
+            dict(Job.objects.values_list('pk', 'status')), {alive.pk: 'running', dead.pk: 'queued', spent.pk: 'failed'},
+        )
+
+    def test_import_problems_are_the_result(self):
+        job = jobs.enqueue('import_students', csv_text="student_id,first_name\nST001,A\n")
+        jobs.run_job(jobs.claim_next('worker-1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result['imported'], job.result['error_count']), ('succeeded', 0, 1))
+
+    def test_export_is_written_for_download(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(EXPORT_DIR=directory):
+            Expense.objects.create(category='fuel', description='Diesel', amount=100, date=date(2024, 1, 5))
+            job = jobs.enqueue('export_csv', name='expenses')
+            jobs.run_job(jobs.claim_next('worker-1'))
+            job.refresh_from_db()
+            self.assertEqual(job.result['rows'], 1)
+            with open(exports.export_path(job.result['file']), newline='') as fh:
+                self.assertEqual([row[3] for row in csv.reader(fh)], ['Description', 'Diesel'])
+
+            # The download answers conditional GET; the file never changes
+            admin = CustomUser.objects.create_user(username='admin', user_type='admin')
+            request = RequestFactory().get('/download/')
+            request.user = admin
+            response = views.job_download(request, job.pk)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+            request = RequestFactory().get('/download/', headers={'if-none-match': response['ETag']})
+            request.user = admin
+            self.assertEqual(views.job_download(request, job.pk).status_code, 304)
+
+
+class DocumentTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings_override = override_settings(DOCUMENT_CACHE_DIR=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def contexts(self, count):
+        return {n: {'receipt_number': f'FEE-2024-{n:06d}', 'amount_paid': n} for n in range(count)}
+
+    @mock.patch.object(documents, 'MIN_POOL_BATCH', 1)
+    def test_batch_renders_in_spawned_workers(self):
+        paths, rendered = documents.render_batch('receipt', self.contexts(4), workers=2)
+        self.assertEqual(rendered, 4)
+        self.assertIn('FEE-2024-000003', paths[3].read_text())
+        self.assertEqual(documents.render_batch('receipt', self.contexts(4), workers=2)[1], 0)
+
+    def test_prune_keeps_documents_still_in_use(self):
+        paths, rendered = documents.render_batch('receipt', self.contexts(2))
+        month_ago = time.time() - 31 * 24 * 60 * 60
+        for path in paths.values():
+            os.utime(path, (month_ago, month_ago))
+        # Serving a cached document marks it as used
+        documents.render_one('receipt', self.contexts(1)[0])
+
+        self.assertEqual(documents.prune(), 1)
+        self.assertEqual([path.exists() for path in paths.values()], [True, False])
+
+
+class RoleContextTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.taught, self.other = SchoolClass.objects.create(name='Grade 1'), SchoolClass.objects.create(name='Grade 2')
+        self.teacher_user = CustomUser.objects.create_user(username='teacher', user_type='teacher')
+        self.teacher = Teacher.objects.create(
+            user=self.teacher_user, employee_id='T001', salary=1000, hire_date=date(2020, 1, 1), qualification='BEd',
+        )
+        self.teacher.classes.add(self.taught)
+        self.students = {}
+        for student_id, school_class in [('ST001', self.taught), ('ST002', self.other)]:
+            user = CustomUser.objects.create_user(username=student_id, user_type='student')
+            self.students[student_id] = Student.objects.create(
+                user=user, student_id=student_id, school_class=school_class, roll_number='1',
+                date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+            )
+
+    def test_teacher_edits_only_students_of_their_classes(self):
+        role = roles.RoleContext(self.teacher_user)
+        self.assertEqual((role.teacher, role.student), (self.teacher, None))
+        self.assertTrue(role.can_edit_student(self.students['ST001']))
+        self.assertFalse(role.can_edit_student(self.students['ST002']))
+
+        admin = roles.RoleContext(CustomUser.objects.create_user(username='admin', user_type='admin'))
+        self.assertTrue(admin.can_edit_student(self.students['ST002']))
+        student = roles.RoleContext(self.students['ST001'].user)
+        self.assertEqual((student.student, student.class_ids), (self.students['ST001'], frozenset()))
+        self.assertFalse(student.can_edit_student(self.students['ST001']))
+
+    def test_class_ids_are_cached_until_assignments_change(self):
+        self.assertEqual(roles.RoleContext(self.teacher_user).class_ids, {self.taught.pk})
+        with self.assertNumQueries(1):  # the teacher; the class IDs come from the cache
+            roles.RoleContext(self.teacher_user).class_ids
+
+        # Assignment changes bump the data version after commit
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.classes.add(self.other)
+        self.assertEqual(roles.RoleContext(self.teacher_user).class_ids, {self.taught.pk, self.other.pk})
+        # Clearing a class's teachers from the class side
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.teacher_set.clear()
+        self.assertEqual(roles.RoleContext(self.teacher_user).class_ids, {self.taught.pk})
+
+        # Written without signals, as by another process: seen on the bump
+        Teacher.classes.through.objects.create(teacher=self.teacher, schoolclass=self.other)
+        self.assertEqual(roles.RoleContext(self.teacher_user).class_ids, {self.taught.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            roles.assignments_changed()
+        self.assertEqual(roles.RoleContext(self.teacher_user).class_ids, {self.taught.pk, self.other.pk})
+
+
+class ReceiptAllocatorTests(TestCase):
+    def test_take_inside_transaction_reserves_only_what_it_uses(self):
+        # TestCase runs inside a transaction, so nothing may be cached
+        allocator = receipts.ReceiptAllocator('FEE', block_size=10)
+        numbers = allocator.take(3)
+        self.assertEqual(len(set(numbers)), 3)
+        self.assertTrue(all(number.startswith('FEE-') for number in numbers))
+        self.assertEqual(ReceiptSequence.objects.get(series='FEE').next_value, 4)
+
+    def test_blocks_do_not_overlap(self):
+        first = receipts.reserve_block('EXP', 2026, 5)
+        second = receipts.reserve_block('EXP', 2026, 5)
+        self.assertEqual(list(first), [1, 2, 3, 4, 5])
+        self.assertEqual(list(second), [6, 7, 8, 9, 10])
+        self.assertEqual(ReceiptSequence.objects.get(series='EXP', year=2026).next_value, 11)
+
+
+class ReceiptAllocatorContentionTests(TransactionTestCase):
+    def test_concurrent_processes_get_unique_numbers(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("Processes cannot share an in-memory SQLite database")
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [context.Process(target=_allocate_receipts, args=(40, queue)) for _ in range(4)]
+        connections.close_all()
+        for worker in workers:
+            worker.start()
+        allocated = [number for _ in workers for number in queue.get(timeout=60)]
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(allocated), 160)
+        self.assertEqual(len(set(allocated)), 160)
+
+
+@override_settings(DELIVERY_BACKENDS={'sms': 'ssa.delivery.LocalGateway', 'email': 'ssa.delivery.LocalGateway'})
+class DeliveryTests(TestCase):
+    def setUp(self):
+        delivery.LocalGateway.outbox = []
+        delivery.LocalGateway.fail_addresses = set()
+        self.admin = CustomUser.objects.create_user(username='admin', user_type='admin')
+        self.user = CustomUser.objects.create_user(username='pupil', email='pupil@example.com', user_type='student')
+        Student.objects.create(
+            user=self.user, student_id='ST001', school_class=SchoolClass.objects.create(name='Grade 1'),
+            roll_number='1', date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+
+    def notify(self, title, notification_type='fee_reminder'):
+        return Notification.objects.create(
+            title=title, message=f"{title} message", notification_type=notification_type,
+            recipient=self.user, sender=self.admin,
+        )
+
+    def test_notifications_are_coalesced_per_recipient_and_channel(self):
+        self.notify("Term 1 fees")
+        self.notify("Lab fees")
+        self.notify("Edited", notification_type='data_change')
+
+        self.assertEqual(delivery.build_digests(), 2)
+        sms = Delivery.objects.get(channel='sms')
+        self.assertEqual(sms.address, '0712345678')
+        self.assertEqual(len(sms.notification_ids), 2)
+        self.assertEqual(Delivery.objects.get(channel='email').subject, "You have 2 new notifications")
+        self.assertEqual(Notification.objects.filter(digested_at__isnull=True).count(), 1)
+        # Nothing left to digest
+        self.assertEqual(delivery.build_digests(), 0)
+
+        self.assertEqual(delivery.send_due(), {'sent': 2, 'pending': 0, 'failed': 0})
+        self.assertEqual(len(delivery.LocalGateway.outbox), 2)
+        self.assertFalse(Delivery.objects.exclude(status='sent').exists())
+
+    def test_failed_sends_back_off_then_fail(self):
+        delivery.LocalGateway.fail_addresses = {'0712345678'}
+        self.notify("Term 1 fees")
+        delivery.build_digests()
+
+        self.assertEqual(delivery.send_due(), {'sent': 1, 'pending': 1, 'failed': 0})
+        sms = Delivery.objects.get(channel='sms')
+        self.assertEqual(sms.status, 'pending')
+        self.assertEqual(sms.attempts, 1)
+        self.assertGreater(sms.next_attempt_at, sms.created_at)
+
+        for _ in range(delivery.MAX_ATTEMPTS - 1):
+            Delivery.objects.filter(pk=sms.pk).update(next_attempt_at=sms.created_at)
+            delivery.send_due()
+        sms.refresh_from_db()
+        self.assertEqual(sms.status, 'failed')
+        self.assertEqual(sms.attempts, delivery.MAX_ATTEMPTS)
+
+    @override_settings(
+        DELIVERY_BACKENDS={'sms': 'ssa.delivery.HttpSmsGateway', 'email': 'ssa.delivery.LocalGateway'},
+        SMS_GATEWAY={'URL': ''},
+    )
+    def test_unconfigured_sms_gateway_refuses_to_send(self):
+        self.notify("Term 1 fees")
+        delivery.build_digests()
+        with self.assertRaises(ImproperlyConfigured):
+            delivery.send_due()
+        self.assertFalse(Delivery.objects.exclude(status='pending').exists())
+
+
+@mock.patch.object(changelog, 'SETTLE_DELAY', timedelta(0))
+class ChangeFeedTests(TestCase):
+    def add_expense(self, description):
+        return Expense.objects.create(category='fuel', description=description, amount=100, date=date(2026, 1, 5))
+
+    def test_feed_returns_latest_state_and_tombstones(self):
+        kept = self.add_expense("Diesel")
+        removed = self.add_expense("Petrol")
+        kept.amount = 150
+        kept.save()
+        removed_id = removed.pk
+        removed.delete()
+
+        changes, cursor, has_more = changelog.changes_since(None)
+        self.assertFalse(has_more)
+        self.assertEqual([(c['id'], c['action']) for c in changes], [(kept.pk, 'upsert'), (removed_id, 'delete')])
+        self.assertEqual(changes[0]['data']['amount'], 150)
+        self.assertIsNone(changes[1]['data'])
+
+        # Only later changes after the cursor
+        self.assertEqual(changelog.changes_since(cursor)[0], [])
+        newer = self.add_expense("Oil")
+        self.assertEqual([c['id'] for c in changelog.changes_since(cursor)[0]], [newer.pk])
+
+    def test_pages_and_rejects_tampered_cursor(self):
+        for n in range(5):
+            self.add_expense(f"Item {n}")
+        first, cursor, has_more = changelog.changes_since(None, limit=3)
+        self.assertEqual(len(first), 3)
+        self.assertTrue(has_more)
+        second, cursor, has_more = changelog.changes_since(cursor, limit=3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse(has_more)
+
+        with self.assertRaises(changelog.InvalidCursor):
+            changelog.changes_since(cursor + 'x')
+
+    def test_unsettled_entries_are_held_back(self):
+        self.add_expense("Diesel")
+        with mock.patch.object(changelog, 'SETTLE_DELAY', timedelta(minutes=5)):
+            changes, cursor, has_more = changelog.changes_since(None)
+        self.assertEqual(changes, [])
+        self.assertEqual(len(changelog.changes_since(cursor)[0]), 1)
+
+    def test_archived_rows_are_not_deletions(self):
+        school_class = SchoolClass.objects.create(name='Grade 1')
+        user = CustomUser.objects.create_user(username='ST001', user_type='student')
+        student = Student.objects.create(
+            user=user, student_id='ST001', school_class=school_class, roll_number='1',
+            date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+        structure = FeeStructure.objects.create(
+            school_class=school_class, fee_type='tuition', amount=100, academic_year='2020-2021',
+        )
+        fee = FeeCollection.objects.create(
+            student=student, fee_structure=structure, amount_due=100, amount_paid=100, payment_status='paid',
+            payment_date=timezone.now(), due_date=date(2021, 1, 31),
+        )
+        ChangeLogEntry.objects.all().delete()
+
+        self.assertEqual(archive.move_in_batches(FeeCollection.objects.filter(pk=fee.pk), ArchivedFeeCollection), 1)
+        self.assertFalse(ChangeLogEntry.objects.exists())
+
+
+class EnrollmentTests(TestCase):
+    def setUp(self):
+        self.small = SchoolClass.objects.create(name='Grade 1', capacity=1)
+        self.large = SchoolClass.objects.create(name='Grade 2', capacity=30)
+
+    def enroll(self, student_id, school_class, **kwargs):
+        user = CustomUser.objects.create_user(username=student_id, user_type='student')
+        student = Student(
+            user=user, student_id=student_id, school_class=school_class,
+            roll_number='1', date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+        student.save(**kwargs)
+        return student
+
+    def counts(self):
+        return dict(SchoolClass.objects.values_list('name', 'enrolled_count'))
+
+    def test_counts_follow_create_move_and_delete(self):
+        student = self.enroll('ST001', self.small)
+        self.enroll('ST002', self.large)
+        self.assertEqual(self.counts(), {'Grade 1': 1, 'Grade 2': 1})
+
+        student = Student.objects.get(pk=student.pk)
+        student.school_class = self.large
+        student.save()
+        self.assertEqual(self.counts(), {'Grade 1': 0, 'Grade 2': 2})
+
+        Student.objects.filter(student_id='ST001').delete()
+        self.assertEqual(self.counts(), {'Grade 1': 0, 'Grade 2': 1})
+        self.assertEqual(enrollment.reconcile(), [])
+
+    def test_capacity_is_enforced(self):
+        self.enroll('ST001', self.small, enforce_capacity=True)
+        with self.assertRaises(ClassFull):
+            self.enroll('ST002', self.small, enforce_capacity=True)
+        self.assertEqual(self.counts()['Grade 1'], 1)
+
+        with self.assertRaises(enrollment.StudentImportError):
+            enrollment.import_students([{
+                'student_id': 'ST003', 'first_name': 'A', 'last_name': 'B', 'class_id': str(self.small.id),
+                'date_of_birth': '2015-01-01', 'parent_name': 'P', 'parent_phone': '0712345678',
+            }])
+        self.assertFalse(Student.objects.filter(student_id='ST003').exists())
+
+    def test_reconcile_repairs_drift(self):
+        self.enroll('ST001', self.large)
+        SchoolClass.objects.filter(pk=self.large.pk).update(enrolled_count=7)
+
+        drifted = enrollment.reconcile()
+        self.assertEqual([(school_class.pk, recorded, actual) for school_class, recorded, actual in drifted],
+                         [(self.large.pk, 7, 1)])
+        self.assertEqual(self.counts()['Grade 2'], 1)
+
+    def test_leaving_an_unreconciled_class_keeps_its_count_at_zero(self):
+        # Classes that existed before the counts did start at 0
+        self.enroll('ST001', self.large)
+        self.enroll('ST002', self.large)
+        SchoolClass.objects.filter(pk=self.large.pk).update(enrolled_count=0)
+
+        Student.objects.get(student_id='ST001').delete()
+        student = Student.objects.get(student_id='ST002')
+        student.school_class = self.small
+        student.save()
+        self.assertEqual(self.counts(), {'Grade 1': 1, 'Grade 2': 0})
+
+
+class RolloverTests(TestCase):
+    def setUp(self):
+        self.lower = SchoolClass.objects.create(name='Grade 1')
+        self.upper = SchoolClass.objects.create(name='Grade 2', capacity=1)
+        for student_id, school_class in [('ST001', self.lower), ('ST002', self.upper)]:
+            user = CustomUser.objects.create_user(username=student_id, user_type='student')
+            Student.objects.create(
+                user=user, student_id=student_id, school_class=school_class,
+                roll_number='1', date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+            )
+        self.from_year = AcademicYear.objects.create(
+            year='2023-2024', start_date=date(2023, 9, 1), end_date=date(2024, 7, 31), is_current=True,
+        )
+        self.to_year = AcademicYear.objects.create(year='2024-2025', start_date=date(2024, 9, 1), end_date=date(2025, 7, 31))
+
+    def test_leavers_free_their_seats(self):
+        # Grade 2 leaves, so Grade 1's student fits into its single seat
+        progression = {self.lower.pk: self.upper.pk, self.upper.pk: None}
+        preview = rollover.preview(self.from_year, self.to_year, progression)
+        self.assertEqual((preview['students_leaving'], preview['classes_over_capacity']), (1, []))
+
+        result = rollover.rollover(self.from_year, self.to_year, progression)
+        self.assertEqual((result['students_promoted'], result['students_leaving']), (1, 1))
+        self.assertEqual(
+            dict(Student.objects.values_list('student_id', 'school_class_id')), {'ST001': self.upper.pk, 'ST002': None},
+        )
+        self.assertEqual(dict(SchoolClass.objects.values_list('name', 'enrolled_count')), {'Grade 1': 0, 'Grade 2': 1})
+        self.assertEqual(enrollment.reconcile(), [])
+
+    def test_current_year_follows_the_years_version(self):
+        cache.clear()
+        self.assertEqual(AcademicYear.get_current(), self.from_year)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.to_year.is_current = True
+                self.to_year.save()
+                # Other connections still see the old year until commit
+                self.assertEqual(AcademicYear.get_current(), self.from_year)
+        self.assertEqual(AcademicYear.get_current(), self.to_year)
+
+        # Another process switches back: this one only sees the version bump
+        AcademicYear.objects.filter(pk=self.to_year.pk).update(is_current=False)
+        AcademicYear.objects.filter(pk=self.from_year.pk).update(is_current=True)
+        self.assertEqual(AcademicYear.get_current(), self.to_year)
+        with self.captureOnCommitCallbacks(execute=True):
+            versioning.touch('years')
+        self.assertEqual(AcademicYear.get_current(), self.from_year)
+
+
+class ServiceProfitabilityTests(TestCase):
+    def setUp(self):
+        school_class = SchoolClass.objects.create(name='Grade 1')
+        self.structures = {
+            fee_type: FeeStructure.objects.create(school_class=school_class, fee_type=fee_type, amount=0, academic_year='2024-2025')
+            for fee_type in ('transport', 'food')
+        }
+        self.students = []
+        for number in range(2):
+            user = CustomUser.objects.create_user(username=f'pupil{number}', user_type='student')
+            self.students.append(Student.objects.create(
+                user=user, student_id=f'ST00{number}', school_class=school_class, roll_number=str(number),
+                date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+            ))
+
+    def fee(self, student, fee_type, due, paid):
+        FeeCollection.objects.create(
+            student=student, fee_structure=self.structures[fee_type], amount_due=paid, amount_paid=paid, due_date=due,
+        )
+
+    def route(self, name):
+        return TransportRoute.objects.create(
+            route_name=name, pickup_points='', monthly_fee=50, driver_name='Driver', driver_phone='0700000000',
+            vehicle_number=name, capacity=30,
+        )
+
+    def test_transport_lines_windows_and_costs(self):
+        north, south = self.route('North'), self.route('South')
+        first, second = self.students
+        # Moves from North to South mid-February: February's fee is split
+        TransportAssignment.objects.create(student=first, route=north, start_date=date(2024, 1, 1), end_date=date(2024, 2, 14))
+        TransportAssignment.objects.create(student=first, route=south, start_date=date(2024, 2, 15))
+        TransportAssignment.objects.create(student=second, route=south, start_date=date(2024, 1, 10))
+        for month in (1, 2):
+            self.fee(first, 'transport', date(2024, month, 1), 40)
+            self.fee(second, 'transport', date(2024, month, 1), 60)
+        Expense.objects.create(category='fuel', description='Fuel', amount=100, date=date(2024, 1, 20))
+        Expense.objects.create(category='transport_cost', description='Tyres', amount=30, date=date(2024, 2, 3), route=north)
+
+        result = analytics.service_profitability('transport', date(2024, 1, 1), date(2024, 2, 29))
+        rows = {(row['line_name'], row['month'].month): row for row in result['rows']}
+
+        self.assertEqual(rows['North', 1]['collected'], Decimal('40.00'))
+        self.assertEqual(rows['North', 2]['collected'], Decimal('20.00'))
+        self.assertEqual(rows['South', 2]['collected'], Decimal('80.00'))
+        self.assertEqual(rows['North', 2]['previous_collected'], Decimal('40.00'))
+        self.assertEqual(rows['North', 2]['collected_change'], Decimal('-20.00'))
+        self.assertEqual(rows['South', 2]['running_collected'], Decimal('140.00'))
+        # January fuel shared one student each; February's tyres are North's
+        self.assertEqual(rows['North', 1]['cost'], Decimal('50.00'))
+        self.assertEqual(rows['North', 2]['cost'], Decimal('30.00'))
+        self.assertEqual(rows['North', 2]['margin'], Decimal('-10.00'))
+        self.assertEqual(rows['North', 2]['margin_change'], Decimal('0.00'))
+        self.assertEqual(sum(row['collected'] for row in result['rows']), Decimal('200.00'))
+
+    def test_food_fees_split_by_rate(self):
+        breakfast = FoodService.objects.create(meal_type='breakfast', daily_rate=1, monthly_rate=20)
+        lunch = FoodService.objects.create(meal_type='lunch', daily_rate=2, monthly_rate=40)
+        first, second = self.students
+        for service in (breakfast, lunch):
+            FoodServiceSubscription.objects.create(
+                student=first, food_service=service, start_date=date(2024, 1, 1), end_date=date(2024, 12, 31),
+            )
+        self.fee(first, 'food', date(2024, 3, 1), 60)
+        self.fee(second, 'food', date(2024, 3, 1), 10)  # no subscription
+
+        result = analytics.service_profitability('food', date(2024, 3, 1), date(2024, 3, 31))
+        collected = {row['line_name']: row['collected'] for row in result['rows']}
+        self.assertEqual(collected, {
+            'Breakfast': Decimal('20.00'), 'Lunch': Decimal('40.00'), 'Unassigned': Decimal('10.00'),
+        })
+
+
+class FoodBillingTests(TestCase):
+    def setUp(self):
+        school_class = SchoolClass.objects.create(name='Grade 1')
+        FeeStructure.objects.create(school_class=school_class, fee_type='food', amount=0, academic_year='2024-2025')
+        service = FoodService.objects.create(meal_type='lunch', daily_rate=5, monthly_rate=100)
+        # (start, end) of each student's subscription
+        for number, (start, end) in enumerate([
+            (date(2024, 1, 1), date(2024, 12, 31)),  # the whole month: monthly rate
+            (date(2024, 3, 22), date(2024, 6, 30)),  # 10 days: daily rate
+            (date(2024, 3, 1), date(2024, 3, 25)),   # 25 days: capped at the monthly rate
+        ]):
+            user = CustomUser.objects.create_user(username=f'ST00{number}', user_type='student')
+            student = Student.objects.create(
+                user=user, student_id=f'ST00{number}', school_class=school_class, roll_number='1',
+                date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+            )
+            FoodServiceSubscription.objects.create(student=student, food_service=service, start_date=start, end_date=end)
+        self.period = (date(2024, 3, 1), date(2024, 3, 31))
+
+    def test_charges_are_prorated_in_sql(self):
+        charges = billing.billable_subscriptions(*self.period).order_by('student__student_id')
+        self.assertEqual([(row.billed_days, row.charge) for row in charges], [(31, 100), (10, 50), (25, 100)])
+
+    def test_repeated_runs_bill_once(self):
+        first = billing.generate_food_fee_collections(*self.period, academic_year='2024-2025')
+        second = billing.generate_food_fee_collections(*self.period, academic_year='2024-2025')
+        self.assertEqual((first['created'], second['created'], second['skipped']), (3, 0, 3))
+        self.assertEqual(sorted(FeeCollection.objects.values_list('amount_due', flat=True)), [50, 100, 100])
+
+    def test_report_falls_back_to_the_current_month(self):
+        request = RequestFactory().get('/food-service-reports/?month=foo')
+        request.user = CustomUser.objects.create_user(username='admin', user_type='admin')
+        rendered = {}
+
+        def render(request, template_name, context):
+            rendered.update(context)
+            return HttpResponse()
+
+        with mock.patch.object(views, 'render', render), mock.patch.object(views.messages, 'error') as error:
+            self.assertEqual(views.food_service_reports(request).status_code, 200)
+        self.assertEqual(rendered['period_start'], timezone.now().date().replace(day=1))
+        error.assert_called_once()
+
+
+class PayrollTests(TestCase):
+    def setUp(self):
+        staff = [(1000, date(2020, 1, 1)), (1500, date(2024, 3, 10)), (900, date(2024, 5, 1))]
+        for number, (salary, hired) in enumerate(staff):
+            user = CustomUser.objects.create_user(username=f'teacher{number}', user_type='teacher')
+            Teacher.objects.create(
+                user=user, employee_id=f'EMP{number}', salary=Decimal(salary), hire_date=hired, qualification='BEd',
+            )
+
+    def test_run_pays_each_teacher_once_per_month(self):
+        run = payroll.run_payroll(date(2024, 3, 15))
+        self.assertEqual((run.month, run.teachers_paid, run.total_amount), (date(2024, 3, 1), 2, Decimal('2500.00')))
+        expenses = Expense.objects.filter(payroll_run=run)
+        self.assertEqual(sorted(expenses.values_list('amount', flat=True)), [Decimal('1000.00'), Decimal('1500.00')])
+        self.assertTrue(all(expense.date == date(2024, 3, 31) and expense.receipt_number for expense in expenses))
+        self.assertEqual(ChangeLogEntry.objects.filter(model='expense').count(), 2)
+
+        self.assertIsNone(payroll.run_payroll(date(2024, 3, 1)))
+        self.assertEqual(payroll.preview(date(2024, 3, 1))['already_paid'], 2)
+
+        # A new hire is picked up by a later run for the same month
+        Teacher.objects.filter(employee_id='EMP2').update(hire_date=date(2024, 3, 20))
+        run = payroll.run_payroll(date(2024, 3, 1))
+        self.assertEqual((run.teachers_paid, run.teachers_skipped), (1, 2))
+        self.assertEqual(Expense.objects.filter(category='salary', payroll_month=date(2024, 3, 1)).count(), 3)
+        self.assertEqual(PayrollRun.objects.count(), 2)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        school_class = SchoolClass.objects.create(name='Grade 1')
+        user = CustomUser.objects.create_user(username='ST001', user_type='student')
+        student = Student.objects.create(
+            user=user, student_id='ST001', school_class=school_class, roll_number='1',
+            date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+        last_year = timezone.localdate().year - 1
+        AcademicYear.objects.create(
+            year=f'{last_year - 1}-{last_year}', start_date=date(last_year - 1, 9, 1), end_date=date(last_year, 7, 31),
+        )
+        old, current = [
+            FeeStructure.objects.create(school_class=school_class, fee_type=fee_type, amount=100, academic_year=year)
+            for fee_type, year in [('tuition', f'{last_year - 1}-{last_year}'), ('food', 'current')]
+        ]
+        # A late payment of last year's fee, made this month, and a fee of
+        # this year paid the same day
+        self.today = timezone.now()
+        for structure, amount in [(old, 100), (current, 40)]:
+            FeeCollection.objects.create(
+                student=student, fee_structure=structure, amount_due=amount, amount_paid=amount,
+                payment_status='paid', payment_date=self.today, due_date=self.today.date(),
+            )
+        FeeCollection.objects.create(student=student, fee_structure=current, amount_due=60, due_date=self.today.date())
+        self.assertEqual(archive.move_in_batches(archive.archivable_fee_collections(), ArchivedFeeCollection), 1)
+
+    def test_totals_include_archived_fees(self):
+        day = self.today.date()
+        self.assertEqual(archive.paid_by_fee_type(day, day), {'tuition': 100, 'food': 40})
+        totals = stats.fee_totals()
+        self.assertEqual((totals['total_collected'], totals['pending'], totals['food_revenue']), (140, 60, 40))
+
+    def test_revenue_charts_include_archived_fees(self):
+        self.assertEqual(stats.current_month_revenue(), 140)
+        self.assertEqual(stats.monthly_revenue(1)[0]['amount'], 140.0)
+        self.assertEqual(stats.fee_collection_by_status(), [
+            {'status': 'paid', 'count': 2, 'due': 140.0, 'paid': 140.0},
+            {'status': 'pending', 'count': 1, 'due': 60.0, 'paid': 0.0},
+        ])
+
+    def test_dashboard_includes_archived_fees(self):
+        request = RequestFactory().get('/admin-dashboard/')
+        request.user = CustomUser.objects.create_user(username='admin', user_type='admin')
+        with mock.patch.object(views, 'render', lambda request, template_name, context: context):
+            context = views.admin_dashboard(request)
+        self.assertEqual((context['total_fees_collected'], context['food_revenue']), (140, 40))
+        self.assertEqual(context['monthly_collections'][-1]['amount'], 140.0)
+
+    def test_state_follows_the_archive_version(self):
+        self.assertEqual(archive.archived_fee_state()['count'], 1)
+        paid = FeeCollection.objects.filter(payment_status='paid')
+        with self.captureOnCommitCallbacks() as callbacks:
+            archive.move_in_batches(paid, ArchivedFeeCollection)
+        # Cached until the run commits and bumps the version, which every
+        # process reads
+        self.assertEqual(archive.archived_fee_state()['count'], 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(archive.archived_fee_state()['count'], 2)
+
+
+class PeriodCloseTests(TestCase):
+    def setUp(self):
+        school_class = SchoolClass.objects.create(name='Grade 1')
+        user = CustomUser.objects.create_user(username='ST001', user_type='student')
+        student = Student.objects.create(
+            user=user, student_id='ST001', school_class=school_class, roll_number='1',
+            date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+        structure = FeeStructure.objects.create(
+            school_class=school_class, fee_type='tuition', amount=300, academic_year='2023-2024',
+        )
+        self.fee = FeeCollection.objects.create(
+            student=student, fee_structure=structure, amount_due=300, amount_paid=300, payment_status='paid',
+            payment_date=timezone.make_aware(datetime(2024, 1, 10, 9)), due_date=date(2024, 1, 31),
+        )
+        FeeCollection.objects.create(
+            student=student, fee_structure=structure, amount_due=300, due_date=date(2024, 1, 31),
+        )
+        self.january = Expense.objects.create(category='fuel', description='Fuel', amount=100, date=date(2024, 1, 5))
+        Expense.objects.create(category='fuel', description='Fuel', amount=40, date=date(2024, 2, 5))
+
+    def test_reports_read_snapshots_of_closed_months(self):
+        live = views.financial_summary(date(2024, 1, 1), date(2024, 2, 29))
+        self.assertEqual((live['total_income'], live['total_expenses']), (300, 140))
+
+        [period] = periods.close_month(date(2024, 1, 1))
+        self.assertEqual(
+            {(row.section, row.item): row.amount for row in period.snapshots.all()},
+            {('income', 'tuition'): 300, ('expense', 'fuel'): 100, ('outstanding', 'tuition'): 300},
+        )
+        self.assertEqual(periods.split_range(date(2023, 12, 20), date(2024, 2, 29)), (
+            [date(2024, 1, 1)], [(date(2023, 12, 20), date(2023, 12, 31)), (date(2024, 2, 1), date(2024, 2, 29))],
+        ))
+
+        # Changed behind the guard's back: the report still shows the close
+        Expense.objects.filter(pk=self.january.pk).update(amount=999)
+        self.assertEqual(views.financial_summary(date(2024, 1, 1), date(2024, 2, 29)), live)
+        self.assertEqual(views.financial_summary(date(2024, 1, 2), date(2024, 1, 31))['total_expenses'], 999)
+
+    def test_closed_months_reject_changes(self):
+        periods.close_month(date(2024, 1, 1))
+        self.january.amount = 150
+        with self.assertRaises(PeriodClosed):
+            self.january.save()
+        with self.assertRaises(PeriodClosed):
+            Expense.objects.create(category='fuel', description='Late', amount=5, date=date(2024, 1, 20))
+        with self.assertRaises(PeriodClosed), transaction.atomic():
+            self.fee.delete()
+        with self.assertRaises(PeriodClosed):
+            payroll.run_payroll(date(2024, 1, 1))
+
+        # Fields outside the figures stay editable; open months are unaffected
+        self.fee.notes = 'Paid by cheque'
+        self.fee.save()
+        Expense.objects.create(category='fuel', description='Fuel', amount=5, date=date(2024, 2, 20))
+
+        self.assertEqual(periods.reopen_month(date(2024, 1, 1)), 1)
+        self.january.save()
+
+
+class AgingTests(TestCase):
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(name='Grade 1')
+        user = CustomUser.objects.create_user(username='ST001', user_type='student')
+        self.student = Student.objects.create(
+            user=user, student_id='ST001', school_class=self.school_class, roll_number='1',
+            date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+        self.tuition = FeeStructure.objects.create(
+            school_class=self.school_class, fee_type='tuition', amount=100, academic_year='2024-2025',
+        )
+        self.today = date(2024, 6, 30)
+        # (days past due, amount due, amount paid, status)
+        for days, due, paid, status in [
+            (-5, 100, 0, 'pending'), (0, 100, 40, 'partial'), (30, 100, 0, 'overdue'), (31, 100, 0, 'pending'),
+            (90, 100, 0, 'pending'), (91, 100, 0, 'pending'), (200, 100, 100, 'paid'),
+        ]:
+            FeeCollection.objects.create(
+                student=self.student, fee_structure=self.tuition, amount_due=due, amount_paid=paid,
+                payment_status=status, due_date=self.today - timedelta(days=days),
+            )
+
+    def test_report_buckets_balances_in_one_query(self):
+        with self.assertNumQueries(1):
+            report = aging.aging_report(self.today)
+        [row] = report['rows']
+        self.assertEqual((row['student__school_class_id'], row['fee_structure__fee_type']), (self.school_class.pk, 'tuition'))
+        self.assertEqual(
+            {bucket: row[bucket] for bucket in aging.BUCKETS},
+            {'not_due': 100, 'days_0_30': 160, 'days_31_60': 100, 'days_61_90': 100, 'days_over_90': 100},
+        )
+        self.assertEqual(report['totals']['total'], 560)
+
+    def test_detail_pages_by_keyset(self):
+        first, cursor = aging.aging_detail('days_0_30', as_of=self.today, limit=1)
+        self.assertEqual([fee.due_date for fee in first], [self.today - timedelta(days=30)])
+        second, cursor = aging.aging_detail('days_0_30', as_of=self.today, after=cursor, limit=1)
+        self.assertEqual([(fee.due_date, fee.balance) for fee in second], [(self.today, 60)])
+        self.assertIsNone(cursor)
+
+    def test_summary_is_cached_until_fees_change(self):
+        cache.clear()
+        self.assertEqual(aging.cached_summary()['total'], 560)
+        with self.assertNumQueries(1):  # the data version lookup
+            aging.cached_summary()
+        with self.captureOnCommitCallbacks(execute=True):
+            FeeCollection.objects.create(
+                student=self.student, fee_structure=self.tuition, amount_due=50, due_date=date(2030, 1, 1),
+            )
+        self.assertEqual(aging.cached_summary()['total'], 610)
+
+
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        school_class = SchoolClass.objects.create(name='Grade 1')
+        user = CustomUser.objects.create_user(username='ST001', user_type='student')
+        self.student = Student.objects.create(
+            user=user, student_id='ST001', school_class=school_class, roll_number='1',
+            date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+        structure = FeeStructure.objects.create(
+            school_class=school_class, fee_type='tuition', amount=100, academic_year='2024-2025',
+        )
+        self.older, self.newer = [
+            FeeCollection.objects.create(
+                student=self.student, fee_structure=structure, amount_due=100, due_date=due_date,
+                receipt_number=receipt_number,
+            )
+            for due_date, receipt_number in [(date(2024, 1, 31), 'FEE-2024-000001'), (date(2024, 2, 29), None)]
+        ]
+
+    def line(self, amount, reference='', phone='', day=date(2024, 3, 5)):
+        return reconciliation.StatementLine(
+            line_number=2, date=datetime.combine(day, datetime.min.time()), amount=Decimal(amount),
+            reference=reference, phone=phone,
+        )
+
+    def test_matching(self):
+        reconciler = reconciliation.Reconciler()
+        self.assertEqual(reconciler.match(self.line(40, 'FEE-2024-000001')), ('receipt', [(reconciler.by_id[self.older.pk], 40)]))
+        self.assertEqual(reconciler.match(self.line(100, phone='+254 712 345 678'))[0], 'phone')
+        match_type, allocation = reconciler.match(self.line(150, 'ST001'))
+        self.assertEqual(match_type, 'split')
+        self.assertEqual([(collection.id, amount) for collection, amount in allocation], [(self.older.pk, 100), (self.newer.pk, 50)])
+        self.assertEqual(reconciler.match(self.line(40, 'FEE2024-00001'))[0], 'fuzzy')
+        self.assertEqual(reconciler.match(self.line(40, 'nothing')), (None, "No matching open fee"))
+        self.assertIsNone(reconciler.match(self.line(101, 'FEE-2024-000001'))[0])
+
+    def test_exceptions(self):
+        periods.close_month(date(2024, 1, 1))
+        statement = io.StringIO(
+            "Date,Amount,Reference\n"
+            "2024-01-10,50,ST001\n"
+            "not a date,50,ST001\n"
+            "2024-03-05,50,unknown\n"
+            "2024-03-05,50,ST001\n"
+        )
+        result = reconciliation.Reconciler().reconcile(reconciliation.read_statement(statement))
+        self.assertEqual(result.summary()['matched'], 1)
+        self.assertEqual([reason for line, reason in result.exceptions], [
+            "January 2024 is closed", "Line 3: Invalid date 'not a date'", "No matching open fee",
+        ])
+
+    def test_apply_adds_to_payments_made_since_loading(self):
+        reconciler = reconciliation.Reconciler()
+        result = reconciler.reconcile([self.line(150, 'ST001')])
+        # A cashier takes a payment after the statement was matched
+        FeeCollection.objects.filter(pk=self.newer.pk).update(amount_paid=30, payment_status='partial')
+
+        self.assertEqual(reconciler.apply(result, 'bank_transfer'), 2)
+        self.older.refresh_from_db()
+        self.newer.refresh_from_db()
+        self.assertEqual((self.older.amount_paid, self.older.payment_status), (100, 'paid'))
+        self.assertEqual((self.newer.amount_paid, self.newer.payment_status), (80, 'partial'))
+        self.assertEqual(self.older.receipt_number, 'FEE-2024-000001')
+        self.assertTrue(self.newer.receipt_number.startswith('FEE-'))
+
+    def test_apply_reports_what_no_longer_fits(self):
+        reconciler = reconciliation.Reconciler()
+        result = reconciler.reconcile([self.line(150, 'ST001')])
+        # Paid in full at the counter in the meantime
+        FeeCollection.objects.filter(pk=self.older.pk).update(amount_paid=100, payment_status='paid')
+        FeeCollection.objects.filter(pk=self.newer.pk).update(amount_paid=70, payment_status='partial')
+
+        self.assertEqual(reconciler.apply(result, 'bank_transfer'), 1)
+        self.older.refresh_from_db()
+        self.newer.refresh_from_db()
+        self.assertEqual(self.older.amount_paid, 100)
+        self.assertEqual((self.newer.amount_paid, self.newer.payment_status), (100, 'paid'))
+        self.assertEqual([reason for line, reason in result.exceptions], [
+            f"100.00 not applied to fee {self.older.pk}: paid since the statement was matched",
+            f"20.00 not applied to fee {self.newer.pk}: paid since the statement was matched",
+        ])
+
+
+class CloseOutTests(TestCase):
+    def setUp(self):
+        school_class = SchoolClass.objects.create(name='Grade 1')
+        user = CustomUser.objects.create_user(username='ST001', user_type='student')
+        student = Student.objects.create(
+            user=user, student_id='ST001', school_class=school_class, roll_number='1',
+            date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+        )
+        structure = FeeStructure.objects.create(
+            school_class=school_class, fee_type='tuition', amount=100, academic_year='2024-2025',
+        )
+        self.bursar = CustomUser.objects.create_user(username='bursar', user_type='admin')
+        self.cashier = CustomUser.objects.create_user(username='cashier', user_type='admin')
+        self.day = date(2024, 5, 6)
+        paid_at = timezone.make_aware(datetime(2024, 5, 6, 10))
+        self.fees = [
+            FeeCollection.objects.create(
+                student=student, fee_structure=structure, amount_due=100, amount_paid=paid, payment_status=status,
+                payment_method=method, payment_date=paid_at + timedelta(days=offset), collected_by=collector,
+                due_date=date(2024, 5, 31),
+            )
+            for paid, status, method, collector, offset in [
+                (100, 'paid', 'cash', self.cashier, 0), (50, 'partial', 'cash', self.cashier, 0),
+                (100, 'paid', 'online', self.cashier, 0), (100, 'paid', 'cash', self.bursar, 0),
+                (100, 'paid', 'cash', self.cashier, 1),
+            ]
+        ]
+
+    def test_close_day_records_totals_per_collector_and_method(self):
+        with self.assertNumQueries(1):
+            totals = closeout.day_totals(self.day)
+        self.assertEqual(
+            [(row['collected_by__username'], row['payment_method'], row['payments'], row['amount']) for row in totals],
+            [('bursar', 'cash', 1, 100), ('cashier', 'cash', 2, 150), ('cashier', 'online', 1, 100)],
+        )
+
+        record = closeout.close_day(self.day, signed_off_by=self.bursar, cash_counted=Decimal('240.00'))
+        self.assertEqual((record.payments, record.total_amount, record.cash_expected), (4, 350, 250))
+        self.assertEqual(record.cash_variance, -10)
+        self.assertEqual(record.lines.count(), 3)
+        with self.assertRaises(ValueError):
+            closeout.close_day(self.day, signed_off_by=self.bursar)
+
+        # History comes from the stored rows, lines included
+        with self.assertNumQueries(3):
+            [stored], cursor = closeout.history()
+            self.assertEqual(sum(line.amount for line in stored.lines.all()), 350)
+        self.assertIsNone(cursor)
+
+    def test_closed_out_day_is_locked(self):
+        closeout.close_day(self.day, signed_off_by=self.bursar)
+        fee = self.fees[1]
+        fee.amount_paid = 100
+        with self.assertRaises(DayClosedOut):
+            fee.save()
+        fee.refresh_from_db()
+        fee.notes = 'Receipt reprinted'
+        fee.save()
+
+        # Payments of other days are unaffected
+        later = self.fees[4]
+        later.payment_method = 'online'
+        later.save()
+
+
+class TenancyTests(TestCase):
+    def setUp(self):
+        self.north = Campus.objects.create(name='North', code='N')
+        self.south = Campus.objects.create(name='South', code='S')
+        for campus, count in ((self.north, 2), (self.south, 1)):
+            school_class = SchoolClass.objects.create(campus=campus, name=f'Grade 1 {campus.code}')
+            for number in range(count):
+                student_id = f'{campus.code}{number}'
+                user = CustomUser.objects.create_user(username=student_id, user_type='student')
+                Student.objects.create(
+                    user=user, student_id=student_id, school_class=school_class, roll_number='1',
+                    date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+                )
+
+    def test_queries_are_scoped_to_the_current_campus(self):
+        self.assertEqual(Student.objects.count(), 3)
+        with tenancy.use_campus(self.north.id):
+            self.assertEqual(Student.objects.count(), 2)
+            self.assertEqual(set(Student.objects.values_list('campus_id', flat=True)), {self.north.id})
+            self.assertEqual(SchoolClass.objects.get().name, 'Grade 1 N')
+            with self.captureOnCommitCallbacks(execute=True):
+                expense = Expense.objects.create(category='fuel', description='Diesel', amount=100, date=date.today())
+        self.assertEqual(expense.campus_id, self.north.id)
+        with tenancy.use_campus(self.south.id):
+            self.assertFalse(Expense.objects.exists())
+
+    def test_writes_only_change_their_campus_versions(self):
+        with tenancy.use_campus(self.south.id):
+            south_before = versioning.versions('expenses')
+        with tenancy.use_campus(self.north.id):
+            with self.captureOnCommitCallbacks(execute=True):
+                Expense.objects.create(category='fuel', description='Diesel', amount=100, date=date.today())
+            north = versioning.versions('expenses')
+        with tenancy.use_campus(self.south.id):
+            self.assertEqual(versioning.versions('expenses'), south_before)
+        self.assertEqual(versioning.versions('expenses'), north)
+
+    def test_food_billing_stays_in_its_campus(self):
+        for campus in (self.north, self.south):
+            school_class = SchoolClass.objects.get(campus=campus)
+            FeeStructure.objects.create(school_class=school_class, fee_type='food', amount=0, academic_year='2024-2025')
+            service = FoodService.objects.create(campus=campus, meal_type='lunch', daily_rate=5, monthly_rate=100)
+            for student in Student.objects.filter(campus=campus):
+                FoodServiceSubscription.objects.create(
+                    student=student, food_service=service, start_date=date(2024, 1, 1), end_date=date(2024, 12, 31),
+                )
+        self.assertEqual(FoodServiceSubscription.objects.filter(campus=self.north).count(), 2)
+
+        period = (date(2024, 3, 1), date(2024, 3, 31))
+        with tenancy.use_campus(self.south.id):
+            self.assertEqual(billing.billable_subscriptions(*period).count(), 1)
+            self.assertEqual(list(billing.daily_meal_headcounts(*period)['lunch'][:1]), [(date(2024, 3, 1), 1)])
+            result = billing.generate_food_fee_collections(*period, academic_year='2024-2025')
+        self.assertEqual(result['created'], 1)
+        self.assertEqual(list(FeeCollection.objects.values_list('campus_id', 'amount_due')), [(self.south.id, 100)])
+
+
+@override_settings(THROTTLE_BUCKETS={'stats': (2, 0.01)}, THROTTLE_COSTS={'stats': 1})
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.admin = CustomUser.objects.create_user(username='admin', password='x', user_type='admin')
+
+    def get(self, path='/api/expense-category-chart/'):
+        request = self.factory.get(path)
+        request.user = self.admin
+        return views.expense_category_chart_api(request)
+
+    def test_bucket_runs_out_and_answers_429(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.get().status_code, 200)
+        response = self.get()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '100')
+        # Other users have their own buckets
+        self.assertEqual(throttling.take(self.admin.pk + 1, 'stats', 1), 0)
+
+    def test_duplicate_request_waits_for_the_running_one(self):
+        request = self.factory.get('/api/expense-category-chart/')
+        key = throttling._coalesce_key(request, self.admin.pk)
+        shared = JsonResponse({'data': 'from the first request'})
+        cache.set(key, 'run-1')
+        cache.set(f'{key}:run-1', shared)
+
+        response = throttling.coalesced(key, lambda: self.fail("computed twice"))
+        self.assertEqual(response.content, shared.content)
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.grade1 = SchoolClass.objects.create(name='Grade 1')
+        self.grade2 = SchoolClass.objects.create(name='Grade 2')
+        # (class, transport, food service)
+        for number, (school_class, transport, food) in enumerate([
+            (self.grade1, True, True), (self.grade1, True, False), (self.grade1, False, False),
+            (self.grade2, True, True), (self.grade2, False, True),
+        ]):
+            user = CustomUser.objects.create_user(
+                username=f'student{number}', first_name='Amina' if number == 0 else 'Brian', user_type='student',
+            )
+            Student.objects.create(
+                user=user, student_id=f'ST{number:03}', school_class=school_class, roll_number=str(number),
+                date_of_birth=date(2015, 1, 1), parent_name='Parent', parent_phone='0712345678',
+                is_transport_user=transport, is_food_service_user=food,
+            )
+
+    def test_unfiltered_counts(self):
+        result = facets.StudentFacets()
+        self.assertEqual(result.students.count(), 5)
+        self.assertEqual(result.counts, {
+            'total': 5,
+            'school_class': {self.grade1.id: 3, self.grade2.id: 2},
+            'transport_user': {'true': 3, 'false': 2},
+            'food_service_user': {'true': 3, 'false': 2},
+        })
+
+    def test_each_facet_counts_against_the_other_selections(self):
+        result = facets.StudentFacets({'school_class': self.grade1.id, 'transport_user': 'true'})
+        self.assertEqual(result.students.count(), 2)
+        self.assertEqual(result.counts, {
+            'total': 2,
+            # Classes counted with the transport filter only
+            'school_class': {self.grade1.id: 2, self.grade2.id: 1},
+            # Transport counted within Grade 1 only
+            'transport_user': {'true': 2, 'false': 1},
+            'food_service_user': {'true': 1, 'false': 1},
+        })
+        self.assertEqual(
+            result.class_options([self.grade1, self.grade2]), [(self.grade1, 2), (self.grade2, 1)],
+        )
+
+    def test_search_narrows_every_count_and_invalid_values_are_ignored(self):
+        result = facets.StudentFacets({'search': 'Amina', 'food_service_user': 'maybe'})
+        self.assertNotIn('food_service_user', result.selected)
+        self.assertEqual(result.counts, {
+            'total': 1,
+            'school_class': {self.grade1.id: 1},
+            'transport_user': {'true': 1, 'false': 0},
+            'food_service_user': {'true': 1, 'false': 0},
+        })
+
+    def test_counts_take_one_query(self):
+        result = facets.StudentFacets({'transport_user': 'false'})
+        with self.assertNumQueries(1):
+            result.counts
+            result.counts
+
+
+class PaginatorTests(TestCase):
+    def setUp(self):
+        for number in range(5):
+            CustomUser.objects.create_user(username=f'user{number}', user_type='teacher' if number % 2 else 'staff')
+
+    def paginator(self, queryset, exact_limit=3):
+        paginator = paginators.EstimatedCountPaginator(queryset.order_by('id'), 2)
+        paginator.exact_limit = exact_limit
+        return paginator
+
+    def test_unfiltered_lists_use_the_table_statistics(self):
+        with mock.patch.object(paginators, 'estimated_row_count', return_value=1000):
+            paginator = self.paginator(CustomUser.objects.all())
+            self.assertEqual(paginator.count, 1000)
+            self.assertEqual(paginator.num_pages, 500)
+
+    def test_small_or_unanalyzed_tables_are_counted(self):
+        # SQLite keeps no statistics; small estimates are not trusted either
+        self.assertIsNone(paginators.estimated_row_count(CustomUser))
+        self.assertEqual(self.paginator(CustomUser.objects.all()).count, 5)
+        with mock.patch.object(paginators, 'estimated_row_count', return_value=2):
+            self.assertEqual(self.paginator(CustomUser.objects.all()).count, 5)
+
+    def test_filtered_lists_stop_counting_at_the_limit(self):
+        self.assertEqual(self.paginator(CustomUser.objects.filter(user_type='teacher')).count, 2)
+        paginator = self.paginator(CustomUser.objects.filter(username__startswith='user'))
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(len(paginator.page(2)), 1)
+
+    def test_plain_lists_are_counted(self):
+        self.assertEqual(paginators.EstimatedCountPaginator(list(range(7)), 2).count, 7)
+
+
+class BenchmarkCommandTests(TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user(username='admin', password='x', user_type='admin')
+
+    def test_requests_must_be_positive(self):
+        with self.assertRaisesMessage(CommandError, "--requests must be at least 1"):
+            call_command('benchmark_request_overhead', '--username', 'admin', '--requests', '0')
+
+    @override_settings(ALLOWED_HOSTS=['localhost'])
+    def test_requests_use_an_allowed_host(self):
+        # A disallowed host would answer 400 before the URL is resolved
+        with self.assertRaisesMessage(CommandError, "returned 404"):
+            call_command('benchmark_request_overhead', '--username', 'admin', '--requests', '1', '--path', '/no-such-page/')
+
+
+class DedupTests(TestCase):
+    def add(self, student_id, first_name, last_name, phone, born=date(2015, 3, 4)):
+        school_class = SchoolClass.objects.get_or_create(name='Grade 1')[0]
+        user = CustomUser.objects.create_user(
+            username=student_id, first_name=first_name, last_name=last_name, user_type='student',
+        )
+        return Student.objects.create(
+            user=user, student_id=student_id, school_class=school_class, roll_number='1',
+            date_of_birth=born, parent_name='Parent', parent_phone=phone,
+        )
+
+    def test_keys_and_scores(self):
+        self.assertEqual(dedup.soundex('Robert'), dedup.soundex('Rupert'))
+        self.assertEqual(dedup.normalize_phone('+254 712-345-678'), dedup.normalize_phone('0712345678'))
+        original = self.add('ST001', 'John', 'Kamau', '0712345678')
+        self.add('ST002', 'Mary', 'Otieno', '0722000000', born=date(2014, 1, 1))
+
+        matches = dedup.find_matches({
+            'first_name': 'Jon', 'last_name': 'Kamau', 'date_of_birth': date(2015, 3, 4),
+            'parent_phone': '+254712345678',
+        })
+        self.assertEqual([student for value, student in matches], [original])
+        self.assertEqual(dedup.find_matches({
+            'first_name': 'Peter', 'last_name': 'Mwangi', 'date_of_birth': date(2013, 5, 6),
+            'parent_phone': '0733111222',
+        }), [])
+
+    def test_batch_scan_and_merge(self):
+        keep = self.add('ST001', 'John', 'Kamau', '0712345678')
+        duplicate = self.add('ST002', 'Jon', 'Kamau', '254712345678')
+        self.add('ST003', 'Mary', 'Otieno', '0722000000', born=date(2014, 1, 1))
+        structure = FeeStructure.objects.create(
+            school_class=keep.school_class, fee_type='tuition', amount=100, academic_year='2024-2025',
+        )
+        fee = FeeCollection.objects.create(
+            student=duplicate, fee_structure=structure, amount_due=100, due_date=date(2024, 1, 31),
+        )
+
+        pairs, skipped = dedup.find_duplicates()
+        self.assertEqual([(student.pk, other.pk) for value, student, other in pairs], [(keep.pk, duplicate.pk)])
+
+        dedup.merge(keep, duplicate)
+        fee.refresh_from_db()
+        self.assertEqual(fee.student_id, keep.pk)
+        self.assertFalse(Student.objects.filter(pk=duplicate.pk).exists())
+        self.assertFalse(CustomUser.objects.get(username='ST002').is_active)
+        self.assertEqual(SchoolClass.objects.get().enrolled_count, 2)
+        self.assertEqual(dedup.find_duplicates()[0], [])
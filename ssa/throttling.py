@@ -0,0 +1,167 @@
+# throttling.py
+# Per-user throttling of the expensive report, chart API and export views.
+# Every user has a token bucket per endpoint class, kept in the cache; a
+# request spends its endpoint's cost and is answered 429 with Retry-After
+# when the bucket is short. Buckets refill continuously. Concurrent
+# requests can occasionally spend the same tokens: the buckets guard
+# against floods, they are not exact quotas.
+#
+# Identical GET requests from one user (same path, query and campus) that
+# arrive while the first is still computing wait for its response instead
+# of running the same aggregates again. Streaming responses (the CSV
+# exports) cannot be shared, so duplicates of those run on their own.
+#
+# Apply @throttle inside @conditional_on so 304 answers cost nothing.
+import asyncio
+import hashlib
+import math
+import time
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from .tenancy import cache_suffix
+
+# Endpoint class -> (bucket capacity, tokens refilled per second)
+DEFAULT_BUCKETS = {
+    'stats': (60, 1.0),
+    'reports': (30, 0.5),
+    'exports': (30, 0.25),
+}
+# Endpoint class -> tokens one request costs
+DEFAULT_COSTS = {
+    'stats': 1,
+    'reports': 3,
+    'exports': 10,
+}
+COALESCE_WAIT = 30  # seconds a duplicate waits for the running request
+COALESCE_POLL = 0.1
+
+
+def _bucket(endpoint_class):
+    return getattr(settings, 'THROTTLE_BUCKETS', DEFAULT_BUCKETS)[endpoint_class]
+
+
+def _cost(endpoint_class):
+    return getattr(settings, 'THROTTLE_COSTS', DEFAULT_COSTS)[endpoint_class]
+
+
+def take(user_id, endpoint_class, cost):
+    """
+    Spend `cost` tokens from the user's bucket for `endpoint_class`.
+    Returns 0 when allowed, otherwise the seconds until enough tokens
+    have refilled (nothing is spent).
+    """
+    capacity, rate = _bucket(endpoint_class)
+    cost = min(cost, capacity)
+    key = f'ssa:throttle:{user_id}:{endpoint_class}'
+    now = time.time()
+    tokens, updated = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens < cost:
+        return math.ceil((cost - tokens) / rate)
+    # An expired entry is a full bucket, so keep it only until it refills
+    cache.set(key, (tokens - cost, now), math.ceil(capacity / rate))
+    return 0
+
+
+def too_many_requests(retry_after):
+    response = HttpResponse("Too many requests; try again shortly.", status=429, content_type='text/plain')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _coalesce_key(request, user_id):
+    identity = f'{user_id}|{cache_suffix()}|{request.get_full_path()}'
+    return 'ssa:coalesce:' + hashlib.sha1(identity.encode()).hexdigest()
+
+
+def _shareable(response):
+    return not response.streaming and response.status_code == 200
+
+
+def coalesced(key, compute):
+    # compute() unless an identical request is already computing; then
+    # wait for its response
+    run_id = uuid.uuid4().hex
+    if cache.add(key, run_id, COALESCE_WAIT):
+        try:
+            response = compute()
+            if _shareable(response):
+                cache.set(f'{key}:{run_id}', response, COALESCE_WAIT)
+            return response
+        finally:
+            cache.delete(key)
+
+    running = cache.get(key)
+    deadline = time.monotonic() + COALESCE_WAIT
+    while running is not None and time.monotonic() < deadline:
+        response = cache.get(f'{key}:{running}')
+        if response is not None:
+            return response
+        if cache.get(key) != running:
+            # Finished between the two reads, or without a shareable response
+            response = cache.get(f'{key}:{running}')
+            return response if response is not None else compute()
+        time.sleep(COALESCE_POLL)
+    return compute()
+
+
+async def acoalesced(key, compute):
+    # coalesced() for async views; `compute` is a coroutine function
+    run_id = uuid.uuid4().hex
+    if await cache.aadd(key, run_id, COALESCE_WAIT):
+        try:
+            response = await compute()
+            if _shareable(response):
+                await cache.aset(f'{key}:{run_id}', response, COALESCE_WAIT)
+            return response
+        finally:
+            await cache.adelete(key)
+
+    running = await cache.aget(key)
+    deadline = time.monotonic() + COALESCE_WAIT
+    while running is not None and time.monotonic() < deadline:
+        response = await cache.aget(f'{key}:{running}')
+        if response is not None:
+            return response
+        if await cache.aget(key) != running:
+            response = await cache.aget(f'{key}:{running}')
+            return response if response is not None else await compute()
+        await asyncio.sleep(COALESCE_POLL)
+    return await compute()
+
+
+def throttle(endpoint_class, cost=None):
+    """
+    View decorator charging each request `cost` tokens (by default the
+    endpoint class's configured cost) and coalescing duplicate GETs.
+    Apply inside the auth decorators.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                user = await request.auser()
+                retry_after = await sync_to_async(take)(user.pk, endpoint_class, cost or _cost(endpoint_class))
+                if retry_after:
+                    return too_many_requests(retry_after)
+                if request.method != 'GET':
+                    return await view_func(request, *args, **kwargs)
+                return await acoalesced(_coalesce_key(request, user.pk), lambda: view_func(request, *args, **kwargs))
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            retry_after = take(request.user.pk, endpoint_class, cost or _cost(endpoint_class))
+            if retry_after:
+                return too_many_requests(retry_after)
+            if request.method != 'GET':
+                return view_func(request, *args, **kwargs)
+            return coalesced(_coalesce_key(request, request.user.pk), lambda: view_func(request, *args, **kwargs))
+        return wrapper
+    return decorator
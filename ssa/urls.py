@@ -1,6 +1,7 @@
 # urls.py (app-level)
 from django.urls import path
 # from . import views
+from . import async_views
 
 app_name = 'ssa'
 
@@ -14,6 +15,7 @@ urlpatterns = [
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('teacher-dashboard/', views.teacher_dashboard, name='teacher_dashboard'),
     path('student-dashboard/', views.student_dashboard, name='student_dashboard'),
+    path('campus/switch/', views.switch_campus, name='switch_campus'),
     
     # Student Management URLs
     path('students/', views.student_list, name='student_list'),
@@ -37,6 +39,11 @@ urlpatterns = [
     path('fees/collect/<int:collection_id>/', views.collect_fee, name='collect_fee'),
     path('fees/generate/', views.generate_fees, name='generate_fees'),
     path('fees/bulk-collection/', views.bulk_fee_collection, name='bulk_fee_collection'),
+    path('fees/<int:collection_id>/receipt/', views.fee_receipt, name='fee_receipt'),
+    path('fees/statements/<int:student_id>/', views.fee_statement, name='fee_statement'),
+    path('fees/statements/generate/', views.generate_fee_statements, name='generate_fee_statements'),
+    path('fees/closeout/', views.cashier_closeout, name='cashier_closeout'),
+    path('fees/closeout/history/', views.closeout_history, name='closeout_history'),
     
     # Transport Management URLs
     path('transport/routes/', views.transport_route_list, name='transport_route_list'),
@@ -51,12 +58,14 @@ urlpatterns = [
     path('food-service/<int:service_id>/edit/', views.food_service_edit, name='food_service_edit'),
     path('food-service/subscriptions/', views.food_subscription_list, name='food_subscription_list'),
     path('food-service/subscribe/<int:student_id>/', views.subscribe_food_service, name='subscribe_food_service'),
+    path('food-service/billing/generate/', views.generate_food_billing, name='generate_food_billing'),
     
     # Expense Management URLs
     path('expenses/', views.expense_list, name='expense_list'),
     path('expenses/add/', views.expense_add, name='expense_add'),
     path('expenses/<int:expense_id>/edit/', views.expense_edit, name='expense_edit'),
     path('expenses/<int:expense_id>/delete/', views.expense_delete, name='expense_delete'),
+    path('expenses/payroll/run/', views.run_payroll, name='run_payroll'),
     
     # Class and Subject Management URLs
     path('classes/', views.school_class_list, name='school_class_list'),
@@ -72,6 +81,9 @@ urlpatterns = [
     path('reports/fee-collection/', views.fee_collection_reports, name='fee_collection_reports'),
     path('reports/transport/', views.transport_reports, name='transport_reports'),
     path('reports/food-service/', views.food_service_reports, name='food_service_reports'),
+    path('reports/service-profitability/', views.service_profitability_report, name='service_profitability_report'),
+    path('reports/receivables-aging/', views.receivables_aging, name='receivables_aging'),
+    path('reports/receivables-aging/<str:bucket>/', views.receivables_aging_detail, name='receivables_aging_detail'),
     
     # Notification URLs
     path('notifications/', views.notifications_list, name='notifications_list'),
@@ -85,12 +97,29 @@ urlpatterns = [
     path('academic-years/<int:year_id>/edit/', views.academic_year_edit, name='academic_year_edit'),
     path('academic-years/<int:year_id>/set-current/', views.set_current_year, name='set_current_year'),
     
+    # Background Job URLs
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/download/', views.job_download, name='job_download'),
+    
     # API URLs
     path('api/dashboard-stats/', views.dashboard_stats_api, name='dashboard_stats_api'),
     path('api/monthly-revenue/', views.monthly_revenue_api, name='monthly_revenue_api'),
     path('api/fee-collection-chart/', views.fee_collection_chart_api, name='fee_collection_chart_api'),
     path('api/student-class-distribution/', views.student_class_distribution_api, name='student_class_distribution_api'),
     path('api/expense-category-chart/', views.expense_category_chart_api, name='expense_category_chart_api'),
+    path('api/service-profitability/', views.service_profitability_api, name='service_profitability_api'),
+    
+    # Async API URLs (served concurrently under ASGI)
+    path('async/admin-dashboard/', async_views.admin_dashboard, name='async_admin_dashboard'),
+    path('api/async/dashboard-stats/', async_views.dashboard_stats_api, name='async_dashboard_stats_api'),
+    path('api/async/monthly-revenue/', async_views.monthly_revenue_api, name='async_monthly_revenue_api'),
+    path('api/async/fee-collection-chart/', async_views.fee_collection_chart_api, name='async_fee_collection_chart_api'),
+    path('api/async/student-class-distribution/', async_views.student_class_distribution_api, name='async_student_class_distribution_api'),
+    path('api/async/expense-category-chart/', async_views.expense_category_chart_api, name='async_expense_category_chart_api'),
+    
+    # Change feed URLs
+    path('api/sync/changes/', views.sync_changes, name='sync_changes'),
+    path('api/sync/cursor/', views.sync_cursor, name='sync_cursor'),
     
     # Export URLs
     path('export/students/', views.export_students, name='export_students'),
@@ -0,0 +1,34 @@
+# utils.py
+import re
+
+from django.db import connections, router
+
+NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_phone(phone):
+    # Compare on the last 9 digits so '+254 712 345 678', '0712345678' and
+    # '712-345-678' are the same number
+    digits = NON_DIGITS.sub('', phone or '')
+    return digits[-9:] if len(digits) >= 9 else digits
+
+
+def update_rows(model, rows, batch_size=1000):
+    # Write per-row values: `rows` are dicts of field name -> value, each
+    # with an 'id', all with the same keys. One prepared
+    # "UPDATE ... WHERE id = %s" is run with executemany; bulk_update
+    # builds a CASE expression per field per row in Python, which
+    # dominates the run time for tens of thousands of rows.
+    connection = connections[router.db_for_write(model)]
+    fields = [model._meta.get_field(name) for name in rows[0] if name != 'id']
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        connection.ops.quote_name(model._meta.db_table),
+        ', '.join(f'{connection.ops.quote_name(field.column)} = %s' for field in fields),
+        connection.ops.quote_name(model._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(row[field.name], connection) for field in fields] + [row['id']]
+                for row in rows[start:start + batch_size]
+            ])
@@ -1,15 +1,23 @@
 # views.py
+import csv
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.db.models import Sum, Count, Q
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.utils import timezone
+from django.views.decorators.http import condition
 from datetime import datetime, timedelta
 from decimal import Decimal
 from .models import *
 from .forms import StudentEditForm, FeeCollectionForm
+from . import aging, analytics, archive, billing, changelog, closeout, documents, enrollment, exports, jobs, periods, receipts, stats, tenancy
+from .facets import StudentFacets
+from .replicas import replica_reads
+from .throttling import throttle
+from .versioning import conditional_on
 
 # User type checking decorators
 def is_admin(user):
@@ -38,100 +46,51 @@ def dashboard(request):
 
 @login_required
 @user_passes_test(is_admin)
+def switch_campus(request):
+    # Admins without a campus of their own pick the campus they work in for
+    # the session; an empty choice goes back to all campuses
+    if request.method == 'POST' and request.user.campus_id is None:
+        campus_id = request.POST.get('campus')
+        if campus_id:
+            campus = get_object_or_404(Campus, pk=campus_id)
+            request.session[tenancy.SESSION_KEY] = campus.pk
+            messages.success(request, f"Now working in {campus}.")
+        else:
+            request.session.pop(tenancy.SESSION_KEY, None)
+            messages.success(request, "Now working across all campuses.")
+    
+    return redirect('admin_dashboard')
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
 def admin_dashboard(request):
     # Get current academic year
-    current_year = AcademicYear.objects.filter(is_current=True).first()
+    current_year = AcademicYear.get_current()
     
-    # Calculate totals
-    total_students = Student.objects.count()
-    total_teachers = Teacher.objects.count()
+    # Totals include archived fees (see stats.py)
+    fees = stats.fee_totals()
+    expenses = stats.expense_totals()
     
-    # Fee collection statistics
-    total_fees_due = FeeCollection.objects.aggregate(
-        total=Sum('amount_due')
-    )['total'] or 0
-    
-    total_fees_collected = FeeCollection.objects.aggregate(
-        total=Sum('amount_paid')
-    )['total'] or 0
-    
-    pending_fees = FeeCollection.objects.filter(
-        payment_status__in=['pending', 'partial']
-    ).aggregate(
-        total=Sum('amount_due') - Sum('amount_paid')
-    )
-    pending_fees = (pending_fees['total__sum'] or 0) - (pending_fees['total__sum'] or 0)
-    
-    # Transport costs
-    transport_revenue = FeeCollection.objects.filter(
-        fee_structure__fee_type='transport',
-        payment_status='paid'
-    ).aggregate(total=Sum('amount_paid'))['total'] or 0
-    
-    transport_expenses = Expense.objects.filter(
-        category__in=['fuel', 'transport_cost']
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    # Food service revenue and costs
-    food_revenue = FeeCollection.objects.filter(
-        fee_structure__fee_type='food',
-        payment_status='paid'
-    ).aggregate(total=Sum('amount_paid'))['total'] or 0
-    
-    food_expenses = Expense.objects.filter(
-        category='food_cost'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    # Total expenses
-    total_expenses = Expense.objects.aggregate(
-        total=Sum('amount')
-    )['total'] or 0
-    
-    # Net earnings calculation
-    net_earnings = total_fees_collected - total_expenses
-    
-    # Recent activities
-    recent_enrollments = Student.objects.order_by('-enrollment_date')[:5]
-    recent_payments = FeeCollection.objects.filter(
-        payment_status='paid'
-    ).order_by('-payment_date')[:5]
-    
-    # Monthly fee collection chart data
-    monthly_collections = []
-    for i in range(12):
-        month_start = timezone.now().replace(day=1, month=(timezone.now().month - i) % 12 + 1)
-        if month_start.month == 12 and i > 0:
-            month_start = month_start.replace(year=month_start.year - 1)
-        
-        month_end = (month_start + timedelta(days=31)).replace(day=1) - timedelta(days=1)
-        
-        monthly_total = FeeCollection.objects.filter(
-            payment_date__range=[month_start, month_end],
-            payment_status='paid'
-        ).aggregate(total=Sum('amount_paid'))['total'] or 0
-        
-        monthly_collections.append({
-            'month': month_start.strftime('%b %Y'),
-            'amount': float(monthly_total)
-        })
-    
-    monthly_collections.reverse()
+    # Outstanding balances by age, cached until fees change
+    aging_summary = aging.cached_summary()
     
     context = {
-        'total_students': total_students,
-        'total_teachers': total_teachers,
-        'total_fees_due': total_fees_due,
-        'total_fees_collected': total_fees_collected,
-        'pending_fees': pending_fees,
-        'transport_revenue': transport_revenue,
-        'transport_expenses': transport_expenses,
-        'food_revenue': food_revenue,
-        'food_expenses': food_expenses,
-        'total_expenses': total_expenses,
-        'net_earnings': net_earnings,
-        'recent_enrollments': recent_enrollments,
-        'recent_payments': recent_payments,
-        'monthly_collections': monthly_collections,
+        'total_students': stats.total_students(),
+        'total_teachers': stats.total_teachers(),
+        'total_fees_due': fees['total_due'],
+        'total_fees_collected': fees['total_collected'],
+        'pending_fees': aging_summary['total'],
+        'aging_summary': aging_summary,
+        'transport_revenue': fees['transport_revenue'],
+        'transport_expenses': expenses['transport'],
+        'food_revenue': fees['food_revenue'],
+        'food_expenses': expenses['food'],
+        'total_expenses': expenses['total'],
+        'net_earnings': fees['total_collected'] - expenses['total'],
+        'recent_enrollments': stats.recent_enrollments(),
+        'recent_payments': stats.recent_payments(),
+        'monthly_collections': stats.monthly_revenue(),
         'current_year': current_year,
     }
     
@@ -140,14 +99,16 @@ def admin_dashboard(request):
 @login_required
 @user_passes_test(is_teacher)
 def teacher_dashboard(request):
-    teacher = get_object_or_404(Teacher, user=request.user)
+    teacher = request.role.teacher
+    if teacher is None:
+        raise Http404("No teacher profile for this user.")
     
     # Get teacher's classes and subjects
-    my_classes = teacher.classes.all()
+    my_classes = SchoolClass.objects.filter(id__in=request.role.class_ids)
     my_subjects = teacher.subjects.all()
     
     # Get students in teacher's classes
-    my_students = Student.objects.filter(school_class__in=my_classes)
+    my_students = Student.objects.filter(school_class_id__in=request.role.class_ids)
     
     # Recent data changes made by this teacher
     recent_changes = StudentDataChange.objects.filter(
@@ -175,7 +136,9 @@ def teacher_dashboard(request):
 @login_required
 @user_passes_test(is_student)
 def student_dashboard(request):
-    student = get_object_or_404(Student, user=request.user)
+    student = request.role.student
+    if student is None:
+        raise Http404("No student profile for this user.")
     
     # Get fee information
     fee_collections = FeeCollection.objects.filter(student=student)
@@ -211,29 +174,22 @@ def student_dashboard(request):
 @login_required
 @user_passes_test(is_admin_or_teacher)
 def student_list(request):
-    students = Student.objects.select_related('user', 'school_class').all()
-    
-    # Filter by class if provided
-    class_filter = request.GET.get('class')
-    if class_filter:
-        students = students.filter(school_class__id=class_filter)
-    
-    # Search functionality
-    search = request.GET.get('search')
-    if search:
-        students = students.filter(
-            Q(user__first_name__icontains=search) |
-            Q(user__last_name__icontains=search) |
-            Q(student_id__icontains=search)
-        )
+    data = request.GET.copy()
+    if 'class' in data and 'school_class' not in data:
+        data['school_class'] = data['class']  # older links use ?class=
+    facets = StudentFacets(data)
+    students = facets.students.select_related('user', 'school_class')
     
     classes = SchoolClass.objects.all()
     
     context = {
         'students': students,
         'classes': classes,
-        'selected_class': class_filter,
-        'search_query': search,
+        'filter_form': facets.form,
+        'facet_counts': facets.counts,
+        'class_options': facets.class_options(classes),
+        'selected_class': data.get('school_class'),
+        'search_query': data.get('search'),
     }
     
     return render(request, 'student_list.html', context)
@@ -244,11 +200,9 @@ def student_edit(request, student_id):
     student = get_object_or_404(Student, id=student_id)
     
     # Check if teacher has permission to edit this student
-    if request.user.user_type == 'teacher':
-        teacher = get_object_or_404(Teacher, user=request.user)
-        if student.school_class not in teacher.classes.all():
-            messages.error(request, "You don't have permission to edit this student.")
-            return redirect('student_list')
+    if not request.role.can_edit_student(student):
+        messages.error(request, "You don't have permission to edit this student.")
+        return redirect('student_list')
     
     if request.method == 'POST':
         form = StudentEditForm(request.POST, instance=student)
@@ -258,11 +212,15 @@ def student_edit(request, student_id):
             for field in form.changed_data:
                 old_values[field] = getattr(student, field)
             
-            form.save()
+            try:
+                form.save()
+            except ClassFull:
+                form.add_error('school_class', "That class filled up while you were editing; choose another.")
+                return render(request, 'student_edit.html', {'form': form, 'student': student})
             
             # Create change records and notifications
-            if request.user.user_type == 'teacher':
-                teacher = Teacher.objects.get(user=request.user)
+            if request.role.is_teacher:
+                teacher = request.role.teacher
                 for field in form.changed_data:
                     StudentDataChange.objects.create(
                         student=student,
@@ -298,6 +256,30 @@ def student_edit(request, student_id):
     
     return render(request, 'student_edit.html', context)
 
+@login_required
+@user_passes_test(is_admin)
+def bulk_import_students(request):
+    # CSV upload with enrollment.IMPORT_COLUMNS as header; all rows or none
+    if request.method != 'POST' or 'file' not in request.FILES:
+        messages.error(request, f"Upload a CSV file with the columns: {', '.join(enrollment.IMPORT_COLUMNS)}.")
+        return redirect('student_list')
+    
+    try:
+        text = request.FILES['file'].read().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        messages.error(request, "The file is not UTF-8 encoded CSV.")
+        return redirect('student_list')
+    
+    # Problems found by the import are in the job's result
+    job = jobs.enqueue(
+        'import_students',
+        created_by=request.user,
+        csv_text=text,
+        allow_duplicates=bool(request.POST.get('allow_duplicates')),  # after reviewing the reported matches
+    )
+    messages.success(request, f"Student import queued (job #{job.id}).")
+    return redirect('student_list')
+
 # Fee Management Views
 @login_required
 @user_passes_test(is_admin)
@@ -344,6 +326,8 @@ def collect_fee(request, collection_id):
             collection = form.save(commit=False)
             collection.collected_by = request.user
             collection.payment_date = timezone.now()
+            if not collection.receipt_number:
+                collection.receipt_number = receipts.next_fee_receipt()
             
             # Update payment status
             if collection.amount_paid >= collection.amount_due:
@@ -351,7 +335,11 @@ def collect_fee(request, collection_id):
             elif collection.amount_paid > 0:
                 collection.payment_status = 'partial'
             
-            collection.save()
+            try:
+                collection.save()
+            except (DayClosedOut, PeriodClosed) as exc:
+                messages.error(request, f"{exc}; the payment was not recorded.")
+                return redirect('fee_collection_list')
             
             messages.success(request, "Fee collection recorded successfully.")
             return redirect('fee_collection_list')
@@ -365,71 +353,345 @@ def collect_fee(request, collection_id):
     
     return render(request, 'collect_fee.html', context)
 
-# Reports and Analytics
+def closeout_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else timezone.localdate()
+
 @login_required
 @user_passes_test(is_admin)
-def financial_reports(request):
-    # Get date range from request
-    start_date = request.GET.get('start_date', timezone.now().replace(day=1).date())
-    end_date = request.GET.get('end_date', timezone.now().date())
+def cashier_closeout(request):
+    if request.method == 'POST':
+        try:
+            day = closeout_day(request.POST.get('date'))
+            cash_counted = request.POST.get('cash_counted')
+            record = closeout.close_day(
+                day,
+                signed_off_by=request.user,
+                cash_counted=Decimal(cash_counted) if cash_counted else None,
+                notes=request.POST.get('notes', ''),
+            )
+        except (ValueError, ArithmeticError) as exc:
+            messages.error(request, f"Close-out not recorded: {exc}")
+            return redirect('cashier_closeout')
+        
+        messages.success(request, f"{record.day:%d %B %Y} closed out: {record.payments} payment(s), {record.total_amount}.")
+        return redirect('closeout_history')
+    
+    try:
+        day = closeout_day(request.GET.get('date'))
+    except ValueError:
+        messages.error(request, "Dates must be given as YYYY-MM-DD.")
+        return redirect('cashier_closeout')
+    
+    totals = closeout.day_totals(day)
+    context = {
+        'day': day,
+        'totals': totals,
+        'total_amount': sum(row['amount'] for row in totals),
+        'cash_expected': sum(row['amount'] for row in totals if row['payment_method'] == 'cash'),
+        'closed_out': closeout.closed_out(tenancy.current_campus_id(), day),
+    }
     
-    if isinstance(start_date, str):
-        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-    if isinstance(end_date, str):
-        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+    return render(request, 'cashier_closeout.html', context)
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+def closeout_history(request):
+    try:
+        closeouts, next_cursor = closeout.history(after=request.GET.get('after'))
+    except ValueError:
+        raise Http404("Invalid page cursor.")
+    
+    context = {
+        'closeouts': closeouts,
+        'next_cursor': next_cursor,
+    }
+    
+    return render(request, 'closeout_history.html', context)
+
+# Printable documents
+@login_required
+def fee_receipt(request, collection_id):
+    collection = get_object_or_404(FeeCollection.objects.only('id', 'student_id'), id=collection_id)
+    student = request.role.student
+    if not request.role.is_admin and (student is None or student.pk != collection.student_id):
+        raise Http404
+    
+    path = documents.receipt_path(collection.id)
+    if path is None:
+        raise Http404("No receipt has been issued for this fee.")
+    return FileResponse(open(path, 'rb'), content_type='text/html; charset=utf-8')
+
+@login_required
+def fee_statement(request, student_id):
+    student = request.role.student
+    if not request.role.is_admin and (student is None or student.pk != student_id):
+        raise Http404
+    
+    academic_year = request.GET.get('academic_year')
+    if not academic_year:
+        current_year = AcademicYear.get_current()
+        if current_year is None:
+            raise Http404("No current academic year.")
+        academic_year = current_year.year
+    
+    path = documents.statement_path(student_id, academic_year)
+    if path is None:
+        raise Http404
+    return FileResponse(open(path, 'rb'), content_type='text/html; charset=utf-8')
+
+@login_required
+@user_passes_test(is_admin)
+def generate_fee_statements(request):
+    if request.method != 'POST':
+        return redirect('fee_collection_list')
+    
+    academic_year = request.POST.get('academic_year')
+    if not academic_year:
+        current_year = AcademicYear.get_current()
+        if current_year is None:
+            messages.error(request, "Set a current academic year before generating statements.")
+            return redirect('fee_collection_list')
+        academic_year = current_year.year
+    
+    job = jobs.enqueue(
+        'render_fee_statements',
+        created_by=request.user,
+        academic_year=academic_year,
+        class_id=request.POST.get('class_id') or None,
+    )
+    
+    messages.success(request, f"Fee statements queued (job #{job.id}).")
+    return redirect('fee_collection_list')
+
+# Reports and Analytics
+def report_date_range(request):
+    start_date = request.GET.get('start_date')
+    end_date = request.GET.get('end_date')
+    start_date = datetime.strptime(start_date, '%Y-%m-%d').date() if start_date else timezone.now().replace(day=1).date()
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date() if end_date else timezone.now().date()
+    return start_date, end_date
+
+def financial_summary(start_date, end_date):
+    # Closed months come from their snapshots; only the rest of the range
+    # is aggregated from the fee and expense rows
+    closed_months, live_ranges = periods.split_range(start_date, end_date)
+    snapshot = periods.snapshot_totals(closed_months)
+    paid = dict(snapshot.get('income', {}))
+    by_category = dict(snapshot.get('expense', {}))
+    for range_start, range_end in live_ranges:
+        # Includes archived history when the range reaches it
+        for fee_type, total in archive.paid_by_fee_type(range_start, range_end).items():
+            paid[fee_type] = paid.get(fee_type, 0) + total
+        for category, total in Expense.objects.filter(
+            date__range=[range_start, range_end]
+        ).values_list('category').annotate(total=Sum('amount')).order_by():
+            by_category[category] = by_category.get(category, 0) + (total or 0)
     
     # Income summary
     income_data = {
-        'tuition_fees': FeeCollection.objects.filter(
-            payment_date__range=[start_date, end_date],
-            fee_structure__fee_type='tuition',
-            payment_status='paid'
-        ).aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0,
-        
-        'transport_fees': FeeCollection.objects.filter(
-            payment_date__range=[start_date, end_date],
-            fee_structure__fee_type='transport',
-            payment_status='paid'
-        ).aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0,
-        
-        'food_service_fees': FeeCollection.objects.filter(
-            payment_date__range=[start_date, end_date],
-            fee_structure__fee_type='food',
-            payment_status='paid'
-        ).aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0,
-        
-        'other_fees': FeeCollection.objects.filter(
-            payment_date__range=[start_date, end_date],
-            fee_structure__fee_type__in=['library', 'lab', 'other'],
-            payment_status='paid'
-        ).aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0,
+        'tuition_fees': paid.get('tuition', 0),
+        'transport_fees': paid.get('transport', 0),
+        'food_service_fees': paid.get('food', 0),
+        'other_fees': sum(paid.get(fee_type, 0) for fee_type in ['library', 'lab', 'other']),
     }
-    
     total_income = sum(income_data.values())
     
     # Expense summary
-    expense_data = {}
-    for category, label in Expense.EXPENSE_CATEGORIES:
-        expense_data[category] = Expense.objects.filter(
-            date__range=[start_date, end_date],
-            category=category
-        ).aggregate(Sum('amount'))['amount__sum'] or 0
-    
+    expense_data = {
+        category: by_category.get(category) or 0
+        for category, label in Expense.EXPENSE_CATEGORIES
+    }
     total_expenses = sum(expense_data.values())
-    net_profit = total_income - total_expenses
     
-    context = {
-        'start_date': start_date,
-        'end_date': end_date,
+    return {
         'income_data': income_data,
         'expense_data': expense_data,
         'total_income': total_income,
         'total_expenses': total_expenses,
-        'net_profit': net_profit,
+        'net_profit': total_income - total_expenses,
+    }
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@throttle('reports')
+def financial_reports(request):
+    start_date, end_date = report_date_range(request)
+    summary = financial_summary(start_date, end_date)
+    
+    context = {
+        'start_date': start_date,
+        'end_date': end_date,
+        **summary,
     }
     
     return render(request, 'financial_reports.html', context)
 
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@throttle('reports')
+def food_service_reports(request):
+    # Billing period defaults to the current month
+    month = request.GET.get('month')
+    period_day = timezone.now().date()
+    if month:
+        try:
+            period_day = datetime.strptime(month, '%Y-%m').date()
+        except ValueError:
+            messages.error(request, "Months must be given as YYYY-MM; showing the current month.")
+    period_start, period_end = billing.month_bounds(period_day)
+
+    charges_by_meal = billing.billable_subscriptions(period_start, period_end).values(
+        'food_service__meal_type'
+    ).annotate(
+        subscribers=Count('student', distinct=True),
+        total=Sum('charge')
+    ).order_by('food_service__meal_type')
+
+    context = {
+        'period_start': period_start,
+        'period_end': period_end,
+        'charges_by_meal': charges_by_meal,
+        'total_billable': sum(row['total'] or 0 for row in charges_by_meal),
+        'headcounts': billing.daily_meal_headcounts(period_start, period_end),
+        'overlapping_subscriptions': billing.overlapping_subscriptions(),
+    }
+
+    return render(request, 'food_service_reports.html', context)
+
+@login_required
+@user_passes_test(is_admin)
+def generate_food_billing(request):
+    if request.method != 'POST':
+        return redirect('food_service_reports')
+
+    month = request.POST.get('month', '')
+    try:
+        datetime.strptime(month, '%Y-%m')  # validate before queueing
+    except ValueError:
+        messages.error(request, "Choose the month to bill (YYYY-MM).")
+        return redirect('food_service_reports')
+    academic_year = request.POST.get('academic_year')
+    if not academic_year:
+        current_year = AcademicYear.get_current()
+        if current_year is None:
+            messages.error(request, "Set a current academic year before generating food billing.")
+            return redirect('food_service_reports')
+        academic_year = current_year.year
+
+    job = jobs.enqueue(
+        'generate_food_billing',
+        created_by=request.user,
+        month=month,
+        academic_year=academic_year,
+    )
+
+    messages.success(request, f"Food service billing queued (job #{job.id}).")
+    return redirect('food_service_reports')
+
+@login_required
+@user_passes_test(is_admin)
+def run_payroll(request):
+    if request.method != 'POST':
+        return redirect('expense_list')
+    
+    month = request.POST.get('month', '')
+    try:
+        datetime.strptime(month, '%Y-%m')  # validate before queueing
+    except ValueError:
+        messages.error(request, "Choose the payroll month (YYYY-MM).")
+        return redirect('expense_list')
+    job = jobs.enqueue('run_payroll', created_by=request.user, month=month)
+    
+    messages.success(request, f"Payroll for {month} queued (job #{job.id}).")
+    return redirect('expense_list')
+
+def profitability_range(request):
+    # ?start=YYYY-MM&end=YYYY-MM, by default the last twelve months
+    today = timezone.localdate()
+    end = request.GET.get('end')
+    end = datetime.strptime(end, '%Y-%m').date() if end else today.replace(day=1)
+    start = request.GET.get('start')
+    if start:
+        start = datetime.strptime(start, '%Y-%m').date()
+    else:
+        start = end
+        for _ in range(11):
+            start = (start - timedelta(days=1)).replace(day=1)
+    end = (end + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return start, end
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees', 'expenses', 'services')
+@throttle('reports')
+def service_profitability_report(request):
+    try:
+        start, end = profitability_range(request)
+    except ValueError:
+        messages.error(request, "Months must be given as YYYY-MM.")
+        return redirect('service_profitability_report')
+    
+    context = {
+        'start': start,
+        'end': end,
+        'services': [
+            (label, analytics.cached_service_profitability(service, start, end))
+            for service, label in (('transport', "Transport routes"), ('food', "Food services"))
+        ],
+    }
+    
+    return render(request, 'service_profitability.html', context)
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees')
+@throttle('reports')
+def receivables_aging(request):
+    report = aging.aging_report()
+    
+    context = {
+        'as_of': report['as_of'],
+        'buckets': [(bucket, label) for bucket, (label, fewest, most) in aging.BUCKETS.items()],
+        'rows': [(row, [(bucket, row[bucket]) for bucket in aging.BUCKETS]) for row in report['rows']],
+        'totals': [report['totals'][bucket] for bucket in aging.BUCKETS],
+        'grand_total': report['totals']['total'],
+    }
+    
+    return render(request, 'receivables_aging.html', context)
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@throttle('reports')
+def receivables_aging_detail(request, bucket):
+    if bucket not in aging.BUCKETS:
+        raise Http404("Unknown aging bucket.")
+    
+    class_id = request.GET.get('class')
+    fee_type = request.GET.get('fee_type')
+    try:
+        fees, next_cursor = aging.aging_detail(
+            bucket, class_id=class_id, fee_type=fee_type, after=request.GET.get('after'),
+        )
+    except ValueError:
+        raise Http404("Invalid page cursor.")
+    
+    context = {
+        'bucket': bucket,
+        'bucket_label': aging.BUCKETS[bucket][0],
+        'fees': fees,
+        'next_cursor': next_cursor,
+        'selected_class': class_id,
+        'selected_fee_type': fee_type,
+    }
+    
+    return render(request, 'receivables_aging_detail.html', context)
+
 # Notifications
 @login_required
 def notifications_list(request):
@@ -451,22 +713,226 @@ def mark_notification_read(request, notification_id):
     
     return JsonResponse({'status': 'success'})
 
+# Academic Year
+@login_required
+@user_passes_test(is_admin)
+def set_current_year(request, year_id):
+    year = get_object_or_404(AcademicYear, id=year_id)
+    if request.method == 'POST':
+        year.is_current = True
+        year.save()
+        messages.success(request, f"{year} is now the current academic year.")
+    return redirect('academic_year_list')
+
+# Background jobs
+@login_required
+def job_status(request, job_id):
+    job = get_object_or_404(Job, id=job_id)
+    if job.created_by_id != request.user.id and request.user.user_type != 'admin':
+        return JsonResponse({'error': 'Not found'}, status=404)
+
+    return JsonResponse({
+        'id': job.id,
+        'task': job.task,
+        'status': job.status,
+        'progress': job.progress,
+        'progress_message': job.progress_message,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error.strip().splitlines()[-1] if job.error else '',
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    })
+
+def export_finished_at(request, job_id):
+    # An export file never changes once written, so its job's finish time
+    # serves as Last-Modified and ETag; looked up once per request
+    if not hasattr(request, '_ssa_export_finished_at'):
+        request._ssa_export_finished_at = Job.objects.filter(
+            id=job_id, task='export_csv', status='succeeded',
+        ).values_list('finished_at', flat=True).first()
+    return request._ssa_export_finished_at
+
+def export_etag(request, job_id):
+    finished_at = export_finished_at(request, job_id)
+    return f"export-{job_id}-{finished_at.timestamp()}" if finished_at else None
+
+@login_required
+@user_passes_test(is_admin)
+@condition(etag_func=export_etag, last_modified_func=export_finished_at)
+def job_download(request, job_id):
+    # The file written by a finished export job
+    job = get_object_or_404(Job, id=job_id, task='export_csv', status='succeeded')
+    path = exports.export_path(job.result['file'])
+    if path is None:
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=job.result['file'].split('-', 1)[1])
+
 # API Views for AJAX requests
 @login_required
 @user_passes_test(is_admin)
+@replica_reads
+@throttle('stats')
 def dashboard_stats_api(request):
-    stats = {
-        'total_students': Student.objects.count(),
-        'total_teachers': Teacher.objects.count(),
-        'pending_fees': float(FeeCollection.objects.filter(
-            payment_status__in=['pending', 'partial']
-        ).aggregate(
-            total=Sum('amount_due') - Sum('amount_paid')
-        )['total'] or 0),
-        'monthly_revenue': float(FeeCollection.objects.filter(
-            payment_date__month=timezone.now().month,
-            payment_status='paid'
-        ).aggregate(Sum('amount_paid'))['amount_paid__sum'] or 0)
+    stats_data = {
+        'total_students': stats.total_students(),
+        'total_teachers': stats.total_teachers(),
+        'pending_fees': float(stats.pending_fees()),
+        'monthly_revenue': float(stats.current_month_revenue()),
     }
     
-    return JsonResponse(stats)
\ No newline at end of file
+    return JsonResponse(stats_data)
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees')
+@throttle('stats')
+def monthly_revenue_api(request):
+    try:
+        months = max(1, min(int(request.GET.get('months', 12)), 60))
+    except ValueError:
+        return JsonResponse({'error': 'months must be an integer'}, status=400)
+    return JsonResponse({'data': stats.monthly_revenue(months)})
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees')
+@throttle('stats')
+def fee_collection_chart_api(request):
+    return JsonResponse({'data': stats.fee_collection_by_status()})
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('students')
+@throttle('stats')
+def student_class_distribution_api(request):
+    return JsonResponse({'data': stats.student_class_distribution()})
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('expenses')
+@throttle('stats')
+def expense_category_chart_api(request):
+    return JsonResponse({'data': stats.expense_by_category()})
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees', 'expenses', 'services')
+@throttle('reports')
+def service_profitability_api(request):
+    service = request.GET.get('service', 'transport')
+    if service not in analytics.SERVICE_LINES:
+        return JsonResponse({'error': "service must be 'transport' or 'food'"}, status=400)
+    try:
+        start, end = profitability_range(request)
+    except ValueError:
+        return JsonResponse({'error': "start and end must be YYYY-MM"}, status=400)
+    
+    result = analytics.cached_service_profitability(service, start, end)
+    return JsonResponse({
+        'service': service,
+        'start': start.strftime('%Y-%m'),
+        'end': end.strftime('%Y-%m'),
+        'rows': [{**row, 'month': row['month'].strftime('%Y-%m')} for row in result['rows']],
+        'unallocated_cost': result['unallocated_cost'],
+    })
+
+# Change feed for external accounting. Served from the primary database:
+# a lagging replica could hide entries below the cursor it hands out.
+@login_required
+@user_passes_test(is_admin)
+def sync_changes(request):
+    try:
+        limit = int(request.GET.get('limit', 500))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    feeds = [feed for feed in request.GET.get('models', '').split(',') if feed]
+    unknown = set(feeds) - set(changelog.FEEDS)
+    if unknown:
+        return JsonResponse({'error': f"Unknown models: {', '.join(sorted(unknown))}"}, status=400)
+    
+    try:
+        changes, next_cursor, has_more = changelog.changes_since(request.GET.get('cursor'), limit, feeds)
+    except changelog.InvalidCursor as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    
+    return JsonResponse({
+        'changes': changes,
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+    })
+
+@login_required
+@user_passes_test(is_admin)
+def sync_cursor(request):
+    return JsonResponse({'cursor': changelog.head_cursor()})
+
+# Export Views
+class Echo:
+    # Pseudo-buffer for streaming csv.writer output
+    def write(self, value):
+        return value
+
+def csv_response(filename, header, rows):
+    writer = csv.writer(Echo())
+    lines = (writer.writerow(row) for row in _with_header(header, rows))
+    response = StreamingHttpResponse(lines, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def _with_header(header, rows):
+    yield header
+    yield from rows
+
+def queue_export(request, name, redirect_to):
+    # Table exports are written by a background job and downloaded from
+    # the job once finished (see exports.py)
+    job = jobs.enqueue('export_csv', created_by=request.user, name=name)
+    messages.success(
+        request,
+        f"Export queued (job #{job.id}). Download it from {reverse('job_download', args=[job.id])} once it has finished.",
+    )
+    return redirect(redirect_to)
+
+@login_required
+@user_passes_test(is_admin)
+@throttle('exports')
+def export_students(request):
+    return queue_export(request, 'students', 'student_list')
+
+@login_required
+@user_passes_test(is_admin)
+@throttle('exports')
+def export_fee_collections(request):
+    return queue_export(request, 'fee_collections', 'fee_collection_list')
+
+@login_required
+@user_passes_test(is_admin)
+@throttle('exports')
+def export_expenses(request):
+    return queue_export(request, 'expenses', 'expense_list')
+
+@login_required
+@user_passes_test(is_admin)
+@replica_reads
+@conditional_on('fees', 'expenses')
+@throttle('exports')
+def export_financial_report(request):
+    start_date, end_date = report_date_range(request)
+    summary = financial_summary(start_date, end_date)
+    
+    rows = [('Period', f"{start_date} to {end_date}", '')]
+    rows += [('Income', name, amount) for name, amount in summary['income_data'].items()]
+    rows += [('Expense', name, amount) for name, amount in summary['expense_data'].items()]
+    rows += [
+        ('Total Income', '', summary['total_income']),
+        ('Total Expenses', '', summary['total_expenses']),
+        ('Net Profit', '', summary['net_profit']),
+    ]
+    
+    return csv_response(f'financial_report_{start_date}_{end_date}.csv', ['Section', 'Item', 'Amount'], rows)